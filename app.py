@@ -1,268 +1,136 @@
-from flask import Flask, render_template_string, request
+import time
+
+# Start of the startup timing report (see STARTUP_REPORT)
+startup_started = time.perf_counter()
+
+import base64
+import gzip
+import hashlib
+import json
+import os
+import sys
+from collections import namedtuple
+
+from flask import (Flask, Response, abort, g, jsonify, render_template, request, send_from_directory,
+                   stream_template)
+
+from engine import (DEFAULT_CATALOGUE_PATH, CatalogueStore, LikelihoodTable, LivestockHealthAdvisor,
+                    OutbreakMonitor, ResultCache, RuleBasedAdvisor, load_rules)
+from images import ImagePipeline
+from metrics import Instrumentation, LogSink, PrometheusSink, format_labels
+from static_assets import StaticAssets
+
+try:
+    import brotli
+except ImportError:  # optional: landing page is still served gzip-compressed
+    brotli = None
+
+# Seconds spent in each startup phase: module imports, catalogue load (decode
+# of the compiled file, or compile on a cache miss), index build and the
+# pre-rendered pages; catalogue_cache tells whether the compiled file was reused
+startup_timings = {'imports': time.perf_counter() - startup_started}
 
 app = Flask(__name__)
 
-# Database of diseases and remedies
-disease_database = {
-    'cattle': [
-        {
-            'id': 1,
-            'name': "Bovine Respiratory Disease (BRD)",
-            'symptoms': ["coughing", "nasal discharge", "fever", "reduced appetite", "labored breathing"],
-            'description': "A complex of diseases affecting the lungs and respiratory tract of cattle.",
-            'severity': "High",
-            'treatments': [
-                {
-                    'type': "Medication",
-                    'details': "Antibiotics like florfenicol, tulathromycin, or tilmicosin as prescribed by a veterinarian."
-                },
-                {
-                    'type': "Management",
-                    'details': "Provide good ventilation, reduce stress, isolate affected animals."
-                },
-                {
-                    'type': "Prevention",
-                    'details': "Vaccination against viral pathogens, proper nutrition, and stress management."
-                }
-            ]
-        },
-        {
-            'id': 2,
-            'name': "Foot and Mouth Disease",
-            'symptoms': ["fever", "blisters on mouth", "blisters on feet", "excessive salivation", "lameness"],
-            'description': "A highly contagious viral disease affecting cloven-hoofed animals.",
-            'severity': "Critical - Reportable Disease",
-            'treatments': [
-                {
-                    'type': "Action Required",
-                    'details': "Contact veterinary authorities immediately. This is a notifiable disease."
-                },
-                {
-                    'type': "Management",
-                    'details': "Quarantine affected animals, implement biosecurity measures."
-                },
-                {
-                    'type': "Treatment",
-                    'details': "Supportive care only. Treatment focuses on pain management and preventing secondary infections."
-                }
-            ]
-        },
-        {
-            'id': 3,
-            'name': "Mastitis",
-            'symptoms': ["swollen udder", "abnormal milk", "pain in udder", "reduced milk production", "fever"],
-            'description': "Inflammation of the mammary gland usually caused by bacterial infection.",
-            'severity': "Moderate to High",
-            'treatments': [
-                {
-                    'type': "Medication",
-                    'details': "Intramammary antibiotics, systemic antibiotics for severe cases as prescribed by vet."
-                },
-                {
-                    'type': "Supportive Care",
-                    'details': "Frequent milking, cold or warm compresses, anti-inflammatory drugs."
-                },
-                {
-                    'type': "Prevention",
-                    'details': "Good milking hygiene, proper housing, teat dipping after milking."
-                }
-            ]
-        }
-    ],
-    'goat': [
-        {
-            'id': 1,
-            'name': "Caprine Arthritis Encephalitis (CAE)",
-            'symptoms': ["joint swelling", "lameness", "weight loss", "pneumonia", "neurological symptoms"],
-            'description': "A viral disease affecting goats that causes chronic progressive arthritis and encephalitis.",
-            'severity': "High - No Cure",
-            'treatments': [
-                {
-                    'type': "Management",
-                    'details': "No specific treatment. Manage pain with anti-inflammatory drugs prescribed by a vet."
-                },
-                {
-                    'type': "Prevention",
-                    'details': "Testing and culling, separating kids from infected dams at birth."
-                },
-                {
-                    'type': "Supportive Care",
-                    'details': "Provide comfortable bedding, easy access to food and water."
-                }
-            ]
-        },
-        {
-            'id': 2,
-            'name': "Enterotoxemia (Overeating Disease)",
-            'symptoms': ["sudden death", "abdominal pain", "diarrhea", "convulsions", "bloating"],
-            'description': "Caused by Clostridium perfringens bacteria that produce toxins in the intestine.",
-            'severity': "Critical",
-            'treatments': [
-                {
-                    'type': "Medication",
-                    'details': "Antitoxin, antibiotics, anti-inflammatories as prescribed by vet."
-                },
-                {
-                    'type': "Supportive Care",
-                    'details': "Oral electrolytes, IV fluids, reduce feed intake temporarily."
-                },
-                {
-                    'type': "Prevention",
-                    'details': "Vaccination, gradual diet changes, avoid overfeeding grain."
-                }
-            ]
-        },
-        {
-            'id': 3,
-            'name': "Coccidiosis",
-            'symptoms': ["diarrhea", "weight loss", "dehydration", "weakness", "bloody stool"],
-            'description': "A parasitic disease caused by protozoa affecting the intestinal tract.",
-            'severity': "Moderate",
-            'treatments': [
-                {
-                    'type': "Medication",
-                    'details': "Sulfa drugs, amprolium, or other coccidiostats as prescribed by a vet."
-                },
-                {
-                    'type': "Supportive Care",
-                    'details': "Fluids to prevent dehydration, electrolytes, good nutrition."
-                },
-                {
-                    'type': "Prevention",
-                    'details': "Clean housing, prevent overcrowding, good sanitation, coccidiostats in feed for prevention."
-                }
-            ]
-        }
-    ]
-}
-
-# Common symptoms for each animal type
-symptoms = {
-    'cattle': [
-        "coughing", "nasal discharge", "fever", "reduced appetite", "labored breathing", 
-        "swollen udder", "abnormal milk", "pain in udder", "reduced milk production",
-        "blisters on mouth", "blisters on feet", "excessive salivation", "lameness",
-        "diarrhea", "weight loss", "dehydration", "weakness", "bloody stool"
-    ],
-    'goat': [
-        "joint swelling", "lameness", "weight loss", "pneumonia", "neurological symptoms",
-        "sudden death", "abdominal pain", "diarrhea", "convulsions", "bloating",
-        "dehydration", "weakness", "bloody stool", "fever", "coughing", "reduced appetite"
-    ]
-}
-
-# Rule-based disease diagnostic system
-class LivestockHealthAdvisor:
-    def __init__(self):
-        self.disease_database = disease_database
-        self.symptoms = symptoms
-        
-    # Rule 1: Filter diseases based on selected symptoms
-    def filter_by_symptoms(self, animal_type, selected_symptoms):
-        if not selected_symptoms:
-            return self.disease_database[animal_type]
-            
-        filtered_diseases = []
-        for disease in self.disease_database[animal_type]:
-            # Check if any selected symptom matches the disease
-            if any(symptom in disease['symptoms'] for symptom in selected_symptoms):
-                filtered_diseases.append(disease)
-        
-        return filtered_diseases
-    
-    # Rule 2: Sort diseases by symptom match count (highest first)
-    def sort_by_match_count(self, diseases, selected_symptoms):
-        if not selected_symptoms:
-            return diseases
-            
-        # Count matching symptoms for each disease and sort
-        return sorted(
-            diseases,
-            key=lambda disease: sum(1 for s in selected_symptoms if s in disease['symptoms']),
-            reverse=True
-        )
-    
-    # Rule 3: Filter by search text in name, description, or symptoms
-    def filter_by_search_text(self, diseases, search_text):
-        if not search_text:
-            return diseases
-            
-        filtered_diseases = []
-        search_text = search_text.lower()
-        
-        for disease in diseases:
-            # Check if text is in disease name
-            if search_text in disease['name'].lower():
-                filtered_diseases.append(disease)
-                continue
-                
-            # Check if text is in description
-            if search_text in disease['description'].lower():
-                filtered_diseases.append(disease)
-                continue
-                
-            # Check if text is in any symptom
-            if any(search_text in symptom for symptom in disease['symptoms']):
-                filtered_diseases.append(disease)
-                continue
-                
-        return filtered_diseases
-    
-    # Rule 4: Identify critical conditions that require immediate veterinary attention
-    def flag_critical_conditions(self, diseases):
-        for disease in diseases:
-            if "Critical" in disease['severity']:
-                disease['urgent'] = True
-            else:
-                disease['urgent'] = False
-        return diseases
-    
-    # Rule 5: Calculate symptom coverage percentage
-    def calculate_symptom_coverage(self, diseases, selected_symptoms):
-        if not selected_symptoms:
-            for disease in diseases:
-                disease['symptom_coverage'] = 0
-            return diseases
-            
-        for disease in diseases:
-            matching_symptoms = [s for s in selected_symptoms if s in disease['symptoms']]
-            disease['matching_symptoms'] = matching_symptoms
-            disease['symptom_coverage'] = len(matching_symptoms) / len(selected_symptoms) * 100
-            
-        return diseases
-    
-    # Rule 6: Apply severity rating score
-    def apply_severity_rating(self, diseases):
-        severity_score = {
-            "Low": 1,
-            "Moderate": 2,
-            "Moderate to High": 3,
-            "High": 4,
-            "Critical": 5,
-            "Critical - Reportable Disease": 5
-        }
-        
-        for disease in diseases:
-            # Extract base severity without additional text
-            base_severity = disease['severity'].split(' - ')[0] if ' - ' in disease['severity'] else disease['severity']
-            disease['severity_score'] = severity_score.get(base_severity, 0)
-            
-        return diseases
-    
-    # Main search method that applies all rules
-    def search_diseases(self, animal_type, selected_symptoms, search_text):
-        # Apply rules in sequence
-        results = self.filter_by_symptoms(animal_type, selected_symptoms)
-        results = self.sort_by_match_count(results, selected_symptoms)
-        results = self.filter_by_search_text(results, search_text)
-        results = self.flag_critical_conditions(results)
-        results = self.calculate_symptom_coverage(results, selected_symptoms)
-        results = self.apply_severity_rating(results)
-        
-        return results
+# Disease catalogue source file, recompiled and reloaded when it changes
+# (seconds between checks; 0 disables hot reload)
+app.config.setdefault('CATALOGUE_PATH', os.environ.get('LIVESTOCK_CATALOGUE', DEFAULT_CATALOGUE_PATH))
+app.config.setdefault('CATALOGUE_RELOAD_INTERVAL', 2.0)
+
+# Maximum number of cases accepted by one /api/v1/diagnose request
+app.config.setdefault('DIAGNOSE_MAX_BATCH', 1000)
+# Stream the /search results page while it renders instead of buffering it
+app.config.setdefault('STREAM_RESULTS', False)
+# Disease cards per /search page; further pages are lazy-loaded as HTML
+# fragments (0 shows every match on one page)
+app.config.setdefault('RESULTS_PAGE_SIZE', 20)
+# Bounded LRU cache of search results and rendered result pages
+# (entries, and seconds before an entry expires; None keeps it until evicted)
+app.config.setdefault('RESULT_CACHE_SIZE', 1024)
+app.config.setdefault('RESULT_CACHE_TTL', None)
+# Free-text search: 'index' (tokenized, prefix-aware) or 'substring' (legacy scan)
+app.config.setdefault('SEARCH_MODE', 'index')
+# Symptom scoring engine for rules 1 and 2: 'bitset' (pure Python) or
+# 'numpy' (sparse matrix products; requires numpy)
+app.config.setdefault('ENGINE', 'bitset')
+# JSON rule set (see engine/rules.py) evaluated as a rule network in place of
+# the built-in rules; None keeps the built-in pipeline
+app.config.setdefault('RULES_PATH', None)
+# Per-rule/per-request timing: histograms on /metrics, and/or one JSON log
+# line per request. Both off by default.
+app.config.setdefault('METRICS_ENABLED', False)
+app.config.setdefault('METRICS_LOG', False)
+# How many candidate diseases each step of a guided interview returns
+app.config.setdefault('INTERVIEW_RESULTS', 10)
+# Outbreak surveillance (see engine/surveillance.py): leading diagnoses of
+# symptom searches counted per disease, species and region in time buckets,
+# over a sliding window and a history it is compared against (seconds), with
+# an alert for a reportable disease reaching ALERT_COUNT cases in the window
+# and ALERT_RATIO times its usual rate. Events beyond QUEUE_SIZE waiting to
+# be counted are dropped rather than slowing requests down. The counts are
+# kept in the SQLite file SURVEILLANCE_PATH, shared by every worker process
+# of the deployment (None keeps them in this process's memory).
+app.config.setdefault('SURVEILLANCE_ENABLED', True)
+app.config.setdefault('SURVEILLANCE_PATH', os.path.join(os.path.dirname(DEFAULT_CATALOGUE_PATH),
+                                                        'surveillance.sqlite3'))
+app.config.setdefault('SURVEILLANCE_BUCKET_SECONDS', 300)
+app.config.setdefault('SURVEILLANCE_WINDOW', 3600)
+app.config.setdefault('SURVEILLANCE_HISTORY', 86400)
+app.config.setdefault('SURVEILLANCE_MAX_SERIES', 10000)
+app.config.setdefault('SURVEILLANCE_QUEUE_SIZE', 10000)
+app.config.setdefault('SURVEILLANCE_ALERT_COUNT', 5)
+app.config.setdefault('SURVEILLANCE_ALERT_RATIO', 3.0)
+# Static images up to STATIC_MEMORY_MAX_SIZE bytes are served from memory,
+# using at most STATIC_MEMORY_BUDGET bytes in total (0 disables)
+app.config.setdefault('STATIC_MEMORY_MAX_SIZE', 65536)
+app.config.setdefault('STATIC_MEMORY_BUDGET', 16 * 1024 * 1024)
+# Print the startup timing report to stderr once the app is loaded
+app.config.setdefault('STARTUP_REPORT', False)
 
-# Initialize our health advisor
-health_advisor = LivestockHealthAdvisor()
+# Any setting above can be overridden with a LIVESTOCK_<NAME> environment
+# variable (values are parsed as JSON, e.g. LIVESTOCK_METRICS_ENABLED=true)
+app.config.from_prefixed_env('LIVESTOCK')
+
+# Load the catalogue and initialize our health advisor
+catalogue_store = CatalogueStore(app.config['CATALOGUE_PATH'])
+phase_started = time.perf_counter()
+catalogue_data = catalogue_store.load()
+startup_timings['catalogue_load'] = time.perf_counter() - phase_started
+startup_timings['catalogue_cache'] = catalogue_store.last_load
+phase_started = time.perf_counter()
+advisor_options = dict(
+    cache_size=app.config['RESULT_CACHE_SIZE'],
+    cache_ttl=app.config['RESULT_CACHE_TTL'],
+    search_mode=app.config['SEARCH_MODE'],
+    engine=app.config['ENGINE']
+)
+if app.config['RULES_PATH']:
+    health_advisor = RuleBasedAdvisor(*catalogue_data, rules=load_rules(app.config['RULES_PATH']),
+                                      **advisor_options)
+else:
+    health_advisor = LivestockHealthAdvisor(*catalogue_data, **advisor_options)
+startup_timings['index_build'] = time.perf_counter() - phase_started
+del catalogue_data
+catalogue_store.watch(health_advisor, app.config['CATALOGUE_RELOAD_INTERVAL'])
+
+# Optional instrumentation sinks
+prometheus_sink = PrometheusSink() if app.config['METRICS_ENABLED'] else None
+metric_sinks = [sink for sink in (prometheus_sink, LogSink() if app.config['METRICS_LOG'] else None) if sink]
+instrumentation = Instrumentation(metric_sinks) if metric_sinks else None
+health_advisor.instrumentation = instrumentation
+
+surveillance = None
+if app.config['SURVEILLANCE_ENABLED']:
+    surveillance = OutbreakMonitor(
+        bucket_seconds=app.config['SURVEILLANCE_BUCKET_SECONDS'],
+        window_seconds=app.config['SURVEILLANCE_WINDOW'],
+        history_seconds=app.config['SURVEILLANCE_HISTORY'],
+        max_series=app.config['SURVEILLANCE_MAX_SERIES'],
+        queue_size=app.config['SURVEILLANCE_QUEUE_SIZE'],
+        alert_count=app.config['SURVEILLANCE_ALERT_COUNT'],
+        alert_ratio=app.config['SURVEILLANCE_ALERT_RATIO'],
+        path=app.config['SURVEILLANCE_PATH']
+    )
 
 # HTML Templates as strings
 
@@ -322,6 +190,10 @@ INDEX_TEMPLATE = '''
             padding: 10px;
             font-size: 1em;
         }
+        .search-box input.region-input {
+            flex-grow: 0;
+            width: 10em;
+        }
         .search-box button {
             padding: 10px 20px;
             background-color: #007bff;
@@ -402,12 +274,12 @@ INDEX_TEMPLATE = '''
             <form action="/search" method="post" class="search-section">
                 <div class="animal-selector">
                     <div class="animal-type {% if animal_type == 'cattle' or not animal_type %}active{% endif %}" id="cattle-selector">
-                        <img src="/static/images/livestock-1822698_1280.jpg" alt="Cattle">
+                        {{ responsive_image('livestock-1822698_1280.jpg', 'Cattle', '100px') }}
                         <span>Cattle</span>
                         <input type="radio" name="animal_type" value="cattle" {% if animal_type == 'cattle' or not animal_type %}checked{% endif %} style="display: none;">
                     </div>
                     <div class="animal-type {% if animal_type == 'goat' %}active{% endif %}" id="goat-selector">
-                        <img src="/static/images/irish-goat-7429437_1280.jpg" alt="Goat">
+                        {{ responsive_image('irish-goat-7429437_1280.jpg', 'Goat', '100px') }}
                         <span>Goat</span>
                         <input type="radio" name="animal_type" value="goat" {% if animal_type == 'goat' %}checked{% endif %} style="display: none;">
                     </div>
@@ -415,6 +287,11 @@ INDEX_TEMPLATE = '''
                 
                 <div class="search-box">
                     <input type="text" id="search-input" name="search_text" placeholder="Search symptoms or diseases...">
+                    <input type="text" class="region-input" name="region" placeholder="Region (optional)" aria-label="Region">
+                    <select name="ranking" aria-label="Rank results by">
+                        <option value="count">Rank by matching symptoms</option>
+                        <option value="likelihood">Rank by likelihood</option>
+                    </select>
                     <button type="submit">Find Remedies</button>
                 </div>
                 
@@ -440,6 +317,8 @@ INDEX_TEMPLATE = '''
                 </div>
             </form>
             
+            <p class="interview-link">Not sure which symptoms to tick? <a href="/interview">Answer one question at a time</a>.</p>
+            
             <div class="emergency-banner">
                 <strong>Important:</strong> In case of severe symptoms or emergency, contact a veterinarian immediately.
             </div>
@@ -609,9 +488,18 @@ RESULTS_TEMPLATE = '''
                 </p>
                 {% endif %}
                 
+                {% if total > results|length %}
+                <p class="result-count">{{ total }} matching conditions</p>
+                {% endif %}
+                
                 <div id="disease-results">
+                    {% block cards %}
                     {% if results|length == 0 %}
+                        {% if total %}
+                        <p>No more results.</p>
+                        {% else %}
                         <p>No matching conditions found. Try selecting different symptoms or consult a veterinarian.</p>
+                        {% endif %}
                     {% else %}
                         {% for disease in results %}
                             <div class="disease-card">
@@ -643,10 +531,15 @@ RESULTS_TEMPLATE = '''
                                         <strong>Symptom match:</strong> {{ disease.symptom_coverage|round(1) }}% ({{ disease.matching_symptoms|length }} of {{ selected_symptoms|length }} symptoms)
                                     </p>
                                 {% endif %}
+                                {% if disease.probability is not none %}
+                                    <p class="symptom-coverage">
+                                        <strong>Estimated likelihood:</strong> {{ (disease.probability * 100)|round(1) }}%
+                                    </p>
+                                {% endif %}
                                 
                                 <div class="disease-details">
                                     <div class="disease-image">
-                                        <img src="/static/images/shutterstock_1571593363-scaled.jpg" alt="{{ disease.name }}">
+                                        {{ responsive_image('shutterstock_1571593363-scaled.jpg', disease.name, '150px') }}
                                     </div>
                                     <div class="disease-info">
                                         <div class="treatment-section">
@@ -662,7 +555,20 @@ RESULTS_TEMPLATE = '''
                                 </div>
                             </div>
                         {% endfor %}
+                        {% if next_offset is not none %}
+                            <form method="post" action="/search" class="load-more">
+                                <input type="hidden" name="animal_type" value="{{ animal_type }}">
+                                {% for symptom in selected_symptoms %}
+                                <input type="hidden" name="symptoms" value="{{ symptom }}">
+                                {% endfor %}
+                                <input type="hidden" name="search_text" value="{{ search_text }}">
+                                <input type="hidden" name="ranking" value="{{ ranking }}">
+                                <input type="hidden" name="offset" value="{{ next_offset }}">
+                                <button type="submit" class="back-button">Show more results</button>
+                            </form>
+                        {% endif %}
                     {% endif %}
+                    {% endblock %}
                 </div>
             </div>
         </div>
@@ -672,46 +578,553 @@ RESULTS_TEMPLATE = '''
             <p>&copy; 2025 Livestock Health Advisor</p>
         </footer>
     </div>
+    <script>
+        // Load further result pages in place; without JavaScript the form
+        // simply opens the next page
+        document.addEventListener('submit', function(event) {
+            var form = event.target;
+            if (!form.classList.contains('load-more') || !window.fetch) return;
+            event.preventDefault();
+            var data = new URLSearchParams(new FormData(form));
+            data.set('fragment', '1');
+            form.querySelector('button').disabled = true;
+            fetch(form.action, { method: 'POST', body: data })
+                .then(function(response) {
+                    if (!response.ok) throw new Error('HTTP ' + response.status);
+                    return response.text();
+                })
+                .then(function(html) {
+                    form.insertAdjacentHTML('afterend', html);
+                    form.remove();
+                })
+                .catch(function() { form.submit(); });
+        });
+    </script>
 </body>
 </html>
 '''
 
+# Resized WebP/JPEG variants of static/images, rebuilt when a source image
+# changes. Templates reference images through responsive_image().
+image_pipeline = ImagePipeline(os.path.join(app.root_path, 'static', 'images'))
+image_pipeline.load_or_build()
+app.jinja_env.globals['responsive_image'] = image_pipeline.responsive_image
+image_assets = StaticAssets(image_pipeline.source_dir, app.config['STATIC_MEMORY_MAX_SIZE'],
+                            app.config['STATIC_MEMORY_BUDGET'])
+image_assets.scan()
+
+# Compile both templates once at startup; render_template_string would
+# re-parse the full template source on every request
+index_template = app.jinja_env.from_string(INDEX_TEMPLATE)
+results_template = app.jinja_env.from_string(RESULTS_TEMPLATE)
+
+# Bodies that only change with the catalogue are rendered and compressed
+# once per catalogue load rather than once per request
+Precompressed = namedtuple('Precompressed', ['etag', 'encodings'])
+
+def precompress(body):
+    etag = hashlib.sha256(body).hexdigest()[:32]
+    # Each encoding is a separate representation with its own strong ETag
+    encodings = {'identity': (etag, body), 'gzip': (etag + '-gz', gzip.compress(body, 9, mtime=0))}
+    if brotli is not None:
+        encodings['br'] = (etag + '-br', brotli.compress(body))
+    return Precompressed(etag, encodings)
+
+# Pick the best encoding the client accepts; answers If-None-Match with a 304
+def precompressed_response(precompressed, mimetype):
+    encoding = 'identity'
+    for candidate in ('br', 'gzip'):
+        if candidate in precompressed.encodings and request.accept_encodings[candidate]:
+            encoding = candidate
+            break
+    etag, body = precompressed.encodings[encoding]
+
+    response = Response(body, mimetype=mimetype)
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.no_cache = True
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+def build_landing_page(catalogue):
+    return precompress(index_template.render(
+        cattle_symptoms=catalogue.symptoms['cattle'],
+        goat_symptoms=catalogue.symptoms['goat'],
+        animal_type='cattle'
+    ).encode('utf-8'))
+
+# Compact catalogue for client-side diagnosis (static/js/diagnosis.js).
+# Per animal: the symptom vocabulary in bit order (the first `listed` entries
+# are the checkbox list), diseases as arrays with symptoms given as vocabulary
+# positions, the symptom -> disease index and the text index as sorted tokens
+# with flat [disease position, weight, ...] postings, and the symptom
+# normalizer's table as [key, vocabulary position] pairs: every vocabulary
+# entry and synonym, in the order whose first match wins a typo lookup. The
+# client runs the same rules on it, so repeat diagnoses need no round trip.
+CATALOGUE_BUNDLE_FORMAT = 2
+
+def build_catalogue_bundle(catalogue, search_mode):
+    animals = {}
+    for animal_type, diseases in catalogue.diseases.items():
+        vocabulary = list(catalogue.symptom_bits[animal_type])
+        column = {symptom: position for position, symptom in enumerate(vocabulary)}
+        symptom_index = [[] for _ in vocabulary]
+        for position, disease in enumerate(diseases):
+            for symptom in disease.symptoms:
+                symptom_index[column[symptom]].append(position)
+
+        text_index = catalogue.text_index[animal_type]
+        normalizer = catalogue.normalizers[animal_type]
+        animals[animal_type] = {
+            'symptoms': vocabulary,
+            'listed': len(catalogue.symptoms[animal_type]),
+            'diseases': [
+                [disease.id, disease.name, disease.description, disease.severity,
+                 [column[symptom] for symptom in disease.symptoms],
+                 [[treatment.type, treatment.details] for treatment in disease.treatments],
+                 disease.urgent, disease.severity_score]
+                for disease in diseases
+            ],
+            'symptom_index': symptom_index,
+            'tokens': text_index.tokens,
+            'postings': text_index.flat_postings(diseases),
+            'symptom_keys': [[key, column[symptom]] for key, symptom in normalizer.exact.items()],
+        }
+
+    bundle = {
+        'format': CATALOGUE_BUNDLE_FORMAT,
+        'search_mode': search_mode,
+        'likelihood': {'listed': LikelihoodTable.LISTED, 'unlisted': LikelihoodTable.UNLISTED},
+        'animals': animals,
+    }
+    return precompress(json.dumps(bundle, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+
+# Builds the landing page and bundle of a catalogue (raising if they cannot
+# be built, e.g. when an animal type is missing) and returns the callable
+# that installs them
+def prepare_catalogue_pages(catalogue):
+    pages = build_landing_page(catalogue), build_catalogue_bundle(catalogue, health_advisor.search_mode)
+
+    def install():
+        global landing_page, catalogue_bundle
+        landing_page, catalogue_bundle = pages
+    return install
+
+phase_started = time.perf_counter()
+prepare_catalogue_pages(health_advisor.catalogue)()
+startup_timings['pages'] = time.perf_counter() - phase_started
+health_advisor.reload_preparers.append(prepare_catalogue_pages)
+
+results_page_cache = ResultCache(app.config['RESULT_CACHE_SIZE'], app.config['RESULT_CACHE_TTL'])
+health_advisor.reload_listeners.append(results_page_cache.clear)
+
+def timed_render(name, template, **context):
+    if instrumentation is None:
+        return render_template(template, **context)
+    started = time.perf_counter()
+    page = render_template(template, **context)
+    instrumentation.observe('template', name, time.perf_counter() - started)
+    return page
+
+if instrumentation is not None:
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request_time(response):
+        instrumentation.observe('request', request.endpoint or 'unmatched',
+                                time.perf_counter() - g.request_started)
+        instrumentation.request_finished()
+        return response
+
+if prometheus_sink is not None:
+    def cache_stats(stat):
+        return lambda: {
+            'cache="results"': health_advisor.result_cache.stats()[stat],
+            'cache="pages"': results_page_cache.stats()[stat],
+        }
+
+    prometheus_sink.gauges['livestock_cache_hits'] = ('Result cache hits', cache_stats('hits'))
+    prometheus_sink.gauges['livestock_cache_misses'] = ('Result cache misses', cache_stats('misses'))
+    prometheus_sink.gauges['livestock_cache_entries'] = ('Result cache entries', cache_stats('size'))
+    prometheus_sink.gauges['livestock_startup_seconds'] = ('Startup time by phase', lambda: {
+        format_labels(phase=phase): seconds for phase, seconds in startup_timings.items() if phase != 'catalogue_cache'
+    })
+    if surveillance is not None:
+        prometheus_sink.gauges['livestock_surveillance_events'] = ('Surveillance events by outcome', lambda: {
+            format_labels(state=state): value for state, value in surveillance.stats().items() if state != 'series'
+        })
+        prometheus_sink.gauges['livestock_surveillance_cases'] = (
+            'Reportable disease diagnoses in the surveillance window', lambda: {
+                format_labels(animal_type=row['animal_type'], disease=row['disease']): row['count']
+                for row in surveillance.snapshot(reportable_only=True)
+            })
+
+# Prometheus text exposition of the in-memory histograms
+@app.route('/metrics')
+def metrics():
+    if prometheus_sink is None:
+        abort(404)
+    return Response(prometheus_sink.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
 def index():
-    return render_template_string(
-        INDEX_TEMPLATE, 
-        cattle_symptoms=symptoms['cattle'], 
-        goat_symptoms=symptoms['goat'],
-        animal_type='cattle'
-    )
+    return precompressed_response(landing_page, 'text/html')
+
+# Stand-alone page that diagnoses in the browser from the catalogue bundle
+@app.route('/offline')
+def offline():
+    return render_template('index.html')
+
+# Service worker that precaches the offline page, diagnosis.js and the
+# catalogue bundle (static/js/service-worker.js), served from the root so its
+# scope covers /offline
+@app.route('/service-worker.js')
+def service_worker():
+    response = send_from_directory(app.static_folder, 'js/service-worker.js', mimetype='text/javascript')
+    response.cache_control.no_cache = True
+    return response
+
+@app.route('/api/v1/catalogue')
+def catalogue_download():
+    return precompressed_response(catalogue_bundle, 'application/json')
+
+# One /search request; fragment asks for a further page of cards only
+SearchQuery = namedtuple('SearchQuery', ['animal_type', 'selected_symptoms', 'search_text', 'ranking', 'offset',
+                                         'fragment'])
+
+# Typed symptoms and search text are normalized to the animal's vocabulary
+# (see engine/normalize.py) before they reach the rules or the cache key
+def parse_search_form(form):
+    animal_type = form.get('animal_type', 'cattle')
+    search_text = health_advisor.resolve_search_text(animal_type, form.get('search_text', ''))
+    selected_symptoms = health_advisor.catalogue.normalize_symptoms(animal_type, form.getlist('symptoms'))
+    ranking = form.get('ranking', 'count')
+    if ranking not in health_advisor.RANKINGS:
+        ranking = 'count'
+    offset = max(form.get('offset', 0, type=int), 0)
+    return SearchQuery(animal_type, selected_symptoms, search_text, ranking, offset, form.get('fragment') == '1')
+
+def results_context(animal_type, selected_symptoms, search_text, ranking, offset=0, fragment=False):
+    # Apply our rule-based system, one page at a time
+    page_size = app.config['RESULTS_PAGE_SIZE'] or None
+    results = health_advisor.search_diseases(animal_type, selected_symptoms, search_text, ranking,
+                                             limit=page_size, offset=offset)
+    if page_size is None:
+        results, total, next_offset = results, len(results), None
+    else:
+        results, total = results.results, results.total
+        next_offset = offset + page_size if offset + page_size < total else None
+    return {
+        'results': results,
+        'total': total,
+        'next_offset': next_offset,
+        'animal_type': animal_type,
+        'selected_symptoms': health_advisor.catalogue.ordered_symptoms(animal_type, selected_symptoms),
+        'search_text': search_text,
+        'ranking': ranking,
+    }
+
+# Only the cards block of the results page: what the "Show more results"
+# button appends in place
+def render_results_fragment(context):
+    return ''.join(results_template.blocks['cards'](results_template.new_context(context)))
+
+# The top match of a first page, if it shares a symptom with the query:
+# what outbreak surveillance counts as the diagnosis
+def leading_disease(results):
+    return results[0].disease if results and results[0].matching_symptoms else None
+
+# Rendered pages are cached under the same key as the search results,
+# so the selected symptoms are shown in a canonical order. The leading
+# disease is cached along with the page, so a cached page can still be
+# reported to surveillance without searching again.
+def render_results_page(animal_type, selected_symptoms, search_text, ranking, offset=0, fragment=False):
+    key = health_advisor.cache_key(animal_type, selected_symptoms, search_text, ranking=ranking,
+                                   offset=offset, limit=app.config['RESULTS_PAGE_SIZE']) + (fragment,)
+    entry = results_page_cache.get(key)
+    if entry is None:
+        context = results_context(animal_type, selected_symptoms, search_text, ranking, offset)
+        if fragment:
+            page = render_results_fragment(context)
+        else:
+            page = timed_render('results', results_template, **context)
+        entry = (page, leading_disease(context['results']))
+        results_page_cache.put(key, entry)
+    return entry
+
+def results_page(animal_type, selected_symptoms, search_text, ranking, offset=0, fragment=False):
+    return render_results_page(animal_type, selected_symptoms, search_text, ranking, offset, fragment)[0]
+
+# Symptom searches feed outbreak surveillance with the diagnosis they
+# already made. Only first pages count, so paging through one diagnosis
+# records it once; submit just queues it.
+def report_search(query, form, disease):
+    if (surveillance is not None and disease is not None and query.selected_symptoms and not query.offset
+            and not query.fragment):
+        surveillance.submit(query.animal_type, disease, form.get('region'))
 
 @app.route('/search', methods=['POST'])
 def search():
-    # Get data from the form
-    animal_type = request.form.get('animal_type', 'cattle')
-    search_text = request.form.get('search_text', '')
-    selected_symptoms = request.form.getlist('symptoms')
-    
-    # Apply our rule-based system
-    results = health_advisor.search_diseases(animal_type, selected_symptoms, search_text)
-    
-    return render_template_string(
-        RESULTS_TEMPLATE, 
-        results=results, 
-        animal_type=animal_type, 
-        selected_symptoms=selected_symptoms
+    query = parse_search_form(request.form)
+    if app.config['STREAM_RESULTS'] and not query.fragment:
+        # Large result lists start reaching the client before the page is complete
+        context = results_context(*query)
+        report_search(query, request.form, leading_disease(context['results']))
+        return stream_template(results_template, **context)
+    page, disease = render_results_page(*query)
+    report_search(query, request.form, disease)
+    return page
+
+# Validate one JSON diagnosis case and return (animal_type, symptoms, search_text, ranking)
+def parse_diagnosis_case(case):
+    if not isinstance(case, dict):
+        raise ValueError("each case must be a JSON object")
+
+    animal_type = case.get('animal_type', 'cattle')
+    if not isinstance(animal_type, str) or animal_type not in health_advisor.catalogue.diseases:
+        raise ValueError("unknown animal_type: %r" % (animal_type,))
+
+    selected_symptoms = case.get('symptoms', [])
+    if not isinstance(selected_symptoms, list) or not all(isinstance(s, str) for s in selected_symptoms):
+        raise ValueError("symptoms must be a list of strings")
+
+    search_text = case.get('search_text', '')
+    if not isinstance(search_text, str):
+        raise ValueError("search_text must be a string")
+
+    ranking = case.get('ranking', 'count')
+    if ranking not in health_advisor.RANKINGS:
+        raise ValueError("ranking must be one of %s" % ', '.join(health_advisor.RANKINGS))
+
+    return (animal_type, health_advisor.catalogue.normalize_symptoms(animal_type, selected_symptoms),
+            health_advisor.resolve_search_text(animal_type, search_text), ranking)
+
+# Optional region tag of a JSON case, for outbreak surveillance
+def parse_region(case):
+    region = case.get('region')
+    if region is not None and not isinstance(region, str):
+        raise ValueError("region must be a string")
+    return region
+
+def report_diagnosis(case, region, results):
+    disease = leading_disease(results)
+    if surveillance is not None and disease is not None and case[1]:
+        surveillance.submit(case[0], disease, region)
+
+def diagnosis_response(case, results):
+    animal_type, selected_symptoms, search_text, ranking = case
+    return {
+        'animal_type': animal_type,
+        'symptoms': selected_symptoms,
+        'search_text': search_text,
+        'ranking': ranking,
+        'results': [match.to_dict() for match in results],
+    }
+
+# JSON diagnosis API: accepts a single case object or an array of cases
+@app.route('/api/v1/diagnose', methods=['POST'])
+def diagnose():
+    payload = request.get_json(silent=True)
+
+    if isinstance(payload, dict):
+        try:
+            case = parse_diagnosis_case(payload)
+            region = parse_region(payload)
+        except ValueError as error:
+            return jsonify(error=str(error)), 400
+        results = health_advisor.search_diseases(*case)
+        report_diagnosis(case, region, results)
+        return jsonify(diagnosis_response(case, results))
+
+    if isinstance(payload, list):
+        if len(payload) > app.config['DIAGNOSE_MAX_BATCH']:
+            return jsonify(error="batch exceeds %d cases" % app.config['DIAGNOSE_MAX_BATCH']), 413
+
+        # Invalid cases get an error entry in place; the rest of the batch still runs
+        cases, regions, responses = [], [], []
+        for item in payload:
+            try:
+                case, region = parse_diagnosis_case(item), parse_region(item)
+            except ValueError as error:
+                responses.append({'error': str(error)})
+                continue
+            cases.append(case)
+            regions.append(region)
+            responses.append(None)
+
+        batch_results = iter(health_advisor.diagnose_batch(cases))
+        valid_cases = iter(zip(cases, regions))
+        for position, response in enumerate(responses):
+            if response is None:
+                case, region = next(valid_cases)
+                results = next(batch_results)
+                report_diagnosis(case, region, results)
+                responses[position] = diagnosis_response(case, results)
+        return jsonify(results=responses)
+
+    return jsonify(error="expected a JSON object or array of cases"), 400
+
+# Outbreak surveillance across the workers sharing SURVEILLANCE_PATH: window
+# counts per disease, busiest first (filters: animal_type, disease, region --
+# '*' lists every region -- and reportable=1), recent alerts and how many
+# events were counted or dropped
+@app.route('/api/v1/surveillance')
+def surveillance_report():
+    if surveillance is None:
+        abort(404)
+    reportable_only = request.args.get('reportable', '').lower() in ('1', 'true')
+    return jsonify(
+        window_seconds=surveillance.window_buckets * surveillance.bucket_seconds,
+        bucket_seconds=surveillance.bucket_seconds,
+        series=surveillance.snapshot(request.args.get('animal_type'), request.args.get('disease'),
+                                     request.args.get('region'), reportable_only),
+        alerts=surveillance.alerts(),
+        stats=surveillance.stats(),
     )
 
-# For serving static files in development (would need proper setup for production)
+# Guided interview: the server narrows the candidate diseases and suggests
+# the most informative symptom to ask about next (engine/interview.py).
+# Nothing is kept between requests: the session id is the animal type and
+# the answers so far, in order, encoded for the URL, and each request replays
+# them on the animal's QuestionTable, which costs about what answering them
+# did. Any worker of a multi-process deployment can therefore serve any step.
+# Answers are replayed on the current catalogue, so after a reload a session
+# continues on the new one.
+def encode_interview(animal_type, answers):
+    state = json.dumps([animal_type, answers], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(state).rstrip(b'=').decode('ascii')
+
+def decode_interview(session_id):
+    try:
+        animal_type, answers = json.loads(base64.urlsafe_b64decode(session_id + '=' * (-len(session_id) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError("malformed interview session") from None
+    if not isinstance(animal_type, str) or not isinstance(answers, list) or not all(
+            isinstance(answer, list) and len(answer) == 2 and isinstance(answer[0], str) and
+            (answer[1] is True or answer[1] is False or answer[1] is None) for answer in answers):
+        raise ValueError("malformed interview session")
+    return animal_type, answers
+
+# (catalogue, animal type, answers, Interview) of a session id
+def replay_interview(session_id):
+    animal_type, answers = decode_interview(session_id)
+    catalogue = health_advisor.catalogue
+    if animal_type not in catalogue.diseases:
+        raise ValueError("unknown animal_type: %r" % (animal_type,))
+    return catalogue, animal_type, answers, catalogue.question_table(animal_type).replay(answers)
+
+# Answers that change nothing are not recorded, so repeating one does not
+# grow the session id
+def record_answer(interview, answers, symptom, present):
+    answered = interview.answer(symptom, present)
+    if (answered.confirmed, answered.ruled_out, answered.skipped) != (
+            interview.confirmed, interview.ruled_out, interview.skipped):
+        answers = answers + [[symptom, present]]
+    return answered, answers
+
+def string_list(payload, field):
+    values = payload.get(field, [])
+    if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+        raise ValueError("%s must be a list of strings" % field)
+    return values
+
+def interview_response(catalogue, animal_type, answers, interview):
+    shown = interview.diseases()[:app.config['INTERVIEW_RESULTS']]
+    question = interview.next_question()
+    return {
+        'session': encode_interview(animal_type, answers),
+        'animal_type': animal_type,
+        'confirmed': list(interview.confirmed),
+        'ruled_out': list(interview.ruled_out),
+        'skipped': list(interview.skipped),
+        'candidates': len(interview.candidates),
+        'results': [match.to_dict() for match in health_advisor.calculate_symptom_coverage(
+            animal_type, shown, list(interview.confirmed), catalogue)],
+        'next_question': question and {
+            'symptom': question[0],
+            'information_gain': question[1],
+            'candidates_with': question[2],
+        },
+    }
+
+@app.route('/interview')
+def interview_page():
+    return render_template('interview.html')
+
+# Start a session, optionally with symptoms already known to be present or absent
+@app.route('/api/v1/interview', methods=['POST'])
+def start_interview():
+    payload = request.get_json(silent=True)
+    if payload is None:
+        payload = {}
+    if not isinstance(payload, dict):
+        return jsonify(error="expected a JSON object"), 400
+
+    catalogue = health_advisor.catalogue
+    animal_type = payload.get('animal_type', 'cattle')
+    if not isinstance(animal_type, str) or animal_type not in catalogue.diseases:
+        return jsonify(error="unknown animal_type: %r" % (animal_type,)), 400
+    try:
+        confirmed = string_list(payload, 'confirmed')
+        ruled_out = string_list(payload, 'ruled_out')
+    except ValueError as error:
+        return jsonify(error=str(error)), 400
+
+    interview = catalogue.question_table(animal_type).start()
+    answers = []
+    for symptom in catalogue.normalize_symptoms(animal_type, confirmed):
+        interview, answers = record_answer(interview, answers, symptom, True)
+    for symptom in catalogue.normalize_symptoms(animal_type, ruled_out):
+        interview, answers = record_answer(interview, answers, symptom, False)
+    return jsonify(interview_response(catalogue, animal_type, answers, interview)), 201
+
+# GET: current state; POST {"symptom": ..., "present": true/false/null}:
+# answer a question (null for "don't know") and get the state with its new
+# session id; DELETE: end the session (nothing is stored, so a no-op)
+@app.route('/api/v1/interview/<session_id>', methods=['GET', 'POST', 'DELETE'])
+def interview_session(session_id):
+    try:
+        catalogue, animal_type, answers, interview = replay_interview(session_id)
+    except ValueError:
+        return jsonify(error="unknown or malformed interview session"), 404
+    if request.method == 'DELETE':
+        return '', 204
+    if request.method == 'GET':
+        return jsonify(interview_response(catalogue, animal_type, answers, interview))
+
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get('symptom'), str):
+        return jsonify(error="expected a JSON object with a symptom"), 400
+    present = payload.get('present')
+    if present not in (True, False, None):
+        return jsonify(error="present must be true, false or null"), 400
+
+    symptom = catalogue.normalize_symptoms(animal_type, [payload['symptom']])[0]
+    interview, answers = record_answer(interview, answers, symptom, present)
+    return jsonify(interview_response(catalogue, animal_type, answers, interview))
+
+# Images (originals and built variants) are indexed once at startup and
+# served with ETag, Range and caching support; large files go out through
+# the server's sendfile-capable file wrapper
 @app.route('/static/images/<path:filename>')
 def serve_image(filename):
-    from flask import send_from_directory
-    import os
-    # This is only for demo purposes - you'd need to set up proper static file serving for production
-    return send_from_directory(os.path.join(app.root_path, 'static', 'images'), filename)
+    return image_assets.response(filename, request)
+
+startup_timings['total'] = time.perf_counter() - startup_started
+
+def startup_report():
+    return ('startup: imports %.1f ms, catalogue load %.1f ms (%s), index build %.1f ms, pages %.1f ms, '
+            'total %.1f ms' % (startup_timings['imports'] * 1000, startup_timings['catalogue_load'] * 1000,
+                               startup_timings['catalogue_cache'], startup_timings['index_build'] * 1000,
+                               startup_timings['pages'] * 1000, startup_timings['total'] * 1000))
+
+if app.config['STARTUP_REPORT']:
+    print(startup_report(), file=sys.stderr)
 
 if __name__ == '__main__':
-    import os
     # Create static/images directory if it doesn't exist
     if not os.path.exists(os.path.join(app.root_path, 'static', 'images')):
         os.makedirs(os.path.join(app.root_path, 'static', 'images'))
@@ -0,0 +1,282 @@
+# ASGI entry point for the health advisor.
+#
+# The hot routes -- the landing page, the catalogue bundle, /search and the
+# images -- are answered natively on the event loop from the same
+# precomputed pages, caches and asset index the Flask app uses, so one
+# process can hold thousands of idle keep-alive connections without a thread
+# per connection. Only their CPU-bound or blocking parts (searching and
+# rendering, file checks and reads) go to a thread pool, so one slow request
+# does not hold up the rest. Everything else (the JSON API, /metrics, /offline, ...) is
+# passed to the Flask app through asgiref's WSGI adapter, which runs it in a
+# thread pool.
+#
+# Requires the optional packages uvicorn and asgiref:
+#
+#   pip install uvicorn asgiref
+#
+# Production launch (one process per CPU core; each worker imports the app
+# and loads the catalogue itself):
+#
+#   uvicorn asgi:application --host 0.0.0.0 --port 8000 --workers 4 \
+#       --backlog 4096 --timeout-keep-alive 30 --no-access-log
+#
+# or under gunicorn's process manager, which restarts crashed workers:
+#
+#   gunicorn asgi:application -k uvicorn.workers.UvicornWorker -w 4 \
+#       -b 0.0.0.0:8000 --keep-alive 30
+#
+# Install uvloop and httptools as well for the fastest event loop and HTTP
+# parser; uvicorn picks them up automatically.
+# benchmarks/load_test.py compares this mode against the synchronous server.
+
+import asyncio
+import contextvars
+import time
+from urllib.parse import parse_qsl
+
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import http_date, parse_accept_header, parse_etags, parse_range_header
+
+import app as livestock
+
+FILE_CHUNK_SIZE = 256 * 1024
+HTML_HEADERS = [('content-type', 'text/html; charset=utf-8')]
+
+
+class Request:
+    def __init__(self, scope, receive):
+        self.scope = scope
+        self.receive = receive
+        self.method = scope['method']
+        self.headers = {}
+        for name, value in scope['headers']:
+            name = name.decode('latin-1')
+            value = value.decode('latin-1')
+            # Repeated headers are combined as a comma separated list
+            self.headers[name] = self.headers[name] + ', ' + value if name in self.headers else value
+
+    async def body(self, limit):
+        chunks = []
+        size = 0
+        while True:
+            message = await self.receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if limit is not None and size > limit:
+                return None
+            chunks.append(chunk)
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+
+def encode_headers(headers):
+    return [(name.encode('latin-1'), str(value).encode('latin-1')) for name, value in headers]
+
+
+# A file opened for reading from `start` (blocking)
+def open_at(path, start):
+    source = open(path, 'rb')
+    source.seek(start)
+    return source
+
+
+async def send_response(send, status, headers, body=b'', head=False):
+    await send({'type': 'http.response.start', 'status': status, 'headers': encode_headers(headers)})
+    await send({'type': 'http.response.body', 'body': b'' if head else body})
+
+
+class AdvisorASGI:
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.fallback = WsgiToAsgi(flask_app)
+        self.routes = {
+            ('/', 'GET'): ('index', self.index),
+            ('/api/v1/catalogue', 'GET'): ('catalogue_download', self.catalogue_download),
+            ('/search', 'POST'): ('search', self.search),
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            await self.fallback(scope, receive, send)
+            return
+
+        # HEAD is answered like GET without a body
+        method = 'GET' if scope['method'] == 'HEAD' else scope['method']
+        route = self.routes.get((scope['path'], method))
+        if route is None and method == 'GET' and scope['path'].startswith('/static/images/'):
+            route = ('serve_image', self.serve_image)
+        if route is None:
+            await self.fallback(scope, receive, send)
+            return
+
+        endpoint, handler = route
+        instrumentation = livestock.instrumentation
+        if instrumentation is None:
+            await handler(Request(scope, receive), send)
+            return
+        started = time.perf_counter()
+        instrumentation.request_started()
+        try:
+            await handler(Request(scope, receive), send)
+        finally:
+            instrumentation.observe('request', endpoint, time.perf_counter() - started)
+            instrumentation.request_finished()
+
+    # Run blocking or CPU-bound work (searches, rendering, file lookups) in
+    # the default thread pool, so one slow request never stalls the other
+    # connections on the loop. The request's context goes along, so events
+    # recorded there end up in its metrics.
+    @staticmethod
+    async def run_blocking(fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, contextvars.copy_context().run, fn, *args)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # Same negotiation as precompressed_response in app.py
+    async def precompressed(self, request, send, precompressed, content_type):
+        accepted = parse_accept_header(request.headers.get('accept-encoding'))
+        encoding = 'identity'
+        for candidate in ('br', 'gzip'):
+            if candidate in precompressed.encodings and accepted[candidate]:
+                encoding = candidate
+                break
+        etag, body = precompressed.encodings[encoding]
+
+        headers = [('content-type', content_type), ('vary', 'Accept-Encoding'),
+                   ('cache-control', 'no-cache'), ('etag', '"%s"' % etag)]
+        if encoding != 'identity':
+            headers.append(('content-encoding', encoding))
+        if parse_etags(request.headers.get('if-none-match')).contains(etag):
+            await send_response(send, 304, headers)
+            return
+        headers.append(('content-length', len(body)))
+        await send_response(send, 200, headers, body, request.method == 'HEAD')
+
+    async def index(self, request, send):
+        await self.precompressed(request, send, livestock.landing_page, 'text/html; charset=utf-8')
+
+    async def catalogue_download(self, request, send):
+        await self.precompressed(request, send, livestock.catalogue_bundle, 'application/json')
+
+    async def search(self, request, send):
+        content_type = request.headers.get('content-type', '').split(';')[0].strip()
+        if content_type != 'application/x-www-form-urlencoded':
+            # Multipart and other encodings are left to Werkzeug's form parser
+            await self.fallback(request.scope, request.receive, send)
+            return
+
+        body = await request.body(self.flask_app.config['MAX_FORM_MEMORY_SIZE'])
+        if body is None:
+            await send_response(send, 413, [('content-type', 'text/plain')], b'Request Entity Too Large')
+            return
+        form = MultiDict(parse_qsl(body.decode('utf-8', 'replace'), keep_blank_values=True))
+        page = await self.run_blocking(self.render_search, asyncio.get_running_loop(), send, form)
+        if page is not None:
+            await send_response(send, 200, HTML_HEADERS + [('content-length', len(page))], page)
+
+    # Search and render a /search request (on a pool thread). Returns the
+    # page, or None when it was streamed: each chunk is then handed to the
+    # loop to send as soon as it is rendered, and the thread waits for it to
+    # be sent before rendering more.
+    def render_search(self, loop, send, form):
+        query = livestock.parse_search_form(form)
+        with self.flask_app.app_context():
+            if not self.flask_app.config['STREAM_RESULTS'] or query.fragment:
+                page, disease = livestock.render_results_page(*query)
+                livestock.report_search(query, form, disease)
+                return page.encode('utf-8')
+
+            # Large result lists start reaching the client before the page is complete
+            context = livestock.results_context(*query)
+            livestock.report_search(query, form, livestock.leading_disease(context['results']))
+
+            def send_now(message):
+                asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+            send_now({'type': 'http.response.start', 'status': 200, 'headers': encode_headers(HTML_HEADERS)})
+            for chunk in livestock.results_template.generate(**context):
+                send_now({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+            send_now({'type': 'http.response.body', 'body': b''})
+        return None
+
+    async def serve_image(self, request, send):
+        name = request.scope['path'][len('/static/images/'):]
+        asset = livestock.image_assets.cached(name)
+        if asset is None:
+            # Not known to be current: may stat and hash the file
+            asset = await self.run_blocking(livestock.image_assets.lookup, name)
+        if asset is None:
+            await send_response(send, 404, [('content-type', 'text/plain')], b'Not Found')
+            return
+
+        headers = [('content-type', asset.mimetype), ('etag', '"%s"' % asset.etag),
+                   ('last-modified', http_date(asset.mtime_ns / 1e9)),
+                   ('cache-control', livestock.image_assets.cache_control(asset)),
+                   ('accept-ranges', 'bytes')]
+        if parse_etags(request.headers.get('if-none-match')).contains(asset.etag):
+            await send_response(send, 304, headers)
+            return
+
+        start, stop, status = 0, asset.size, 200
+        if 'range' in request.headers and request.headers.get('if-range', '"%s"' % asset.etag) == '"%s"' % asset.etag:
+            parsed = parse_range_header(request.headers['range'])
+            span = parsed.range_for_length(asset.size) if parsed is not None else None
+            if span is None:
+                await send_response(send, 416, [('content-range', 'bytes */%d' % asset.size)])
+                return
+            start, stop, status = span[0], span[1], 206
+            headers.append(('content-range', parsed.to_content_range_header(asset.size)))
+        headers.append(('content-length', stop - start))
+
+        if request.method == 'HEAD':
+            await send_response(send, status, headers, head=True)
+        elif asset.data is not None:
+            await send_response(send, status, headers, asset.data[start:stop])
+        elif status == 200 and 'http.response.pathsend' in request.scope.get('extensions', {}):
+            # The server sends the file itself (zero-copy where supported)
+            await send({'type': 'http.response.start', 'status': status,
+                        'headers': encode_headers(headers)})
+            await send({'type': 'http.response.pathsend', 'path': asset.path})
+        else:
+            await self.send_file(send, status, headers, asset.path, start, stop)
+
+    # Stream a byte range of a file; opening, reading and closing it all
+    # happen off the event loop, since any of them can block on the disk
+    async def send_file(self, send, status, headers, path, start, stop):
+        try:
+            source = await self.run_blocking(open_at, path, start)
+        except OSError:
+            # Removed since it was indexed
+            await send_response(send, 404, [('content-type', 'text/plain')], b'Not Found')
+            return
+        try:
+            await send({'type': 'http.response.start', 'status': status,
+                        'headers': encode_headers(headers)})
+            remaining = stop - start
+            while remaining > 0:
+                chunk = await self.run_blocking(source.read, min(FILE_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': remaining > 0})
+            if remaining > 0:
+                # File shrank since it was indexed; end the body
+                await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            await self.run_blocking(source.close)
+
+application = AdvisorASGI(livestock.app)
@@ -0,0 +1,148 @@
+# Benchmark of free-text symptom normalization against vocabulary size.
+#
+# Builds SymptomNormalizer over synthetic vocabularies of one- to three-word
+# terms (pronounceable pseudo-words, drawn Zipf-style so a few words are
+# shared by many terms, as "swelling" or "discharge" are in real ones) and
+# times single uncached lookups of
+#
+#   exact     a vocabulary term as is
+#   variant   the same with other case, punctuation and spacing
+#   typo1     one random insertion, deletion or substitution
+#   typo2     two of them
+#   unknown   a term from another vocabulary
+#
+# reporting per-lookup latency percentiles in microseconds, build time and
+# how many typo queries found their intended term.
+#
+#   python benchmarks/bench_normalize.py --sizes 1000 10000 50000 --output normalize.json
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_pipeline import git_revision  # noqa: E402
+from engine.normalize import SymptomNormalizer  # noqa: E402
+
+DEFAULT_SIZES = [1000, 10000, 50000]
+ONSETS = 'b c d f g h j k l m n p r s t v w z br cr dr fl gr pl pr st tr sh ch th'.split()
+NUCLEI = 'a e i o u ai ea ou ia io'.split()
+CODAS = ['', '', 'n', 'r', 's', 'l', 't', 'm', 'x', 'ng']
+LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+
+
+def synthetic_vocabulary(size, seed=0):
+    rng = random.Random(seed)
+    words = list(dict.fromkeys(
+        ''.join(rng.choice(ONSETS) + rng.choice(NUCLEI) + rng.choice(CODAS) for _ in range(rng.randint(2, 4)))
+        for _ in range(max(200, size // 5))
+    ))
+    cumulative_weights = list(itertools.accumulate(1.0 / (rank + 1) ** 0.8 for rank in range(len(words))))
+    terms = {}
+    while len(terms) < size:
+        terms[' '.join(rng.choices(words, cum_weights=cumulative_weights, k=rng.randint(1, 3)))] = None
+    return list(terms)
+
+
+def misspell(rng, text, edits):
+    for _ in range(edits):
+        position = rng.randrange(len(text))
+        operation = rng.randrange(3)
+        if operation == 0:
+            text = text[:position] + text[position + 1:]
+        elif operation == 1:
+            text = text[:position] + rng.choice(LETTERS) + text[position + 1:]
+        else:
+            text = text[:position] + rng.choice(LETTERS) + text[position:]
+    return text
+
+
+def variant(rng, text):
+    words = [word.upper() if rng.random() < 0.5 else word.title() for word in text.split()]
+    return '  ' + ' - '.join(words) + '. '
+
+
+def latency(lookup, queries):
+    timings = []
+    for query in queries:
+        begin = time.perf_counter()
+        lookup(query)
+        timings.append((time.perf_counter() - begin) * 1e6)
+    timings.sort()
+    return {
+        'queries': len(timings),
+        'mean_us': statistics.fmean(timings),
+        'p50_us': timings[len(timings) // 2],
+        'p99_us': timings[min(len(timings) - 1, int(len(timings) * 0.99))],
+    }
+
+
+def bench_size(size, count):
+    vocabulary = synthetic_vocabulary(size)
+    begin = time.perf_counter()
+    normalizer = SymptomNormalizer(vocabulary, synonyms=())
+    build_ms = (time.perf_counter() - begin) * 1000
+    # The uncached lookup, so every query is timed in full
+    lookup = normalizer.lookup.__wrapped__
+
+    rng = random.Random(1)
+    targets = rng.choices(vocabulary, k=count)
+    others = [term for term in synthetic_vocabulary(count, seed=2) if term not in normalizer.exact]
+    queries = {
+        'exact': targets,
+        'variant': [variant(rng, term) for term in targets],
+        'typo1': [misspell(rng, term, 1) for term in targets],
+        'typo2': [misspell(rng, term, 2) for term in targets],
+        'unknown': others[:count],
+    }
+    result = {
+        'vocabulary': len(vocabulary),
+        'build_ms': build_ms,
+        'lookups': {kind: latency(lookup, texts) for kind, texts in queries.items()},
+    }
+    # Share of misspelt queries mapped back to their term (a typo can also
+    # land closer to, or exactly on, another term)
+    for kind in ('typo1', 'typo2'):
+        found = sum(lookup(text) == term for text, term in zip(queries[kind], targets))
+        result['lookups'][kind]['recovered'] = found / len(targets)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark free-text symptom normalization")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help="vocabulary sizes to build")
+    parser.add_argument('--queries', type=int, default=2000, help="lookups timed per query kind")
+    parser.add_argument('--output', help="write JSON results here instead of stdout")
+    args = parser.parse_args(argv)
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': [],
+    }
+    for size in args.sizes:
+        print('benchmarking a vocabulary of %d terms...' % size, file=sys.stderr)
+        result = bench_size(size, args.queries)
+        for kind, timing in result['lookups'].items():
+            print('  %-8s p50 %7.1f us  p99 %7.1f us' % (kind, timing['p50_us'], timing['p99_us']), file=sys.stderr)
+        report['results'].append(result)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as destination:
+            destination.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
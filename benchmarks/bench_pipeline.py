@@ -0,0 +1,209 @@
+# Benchmark harness for the rule pipeline and the HTTP routes.
+#
+# Generates synthetic catalogues (see synthetic.py: 10 to 100k diseases per
+# animal type with a skewed symptom distribution, so common symptoms like
+# "fever" overlap many diseases), then times every rule of LivestockHealthAdvisor on its own,
+# the full uncached search, and /search end to end through Flask's test
+# client. Results are written as JSON so runs can be compared across commits,
+# together with build time and traced memory of each catalogue size.
+# The full default run (up to 100k diseases per animal) takes several minutes.
+#
+#   python benchmarks/bench_pipeline.py --sizes 10 1000 100000 --output bench.json
+#   python benchmarks/bench_pipeline.py --compare old.json new.json
+
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app as livestock_app  # noqa: E402
+from engine import DiseaseCatalogue, LivestockHealthAdvisor  # noqa: E402
+from synthetic import synthetic_catalogue, synthetic_queries  # noqa: E402
+
+DEFAULT_SIZES = [10, 100, 1000, 10000, 100000]
+
+
+# Run fn repeatedly (at least min_runs, until budget seconds are used) and
+# report per-call statistics in milliseconds
+def measure(fn, budget=0.5, min_runs=3, max_runs=1000):
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < min_runs or (time.perf_counter() - started < budget and len(timings) < max_runs):
+        begin = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - begin) * 1000)
+    timings.sort()
+    return {
+        'runs': len(timings),
+        'mean_ms': statistics.fmean(timings),
+        'p50_ms': timings[len(timings) // 2],
+        'p99_ms': timings[min(len(timings) - 1, int(len(timings) * 0.99))],
+    }
+
+
+def measure_memory(build):
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {'retained_bytes': current, 'peak_bytes': peak}
+
+
+def bench_rules(advisor, queries, budget):
+    catalogue = advisor.catalogue
+    diseases = catalogue.diseases['cattle']
+    severities = [disease.severity for disease in diseases]
+    prepared = []
+    for selected_symptoms, search_text in queries:
+        filtered = advisor.filter_by_symptoms('cattle', selected_symptoms)
+        prepared.append((selected_symptoms, search_text, filtered))
+
+    def each_query(rule):
+        return lambda: [rule(*query) for query in prepared]
+
+    timings = {
+        'filter_by_symptoms': measure(each_query(
+            lambda symptoms_, text, filtered: advisor.filter_by_symptoms('cattle', symptoms_)), budget),
+        'sort_by_match_count': measure(each_query(
+            lambda symptoms_, text, filtered: advisor.sort_by_match_count('cattle', filtered, symptoms_)), budget),
+        'filter_by_search_text': measure(each_query(
+            lambda symptoms_, text, filtered: advisor.filter_by_search_text('cattle', filtered, text or 'viral')), budget),
+        'calculate_symptom_coverage': measure(each_query(
+            lambda symptoms_, text, filtered: advisor.calculate_symptom_coverage('cattle', filtered, symptoms_)), budget),
+        # Rules 4 and 6 run once per disease when the catalogue is loaded
+        'flag_critical_conditions': measure(
+            lambda: [advisor.flag_critical_conditions(severity) for severity in severities], budget),
+        'apply_severity_rating': measure(
+            lambda: [advisor.apply_severity_rating(severity) for severity in severities], budget),
+        'search_diseases_uncached': measure(each_query(
+            lambda symptoms_, text, filtered: advisor.evaluate_rules('cattle', symptoms_, text)), budget),
+        # First page of 20 through the heap selection
+        'search_diseases_page_uncached': measure(each_query(
+            lambda symptoms_, text, filtered: advisor.evaluate_page('cattle', symptoms_, text, limit=20)), budget),
+    }
+    # Each timing covers one batch: every query, or every disease for rules 4 and 6
+    for name, timing in timings.items():
+        if name in ('flag_critical_conditions', 'apply_severity_rating'):
+            timing['diseases'] = len(severities)
+        else:
+            timing['queries'] = len(prepared)
+    return timings
+
+
+# End-to-end POST /search through the Flask test client with caching disabled
+def bench_http(database, symptom_lists, queries, budget):
+    advisor = livestock_app.health_advisor
+    advisor.load_catalogue(database, symptom_lists)
+    advisor.result_cache.maxsize = 0
+    livestock_app.results_page_cache.maxsize = 0
+    client = livestock_app.app.test_client()
+    forms = [{'animal_type': 'cattle', 'symptoms': selected, 'search_text': text} for selected, text in queries]
+    response_bytes = [len(client.post('/search', data=form).data) for form in forms]
+
+    def post_all():
+        for form in forms:
+            client.post('/search', data=form)
+
+    timing = measure(post_all, budget, min_runs=1)
+    timing['queries'] = len(forms)
+    timing['mean_response_bytes'] = statistics.fmean(response_bytes)
+    return timing
+
+
+def bench_size(size, budget, http=True, engine='bitset'):
+    database, symptom_lists = synthetic_catalogue(size)
+    queries = synthetic_queries(symptom_lists)
+
+    begin = time.perf_counter()
+    DiseaseCatalogue(database, symptom_lists)
+    build_ms = (time.perf_counter() - begin) * 1000
+    # Measured separately: tracemalloc slows allocation down considerably
+    catalogue, memory = measure_memory(lambda: DiseaseCatalogue(database, symptom_lists))
+
+    advisor = LivestockHealthAdvisor(database, symptom_lists, cache_size=0, engine=engine)
+    result = {
+        'diseases_per_animal': size,
+        'engine': engine,
+        'catalogue_build_ms': build_ms,
+        'catalogue_memory': memory,
+        'rules': bench_rules(advisor, queries, budget),
+    }
+    del catalogue
+    if http:
+        result['http_search'] = bench_http(database, symptom_lists, queries, budget)
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Print the ratio new/old for every timing present in both result files
+def compare(old_path, new_path):
+    with open(old_path) as old_file, open(new_path) as new_file:
+        old, new = json.load(old_file), json.load(new_file)
+    old_sizes = {run['diseases_per_animal']: run for run in old['results']}
+    for run in new['results']:
+        before = old_sizes.get(run['diseases_per_animal'])
+        if before is None:
+            continue
+        pairs = [(name, before['rules'].get(name), timing) for name, timing in run['rules'].items()]
+        if 'http_search' in run and 'http_search' in before:
+            pairs.append(('http_search', before['http_search'], run['http_search']))
+        for name, old_timing, new_timing in pairs:
+            if old_timing:
+                print('%7d  %-28s %10.3f -> %10.3f ms  (x%.2f)' % (
+                    run['diseases_per_animal'], name, old_timing['p50_ms'], new_timing['p50_ms'],
+                    new_timing['p50_ms'] / old_timing['p50_ms'] if old_timing['p50_ms'] else float('inf')))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the diagnosis rule pipeline")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help="diseases per animal type in each synthetic catalogue")
+    parser.add_argument('--budget', type=float, default=0.5, help="seconds spent per measurement")
+    parser.add_argument('--no-http', action='store_true', help="skip the /search route benchmark")
+    parser.add_argument('--engine', choices=('bitset', 'numpy'), default='bitset',
+                        help="symptom scoring engine used for the rule timings")
+    parser.add_argument('--output', help="write JSON results here instead of stdout")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="compare two result files")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': [],
+    }
+    for size in args.sizes:
+        print('benchmarking %d diseases per animal...' % size, file=sys.stderr)
+        report['results'].append(bench_size(size, args.budget, http=not args.no_http, engine=args.engine))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as destination:
+            destination.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
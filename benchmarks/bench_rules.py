@@ -0,0 +1,177 @@
+# Benchmark of the declarative rule network against rule count.
+#
+# Starts from REFERENCE_RULES (the advisor's six rules) and adds K generated
+# domain rules of the kinds a real rule set accumulates: species exclusions,
+# severity escalations on selected symptoms and reportable-disease triggers.
+# The generated rules draw their conditions from a small pool, so many of
+# them share alpha nodes and join prefixes, as hand-written rules do. For
+# each catalogue size and K it times
+#
+#   network   RuleSession evaluation and the first page of 20 results
+#   naive     the same rule set interpreted rule by rule, every condition of
+#             every rule tested against every disease (the cost a plain list
+#             of rules would pay)
+#
+# and records the compile time and node counts of the network.
+#
+#   python benchmarks/bench_rules.py --sizes 1000 10000 --rule-counts 0 100 1000 --output rules.json
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_pipeline import git_revision, measure  # noqa: E402
+from engine import REFERENCE_RULES, LivestockHealthAdvisor, compile_rules  # noqa: E402
+from engine.rules import OPERATORS, disease_field  # noqa: E402
+from synthetic import synthetic_catalogue, synthetic_queries  # noqa: E402
+
+DEFAULT_SIZES = [1000, 10000]
+DEFAULT_RULE_COUNTS = [0, 10, 50, 100, 500, 1000]
+NAME_WORDS = ['acute', 'chronic', 'viral', 'bacterial', 'parasitic', 'toxin']
+
+
+# K extra rules over the catalogue's symptom vocabulary
+def generate_rules(count, symptom_lists, seed=0):
+    rng = random.Random(seed)
+    vocabulary = sorted(set(symptom for symptoms in symptom_lists.values() for symptom in symptoms))
+    levels = [level for level in LivestockHealthAdvisor.SEVERITY_SCORES if ' - ' not in level]
+    rules = []
+    for number in range(count):
+        kind = number % 3
+        if kind == 0:
+            rules.append({
+                'name': 'species_exclusion_%d' % number,
+                'when': [['species', '==', rng.choice(['cattle', 'goat'])],
+                         ['name', 'contains', rng.choice(NAME_WORDS)],
+                         ['symptoms', 'contains', rng.choice(vocabulary)]],
+                'then': {'exclude': True},
+            })
+        elif kind == 1:
+            rules.append({
+                'name': 'severity_escalation_%d' % number,
+                'when': [['severity_level', '==', rng.choice(levels)],
+                         ['selected', 'contains', rng.choice(vocabulary)]],
+                'then': {'set': {'severity_score': 5}},
+            })
+        else:
+            trigger = rng.choice(vocabulary)
+            rules.append({
+                'name': 'reportable_trigger_%d' % number,
+                'when': [['severity', 'contains', 'Reportable'],
+                         ['symptoms', 'contains', trigger],
+                         ['selected', 'contains', trigger]],
+                'then': {'set': {'urgent': True}},
+            })
+    return rules
+
+
+# The rule set interpreted directly: each rule tests each disease
+def naive_matches(condition, disease, facts, animal_type, text_matched):
+    if condition[0] == 'not':
+        return not naive_matches(condition[1], disease, facts, animal_type, text_matched)
+    subject, operator = condition[0], condition[1]
+    value = condition[2] if len(condition) == 3 else None
+    if operator == 'intersects':
+        return any(symptom in facts['selected'] for symptom in disease.symptoms)
+    if operator == 'matches':
+        return text_matched is None or id(disease) in text_matched
+    if subject == 'species':
+        return OPERATORS[operator](animal_type, value)
+    if subject in facts:
+        return OPERATORS[operator](facts[subject], value)
+    return OPERATORS[operator](disease_field(disease, subject), value)
+
+
+def naive_evaluate(rules, animal_type, catalogue, facts):
+    records = catalogue.diseases[animal_type]
+    text_matched = None
+    if facts['search_text']:
+        text_matched = catalogue.text_index[animal_type].search(facts['search_text'])
+    excluded = set()
+    overrides = {}
+    for rule in rules:
+        for position, disease in enumerate(records):
+            if all(naive_matches(condition, disease, facts, animal_type, text_matched) for condition in rule['when']):
+                if rule['then'].get('exclude'):
+                    excluded.add(position)
+                if 'set' in rule['then']:
+                    overrides.setdefault(position, {}).update(rule['then']['set'])
+    return [position for position in range(len(records)) if position not in excluded], overrides
+
+
+def bench_size(size, rule_counts, budget):
+    database, symptom_lists = synthetic_catalogue(size)
+    queries = synthetic_queries(symptom_lists)
+    advisor = LivestockHealthAdvisor(database, symptom_lists, cache_size=0)
+    catalogue = advisor.catalogue
+
+    results = []
+    for count in rule_counts:
+        rules = REFERENCE_RULES + generate_rules(count, symptom_lists)
+        begin = time.perf_counter()
+        network = compile_rules(rules, catalogue)['cattle']
+        compile_ms = (time.perf_counter() - begin) * 1000
+
+        def run_network():
+            for selected_symptoms, search_text in queries:
+                network.session(selected_symptoms, search_text).results(0, 20)
+
+        def run_naive():
+            for selected_symptoms, search_text in queries:
+                naive_evaluate(rules, 'cattle', catalogue,
+                               {'selected': selected_symptoms, 'search_text': search_text, 'ranking': 'count'})
+
+        entry = {
+            'rules': len(rules),
+            'compile_ms': compile_ms,
+            'nodes': len(network.nodes),
+            'dynamic_nodes': len(network.dynamic),
+            'network': measure(run_network, budget),
+            'queries': len(queries),
+        }
+        # The interpreted walk grows with rules x diseases; skip the hopeless cases
+        if count * size <= 500000:
+            entry['naive'] = measure(run_naive, budget, min_runs=1)
+        print('  %6d rules: network %.2f ms, naive %s' % (
+            len(rules), entry['network']['p50_ms'],
+            '%.2f ms' % entry['naive']['p50_ms'] if 'naive' in entry else 'skipped'), file=sys.stderr)
+        results.append(entry)
+    return {'diseases_per_animal': size, 'rule_counts': results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the rule network against rule count")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help="diseases per animal type in each synthetic catalogue")
+    parser.add_argument('--rule-counts', type=int, nargs='+', default=DEFAULT_RULE_COUNTS,
+                        help="generated rules added to the reference rule set")
+    parser.add_argument('--budget', type=float, default=0.5, help="seconds spent per measurement")
+    parser.add_argument('--output', help="write JSON results here instead of stdout")
+    args = parser.parse_args(argv)
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': [],
+    }
+    for size in args.sizes:
+        print('benchmarking %d diseases per animal...' % size, file=sys.stderr)
+        report['results'].append(bench_size(size, args.rule_counts, args.budget))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as destination:
+            destination.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+# Benchmark of outbreak surveillance: what it costs a request and how fast
+# the aggregator keeps up.
+#
+# On a synthetic catalogue it times
+#
+#   submit      OutbreakMonitor.submit alone, the only part on the request
+#               path, while the aggregator thread drains the queue
+#   aggregate   events counted per second by the aggregator
+#   snapshot    one /api/v1/surveillance query over every series
+#
+# with the leading diagnoses of random searches spread over many regions, so
+# the series cap is exercised. --store shared counts into a fresh SQLite file
+# (SURVEILLANCE_PATH) instead of memory.
+#
+#   python benchmarks/bench_surveillance.py --events 20000 --regions 1 100 5000 --output surveillance.json
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_pipeline import git_revision  # noqa: E402
+from engine import LivestockHealthAdvisor, OutbreakMonitor  # noqa: E402
+from synthetic import synthetic_catalogue, synthetic_queries  # noqa: E402
+
+DEFAULT_REGIONS = [1, 100, 5000]
+
+
+def bench_regions(diagnoses, regions, count, max_series, path=None):
+    monitor = OutbreakMonitor(max_series=max_series, queue_size=count, path=path)
+    rng = random.Random(0)
+    events = [(rng.choice(diagnoses), 'region %d' % rng.randrange(regions)) for _ in range(count)]
+
+    timings = []
+    begin = time.perf_counter()
+    for disease, region in events:
+        started = time.perf_counter()
+        monitor.submit('cattle', disease, region=region)
+        timings.append((time.perf_counter() - started) * 1e6)
+    monitor.flush()
+    elapsed = time.perf_counter() - begin
+    timings.sort()
+
+    begin = time.perf_counter()
+    rows = monitor.snapshot(region='*')
+    snapshot_ms = (time.perf_counter() - begin) * 1000
+    return {
+        'regions': regions,
+        'events': count,
+        'submit_p50_us': timings[len(timings) // 2],
+        'submit_p99_us': timings[min(len(timings) - 1, int(len(timings) * 0.99))],
+        'submit_mean_us': statistics.fmean(timings),
+        'aggregate_events_per_s': monitor.recorded / elapsed,
+        'snapshot_ms': snapshot_ms,
+        'series': monitor.stats()['series'],
+        'regional_rows': len(rows),
+        'dropped': monitor.dropped,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark outbreak surveillance")
+    parser.add_argument('--size', type=int, default=1000, help="diseases per animal type in the synthetic catalogue")
+    parser.add_argument('--events', type=int, default=20000, help="diagnosis events submitted per run")
+    parser.add_argument('--regions', type=int, nargs='+', default=DEFAULT_REGIONS,
+                        help="distinct region tags the events are spread over")
+    parser.add_argument('--max-series', type=int, default=10000, help="series kept by the monitor")
+    parser.add_argument('--store', choices=['memory', 'shared'], default='memory',
+                        help="keep the counts in memory or in an SQLite file")
+    parser.add_argument('--output', help="write JSON results here instead of stdout")
+    args = parser.parse_args(argv)
+
+    database, symptom_lists = synthetic_catalogue(args.size)
+    advisor = LivestockHealthAdvisor(database, symptom_lists, cache_size=0)
+    # Leading diagnoses of random symptom searches, as /search reports them
+    diagnoses = [advisor.search_diseases('cattle', selected_symptoms, search_text, limit=1).results
+                 for selected_symptoms, search_text in synthetic_queries(symptom_lists, count=200)]
+    diagnoses = [results[0].disease for results in diagnoses if results]
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'diseases_per_animal': args.size,
+        'store': args.store,
+        'results': [],
+    }
+    directory = tempfile.mkdtemp(prefix='bench-surveillance-')
+    for regions in args.regions:
+        print('benchmarking %d regions...' % regions, file=sys.stderr)
+        path = os.path.join(directory, '%d.sqlite3' % regions) if args.store == 'shared' else None
+        result = bench_regions(diagnoses, regions, args.events, args.max_series, path)
+        print('  submit p50 %.1f us  p99 %.1f us, aggregator %.0f events/s, %d series' % (
+            result['submit_p50_us'], result['submit_p99_us'], result['aggregate_events_per_s'],
+            result['series']), file=sys.stderr)
+        report['results'].append(result)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as destination:
+            destination.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+# Load test: synchronous server vs the ASGI entry point on the same machine.
+#
+# Starts each server as a subprocess on a free local port, then drives it with
+# many concurrent keep-alive HTTP/1.1 connections (plain asyncio sockets, no
+# client library needed) for a fixed duration. The request mix is the landing
+# page, /search with varied symptom sets and an image. Reports requests per
+# second, p50/p99 latency and errors per mode.
+#
+#   sync  Werkzeug threaded server, as started by `python app.py`
+#   asgi  uvicorn asgi:application (needs uvicorn and asgiref)
+#
+#   python benchmarks/load_test.py --connections 200 --duration 15
+#   python benchmarks/load_test.py --modes asgi --workers 4 --output load.json
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode
+
+RESPONSE_TIMEOUT = 30.0
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+CATTLE_SYMPTOMS = ["coughing", "nasal discharge", "fever", "reduced appetite", "labored breathing",
+                   "swollen udder", "abnormal milk", "diarrhea", "weight loss", "lameness"]
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def server_command(mode, port, workers):
+    if mode == 'sync':
+        return [sys.executable, '-c',
+                'from werkzeug.serving import run_simple; import app; '
+                'run_simple("127.0.0.1", %d, app.app, threaded=True)' % port]
+    return [sys.executable, '-m', 'uvicorn', 'asgi:application', '--host', '127.0.0.1', '--port', str(port),
+            '--workers', str(workers), '--no-access-log', '--log-level', 'warning', '--backlog', '4096']
+
+
+def wait_until_listening(port, process, log, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            log.seek(0)
+            raise RuntimeError("server exited with status %d:\n%s" % (
+                process.returncode, log.read().decode('utf-8', 'replace')[-2000:]))
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("server did not start listening on port %d" % port)
+
+
+def request_mix(seed=0, count=64):
+    rng = random.Random(seed)
+    requests = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.3:
+            requests.append(b'GET / HTTP/1.1\r\nHost: localhost\r\nAccept-Encoding: gzip\r\n\r\n')
+        elif kind < 0.9:
+            form = [('animal_type', 'cattle'), ('search_text', rng.choice(['', '', 'viral']))]
+            form += [('symptoms', symptom) for symptom in rng.sample(CATTLE_SYMPTOMS, rng.randint(1, 3))]
+            body = urlencode(form).encode()
+            requests.append(b'POST /search HTTP/1.1\r\nHost: localhost\r\n'
+                            b'Content-Type: application/x-www-form-urlencoded\r\n'
+                            b'Content-Length: %d\r\n\r\n%s' % (len(body), body))
+        else:
+            requests.append(b'GET /static/images/livestock-1822698_1280.jpg HTTP/1.1\r\nHost: localhost\r\n\r\n')
+    return requests
+
+
+async def read_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed")
+    status = int(status_line.split()[1])
+    length = None
+    chunked = False
+    close = False
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        name = name.strip().lower()
+        value = value.strip().lower()
+        if name == 'content-length':
+            length = int(value)
+        elif name == 'transfer-encoding' and 'chunked' in value:
+            chunked = True
+        elif name == 'connection' and value == 'close':
+            close = True
+
+    if chunked:
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif length is not None:
+        await reader.readexactly(length)
+    else:
+        await reader.read()
+        close = True
+    return status, close
+
+
+async def connection_worker(port, requests, offset, stop_at, latencies, errors):
+    reader = writer = None
+    index = offset
+    while time.perf_counter() < stop_at:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            payload = requests[index % len(requests)]
+            index += 1
+            started = time.perf_counter()
+            writer.write(payload)
+            status, close = await asyncio.wait_for(read_response(reader), RESPONSE_TIMEOUT)
+            latencies.append(time.perf_counter() - started)
+            if status >= 400:
+                errors['http_%d' % status] = errors.get('http_%d' % status, 0) + 1
+            if close:
+                writer.close()
+                writer = None
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError) as error:
+            errors[type(error).__name__] = errors.get(type(error).__name__, 0) + 1
+            if writer is not None:
+                writer.close()
+            writer = None
+            await asyncio.sleep(0.01)
+    if writer is not None:
+        writer.close()
+
+
+async def drive(port, connections, duration, warmup):
+    requests = request_mix()
+    # Warm-up pass so caches and connection setup are excluded from the measurement
+    await asyncio.gather(*(connection_worker(port, requests, i, time.perf_counter() + warmup, [], {})
+                           for i in range(min(connections, 16))))
+
+    latencies = []
+    errors = {}
+    started = time.perf_counter()
+    stop_at = started + duration
+    await asyncio.gather(*(connection_worker(port, requests, i, stop_at, latencies, errors)
+                           for i in range(connections)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    count = len(latencies)
+    return {
+        'requests': count,
+        'requests_per_second': count / elapsed,
+        'p50_ms': latencies[count // 2] * 1000 if count else None,
+        'p99_ms': latencies[min(count - 1, int(count * 0.99))] * 1000 if count else None,
+        'errors': errors,
+    }
+
+
+def run_mode(mode, connections, duration, warmup, workers):
+    port = free_port()
+    env = dict(os.environ, LIVESTOCK_CATALOGUE_RELOAD_INTERVAL='0')
+    # Server output goes to a file: the sync server logs every request, which
+    # would fill an unread pipe and stall it
+    log = tempfile.TemporaryFile()
+    process = subprocess.Popen(server_command(mode, port, workers), cwd=ROOT, env=env,
+                               stdout=log, stderr=subprocess.STDOUT)
+    try:
+        wait_until_listening(port, process, log)
+        result = asyncio.run(drive(port, connections, duration, warmup))
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        log.close()
+    result.update(mode=mode, connections=connections, workers=workers if mode == 'asgi' else 1)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the sync and ASGI servers under concurrent load")
+    parser.add_argument('--modes', nargs='+', choices=('sync', 'asgi'), default=['sync', 'asgi'])
+    parser.add_argument('--connections', type=int, default=100, help="concurrent keep-alive connections")
+    parser.add_argument('--duration', type=float, default=10.0, help="measured seconds per mode")
+    parser.add_argument('--warmup', type=float, default=2.0, help="unmeasured seconds before each run")
+    parser.add_argument('--workers', type=int, default=1, help="uvicorn worker processes in asgi mode")
+    parser.add_argument('--output', help="write JSON results here as well")
+    args = parser.parse_args(argv)
+
+    results = []
+    for mode in args.modes:
+        print('load testing %s with %d connections...' % (mode, args.connections), file=sys.stderr)
+        result = run_mode(mode, args.connections, args.duration, args.warmup, args.workers)
+        results.append(result)
+        print('%-5s %9.1f req/s   p50 %8.2f ms   p99 %8.2f ms   errors %s' % (
+            mode, result['requests_per_second'], result['p50_ms'] or 0, result['p99_ms'] or 0,
+            result['errors'] or 0))
+
+    if args.output:
+        with open(args.output, 'w') as destination:
+            json.dump({'results': results}, destination, indent=2)
+            destination.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+# Synthetic catalogues and queries for the benchmarks and the tests.
+#
+# Catalogues have 10 to 100k diseases per animal type with a skewed symptom
+# distribution, so common symptoms like "fever" overlap many diseases, and
+# Zipf-distributed free text. Nothing here imports the app, so the tests can
+# use it without starting one.
+
+import itertools
+import random
+
+SEVERITIES = ["Low", "Moderate", "Moderate to High", "High", "Critical", "Critical - Reportable Disease"]
+TREATMENT_TYPES = ["Medication", "Management", "Prevention", "Supportive Care"]
+# Free-text lexicon: a few real terms plus synthetic ones, drawn Zipf-style
+LEXICON = ("acute chronic viral bacterial parasitic infection inflammation toxin respiratory digestive "
+           "udder joint skin hoof fever lesion swelling discharge weakness nutrition vaccine "
+           "antibiotic isolation hygiene ventilation electrolytes supportive").split()
+LEXICON += ['term%d' % i for i in range(2000)]
+LEXICON_WEIGHTS = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(len(LEXICON))))
+
+
+def synthetic_text(rng, words):
+    return ' '.join(rng.choices(LEXICON, cum_weights=LEXICON_WEIGHTS, k=words))
+
+
+# Symptom vocabulary grows with the catalogue; symptom popularity follows a
+# Zipf-like curve so a handful of symptoms are shared by many diseases
+def synthetic_catalogue(size, seed=0, animal_types=('cattle', 'goat')):
+    rng = random.Random(seed)
+    vocabulary_size = max(20, min(5000, size // 10))
+    vocabulary = ['symptom %d' % i for i in range(vocabulary_size)]
+    cumulative_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(vocabulary_size)))
+
+    database = {}
+    symptom_lists = {}
+    for animal_type in animal_types:
+        diseases = []
+        for disease_id in range(1, size + 1):
+            disease_symptoms = {}
+            target = rng.randint(3, 10)
+            while len(disease_symptoms) < target:
+                for symptom in rng.choices(vocabulary, cum_weights=cumulative_weights, k=target):
+                    disease_symptoms[symptom] = None
+                    if len(disease_symptoms) == target:
+                        break
+            diseases.append({
+                'id': disease_id,
+                'name': '%s disease %d %s' % (animal_type.title(), disease_id, synthetic_text(rng, 1)),
+                'symptoms': sorted(disease_symptoms),
+                'description': synthetic_text(rng, 12),
+                'severity': rng.choice(SEVERITIES),
+                'treatments': [
+                    {'type': treatment_type, 'details': synthetic_text(rng, 10)}
+                    for treatment_type in rng.sample(TREATMENT_TYPES, 3)
+                ],
+            })
+        database[animal_type] = diseases
+        symptom_lists[animal_type] = vocabulary[:60]
+    return database, symptom_lists
+
+
+def synthetic_queries(symptom_lists, count=20, seed=1):
+    rng = random.Random(seed)
+    vocabulary = symptom_lists['cattle']
+    return [(rng.sample(vocabulary, rng.randint(1, 4)), rng.choice(['', '', 'viral', 'fev'])) for _ in range(count)]
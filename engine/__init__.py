@@ -0,0 +1,21 @@
+# Shared diagnosis engine used by the Flask app (app.py) and the command-line
+# advisor (py/animal-disease-remedies.py): catalogue storage and compilation,
+# the indexed catalogue and the rules evaluated over it, built in or as a
+# declarative rule network, and outbreak surveillance over the diagnoses made.
+
+from .advisor import (Disease, DiseaseCatalogue, DiseaseMatch, LikelihoodTable, LivestockHealthAdvisor,
+                      ResultCache, ResultPage, TextIndex, Treatment, tokenize)
+from .catalogue import DEFAULT_CATALOGUE_PATH, CatalogueData, CatalogueError, CatalogueStore
+from .interview import Interview, QuestionTable
+from .normalize import SYMPTOM_SYNONYMS, SymptomNormalizer
+from .remedies import RemedyTable
+from .rules import REFERENCE_RULES, RuleBasedAdvisor, RuleError, RuleNetwork, RuleSession, compile_rules, load_rules
+from .surveillance import OutbreakMonitor
+
+__all__ = [
+    'CatalogueData', 'CatalogueError', 'CatalogueStore', 'DEFAULT_CATALOGUE_PATH', 'Disease', 'DiseaseCatalogue',
+    'DiseaseMatch', 'Interview', 'LikelihoodTable', 'LivestockHealthAdvisor', 'OutbreakMonitor', 'QuestionTable',
+    'REFERENCE_RULES', 'RemedyTable', 'ResultCache', 'ResultPage', 'RuleBasedAdvisor', 'RuleError', 'RuleNetwork',
+    'RuleSession', 'SYMPTOM_SYNONYMS', 'SymptomNormalizer', 'TextIndex', 'Treatment', 'compile_rules', 'load_rules',
+    'tokenize',
+]
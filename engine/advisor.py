@@ -0,0 +1,758 @@
+# Rule-based diagnosis engine: catalogue records, indexes and the advisor rules.
+# Shared by the Flask app and the command-line tools; nothing here depends on Flask.
+
+import heapq
+import itertools
+import math
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, namedtuple
+
+from .interview import QuestionTable
+from .normalize import SymptomNormalizer, normalize_key
+from .remedies import RemedyTable
+from .vector import SymptomMatrix
+
+# Immutable catalogue records: built once at load and shared by all requests
+Treatment = namedtuple('Treatment', ['type', 'details'])
+Disease = namedtuple('Disease', [
+    'id', 'name', 'symptoms', 'description', 'severity', 'treatments',
+    'urgent', 'severity_score', 'symptom_mask'
+])
+
+# One page of ranked results: the matches shown and how many diseases
+# survived the rules in total
+ResultPage = namedtuple('ResultPage', ['results', 'total', 'offset', 'limit'])
+
+# Indexes derived from one animal's diseases, as stored in the compiled
+# catalogue so a load does not have to rebuild them: the symptom vocabulary in
+# bit order, each disease's symptom bitmask, severity score and urgent flag,
+# and the text index as sorted tokens with flat [disease position, weight, ...]
+# postings
+AnimalIndex = namedtuple('AnimalIndex', ['vocabulary', 'masks', 'severity_scores', 'urgent', 'tokens', 'postings'])
+
+# Per-request view of a matched disease: only the query-dependent fields live
+# here, everything else is read through from the shared Disease record
+class DiseaseMatch:
+    __slots__ = ('disease', 'matching_symptoms', 'symptom_coverage', 'probability')
+
+    def __init__(self, disease, matching_symptoms=(), symptom_coverage=0, probability=None):
+        self.disease = disease
+        self.matching_symptoms = matching_symptoms
+        self.symptom_coverage = symptom_coverage
+        # Posterior probability (0-1) under likelihood ranking, else None
+        self.probability = probability
+
+    def __getattr__(self, name):
+        return getattr(self.disease, name)
+
+    def __repr__(self):
+        return 'DiseaseMatch(%r, coverage=%r)' % (self.disease.name, self.symptom_coverage)
+
+    # JSON-friendly summary used by the diagnosis API
+    def to_dict(self):
+        return {
+            'id': self.disease.id,
+            'name': self.disease.name,
+            'severity': self.disease.severity,
+            'severity_score': self.disease.severity_score,
+            'urgent': self.disease.urgent,
+            'symptom_coverage': self.symptom_coverage,
+            'matching_symptoms': list(self.matching_symptoms),
+            'probability': self.probability,
+        }
+
+def tokenize(text):
+    return re.findall(r'[a-z0-9]+', text.lower())
+
+# (position, weight) pairs of a flat posting
+def pairs(posting):
+    values = iter(posting)
+    return zip(values, values)
+
+# Flat [disease position, weight, ...] postings of consecutive tokens, stored
+# back to back in one sequence of unsigned 32-bit words: token i's are
+# words[starts[i]:starts[i + 1]]. Built from lists the words are an array;
+# loaded from the compiled catalogue they are a memoryview of its mapped file,
+# so they are only paged in when searched and stay shared between processes.
+class PostingList:
+    def __init__(self, words, starts):
+        self.words = words
+        self.starts = starts
+
+    @classmethod
+    def from_lists(cls, postings):
+        words = array('I')
+        starts = array('I', [0])
+        for posting in postings:
+            words.extend(posting)
+            starts.append(len(words))
+        return cls(words, starts)
+
+    def __len__(self):
+        return len(self.starts) - 1
+
+    def __getitem__(self, number):
+        return self.words[self.starts[number]:self.starts[number + 1]]
+
+    def __iter__(self):
+        return (self[number] for number in range(len(self)))
+
+# Inverted index over one animal's diseases: sorted tokens and their
+# postings. A query term matches every token it prefixes.
+class TextIndex:
+    FIELD_WEIGHTS = (('name', 3), ('symptoms', 2), ('description', 1), ('treatments', 1))
+
+    def __init__(self, diseases):
+        weights = {}
+        for position, disease in enumerate(diseases):
+            for field, weight in self.FIELD_WEIGHTS:
+                for token in tokenize(self.field_text(disease, field)):
+                    posting = weights.setdefault(token, {})
+                    posting[position] = posting.get(position, 0) + weight
+        self.diseases = diseases
+        self.tokens = sorted(weights)
+        self.postings = PostingList.from_lists(
+            [value for position, weight in weights[token].items() for value in (position, weight)]
+            for token in self.tokens
+        )
+
+    # Rebuild from postings exported by flat_postings (positions index
+    # diseases): lists, or a PostingList that is used as is
+    @classmethod
+    def from_postings(cls, diseases, tokens, postings):
+        index = cls.__new__(cls)
+        index.diseases = diseases
+        index.tokens = list(tokens)
+        index.postings = postings if isinstance(postings, PostingList) else PostingList.from_lists(postings)
+        return index
+
+    # Postings per token (in token order) as flat [disease position, weight, ...] lists
+    def flat_postings(self, diseases):
+        if diseases is self.diseases:
+            return [list(posting) for posting in self.postings]
+        positions = {id(disease): position for position, disease in enumerate(diseases)}
+        return [
+            [value for position, weight in pairs(posting) for value in (positions[id(self.diseases[position])], weight)]
+            for posting in self.postings
+        ]
+
+    @staticmethod
+    def field_text(disease, field):
+        if field == 'symptoms':
+            return ' '.join(disease.symptoms)
+        if field == 'treatments':
+            return ' '.join(treatment.details for treatment in disease.treatments)
+        return getattr(disease, field)
+
+    # Relevance score per matching disease (by id); every query term must match
+    def search(self, text):
+        scores = None
+        for term in tokenize(text):
+            term_scores = {}
+            number = bisect_left(self.tokens, term)
+            while number < len(self.tokens) and self.tokens[number].startswith(term):
+                for position, weight in pairs(self.postings[number]):
+                    disease_id = id(self.diseases[position])
+                    term_scores[disease_id] = term_scores.get(disease_id, 0) + weight
+                number += 1
+
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {disease_id: scores[disease_id] + weight
+                          for disease_id, weight in term_scores.items() if disease_id in scores}
+            if not scores:
+                return {}
+        return scores or {}
+
+# Naive Bayes log-probability tables for one animal's diseases.
+# Every disease observes each of its listed symptoms with probability LISTED
+# and any other vocabulary symptom with probability UNLISTED, under a uniform
+# prior. The log-likelihood of an observed symptom set S then is
+#   base[d] + hits * HIT + (|S| - hits) * MISS
+# where base[d] = log prior + log P(no symptom observed | d) is precomputed and
+# hits is the same popcount rule 2 uses, so scoring costs no more than counting.
+class LikelihoodTable:
+    LISTED = 0.9
+    UNLISTED = 0.01
+
+    def __init__(self, diseases, vocabulary_size):
+        log_prior = -math.log(len(diseases)) if diseases else 0.0
+        self.hit = math.log(self.LISTED) - math.log1p(-self.LISTED)
+        self.miss = math.log(self.UNLISTED) - math.log1p(-self.UNLISTED)
+        self.base = [
+            log_prior
+            + len(disease.symptoms) * math.log1p(-self.LISTED)
+            + (vocabulary_size - len(disease.symptoms)) * math.log1p(-self.UNLISTED)
+            for disease in diseases
+        ]
+
+    # Log-likelihood per disease given the query bitmask
+    def scores(self, diseases, query_mask):
+        observed = query_mask.bit_count()
+        return [
+            base + hits * self.hit + (observed - hits) * self.miss
+            for base, hits in zip(self.base, ((disease.symptom_mask & query_mask).bit_count() for disease in diseases))
+        ]
+
+# Frozen, indexed copy of the disease database, symptom lists and keyword
+# remedy rules. indexes ({animal_type: AnimalIndex}, from the compiled
+# catalogue) supplies the derived structures instead of rebuilding them.
+class DiseaseCatalogue:
+    _versions = itertools.count(1)
+
+    def __init__(self, database, symptom_lists, remedies=None, vectorize=False, indexes=None):
+        # Distinguishes catalogue generations in cache keys
+        self.version = next(self._versions)
+        self.diseases = {}
+        self.symptoms = {}
+        self.symptom_bits = {}
+        self.text_index = {}
+        self.likelihoods = {}
+        # Disease x symptom matrices for the numpy engine (only when vectorize)
+        self.symptom_matrix = {}
+        # Symptom holders and co-occurrence counts for the interview mode,
+        # built on first use (see question_table)
+        self.questions = {}
+        self._questions_lock = threading.Lock()
+        # Free-text symptom -> vocabulary symptom (typos and synonyms)
+        self.normalizers = {}
+        # Per-species keyword -> remedies tables (the command-line rule set)
+        self.remedy_table = RemedyTable(remedies)
+
+        for animal_type, entries in database.items():
+            index = indexes.get(animal_type) if indexes else None
+            if index is not None:
+                symptom_bits = {symptom: 1 << position for position, symptom in enumerate(index.vocabulary)}
+                masks, severity_scores, urgent = index.masks, index.severity_scores, index.urgent
+            else:
+                # One integer bit per symptom in the animal's vocabulary
+                symptom_bits = {}
+                for symptom in symptom_lists.get(animal_type, []):
+                    symptom_bits.setdefault(symptom, 1 << len(symptom_bits))
+                for entry in entries:
+                    for symptom in entry['symptoms']:
+                        symptom_bits.setdefault(symptom, 1 << len(symptom_bits))
+
+                masks = []
+                for entry in entries:
+                    mask = 0
+                    for symptom in entry['symptoms']:
+                        mask |= symptom_bits[symptom]
+                    masks.append(mask)
+                severity_scores = [LivestockHealthAdvisor.apply_severity_rating(entry['severity'])
+                                   for entry in entries]
+                urgent = [LivestockHealthAdvisor.flag_critical_conditions(entry['severity']) for entry in entries]
+
+            # A symptom listed twice is one symptom: the rules count symptoms
+            # by walking disease.symptoms
+            records = tuple(
+                Disease(
+                    id=entry['id'],
+                    name=entry['name'],
+                    symptoms=tuple(dict.fromkeys(entry['symptoms'])),
+                    description=entry['description'],
+                    severity=entry['severity'],
+                    treatments=tuple(Treatment(t['type'], t['details']) for t in entry['treatments']),
+                    urgent=urgent[position],
+                    severity_score=severity_scores[position],
+                    symptom_mask=masks[position]
+                )
+                for position, entry in enumerate(entries)
+            )
+
+            self.diseases[animal_type] = records
+            self.symptoms[animal_type] = tuple(symptom_lists.get(animal_type, []))
+            self.symptom_bits[animal_type] = symptom_bits
+            if index is not None:
+                self.text_index[animal_type] = TextIndex.from_postings(records, index.tokens, index.postings)
+            else:
+                self.text_index[animal_type] = TextIndex(records)
+            self.likelihoods[animal_type] = LikelihoodTable(records, len(symptom_bits))
+            self.normalizers[animal_type] = SymptomNormalizer(symptom_bits)
+            if vectorize:
+                self.symptom_matrix[animal_type] = SymptomMatrix(records, symptom_bits)
+
+    # The interview table of one animal. Only interviews use it, so it is
+    # built when the first one starts rather than on every (re)load.
+    def question_table(self, animal_type):
+        table = self.questions.get(animal_type)
+        if table is None:
+            with self._questions_lock:
+                table = self.questions.get(animal_type)
+                if table is None:
+                    table = QuestionTable(self.diseases[animal_type], self.symptom_bits[animal_type])
+                    self.questions[animal_type] = table
+        return table
+
+    # The derived structures in the form the compiled catalogue stores them
+    def export_indexes(self):
+        return {
+            animal_type: AnimalIndex(
+                vocabulary=tuple(self.symptom_bits[animal_type]),
+                masks=[disease.symptom_mask for disease in diseases],
+                severity_scores=[disease.severity_score for disease in diseases],
+                urgent=[disease.urgent for disease in diseases],
+                tokens=self.text_index[animal_type].tokens,
+                postings=self.text_index[animal_type].flat_postings(diseases),
+            )
+            for animal_type, diseases in self.diseases.items()
+        }
+
+    # Bitmask of the selected symptoms that exist in the animal's vocabulary
+    def symptom_mask(self, animal_type, selected_symptoms):
+        symptom_bits = self.symptom_bits[animal_type]
+        mask = 0
+        for symptom in selected_symptoms:
+            mask |= symptom_bits.get(symptom, 0)
+        return mask
+
+    # Symptoms as typed mapped to the animal's vocabulary ("Cough",
+    # "coughin" and "cough" all become "coughing"); unrecognised ones are kept
+    def normalize_symptoms(self, animal_type, symptoms):
+        normalizer = self.normalizers.get(animal_type)
+        return normalizer.normalize(symptoms) if normalizer else list(dict.fromkeys(symptoms))
+
+    # Symptoms in vocabulary order (unknown ones last, alphabetically)
+    def ordered_symptoms(self, animal_type, selected_symptoms):
+        symptom_bits = self.symptom_bits[animal_type]
+        unknown = 1 << len(symptom_bits)
+        return sorted(set(selected_symptoms), key=lambda s: (symptom_bits.get(s, unknown), s))
+
+# Thread-safe bounded LRU cache with optional time-to-live and hit/miss counters
+class ResultCache:
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self, *args):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {'size': len(self._entries), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+# Stand-in for Instrumentation.time_rule when instrumentation is off
+def run_untimed(name, input_size, rule, *args):
+    return rule(*args)
+
+# Rule-based disease diagnostic system
+class LivestockHealthAdvisor:
+    SEVERITY_SCORES = {
+        "Low": 1,
+        "Moderate": 2,
+        "Moderate to High": 3,
+        "High": 4,
+        "Critical": 5,
+        "Critical - Reportable Disease": 5
+    }
+
+    RANKINGS = ('count', 'likelihood')
+
+    def __init__(self, database, symptom_lists, remedies=None, indexes=None, cache_size=1024, cache_ttl=None,
+                 search_mode='index', engine='bitset'):
+        if search_mode not in ('index', 'substring'):
+            raise ValueError("search_mode must be 'index' or 'substring'")
+        if engine not in ('bitset', 'numpy'):
+            raise ValueError("engine must be 'bitset' or 'numpy'")
+        self.search_mode = search_mode
+        self.engine = engine
+        # Optional metrics.Instrumentation; None keeps the rules untimed
+        self.instrumentation = None
+        # Called with a new catalogue before it is swapped in, to build what
+        # is derived from it; each returns a callable (or None) that installs
+        # the result and is run right after the swap. A preparer that raises
+        # rejects the reload and leaves everything as it was.
+        self.reload_preparers = []
+        # Called with the new catalogue once it is swapped in (cache clears;
+        # must not fail)
+        self.reload_listeners = []
+        self.catalogue = self.build_catalogue(database, symptom_lists, remedies, indexes)
+        self.result_cache = ResultCache(cache_size, cache_ttl)
+        self.reload_listeners.append(self.result_cache.clear)
+
+    # Swap in a freshly compiled catalogue and notify anything derived from it.
+    # The new catalogue and everything derived from it are fully built before
+    # the single reference assignment, so a request never sees a half-loaded
+    # database and a failed build leaves the old catalogue in place.
+    def load_catalogue(self, database, symptom_lists, remedies=None, indexes=None):
+        catalogue = self.build_catalogue(database, symptom_lists, remedies, indexes)
+        installers = [prepare(catalogue) for prepare in self.reload_preparers]
+        self.catalogue = catalogue
+        for install in installers:
+            if install is not None:
+                install()
+        for listener in self.reload_listeners:
+            listener(catalogue)
+
+    def build_catalogue(self, database, symptom_lists, remedies=None, indexes=None):
+        return DiseaseCatalogue(database, symptom_lists, remedies, self.engine == 'numpy', indexes)
+
+    # Rule 1: Filter diseases based on selected symptoms
+    def filter_by_symptoms(self, animal_type, selected_symptoms, catalogue=None):
+        catalogue = catalogue or self.catalogue
+        diseases = catalogue.diseases[animal_type]
+        if not selected_symptoms:
+            return list(diseases)
+
+        query_mask = catalogue.symptom_mask(animal_type, selected_symptoms)
+        return [disease for disease in diseases if disease.symptom_mask & query_mask]
+
+    # Rule 2: Sort diseases by symptom match count (highest first)
+    def sort_by_match_count(self, animal_type, diseases, selected_symptoms, catalogue=None):
+        if not selected_symptoms:
+            return diseases
+
+        query_mask = (catalogue or self.catalogue).symptom_mask(animal_type, selected_symptoms)
+        # sorted() is stable, so ties keep their catalogue order
+        return sorted(
+            diseases,
+            key=lambda disease: (disease.symptom_mask & query_mask).bit_count(),
+            reverse=True
+        )
+
+    # Rules 1 and 2 in a single pass: one AND + popcount per disease
+    def rank_by_symptoms(self, animal_type, selected_symptoms, catalogue=None):
+        catalogue = catalogue or self.catalogue
+        diseases = catalogue.diseases[animal_type]
+        if not selected_symptoms:
+            return list(diseases)
+
+        if self.engine == 'numpy':
+            matrix = catalogue.symptom_matrix[animal_type]
+            return [diseases[row] for row in matrix.rank(matrix.match_counts(selected_symptoms))]
+
+        return [disease for _, _, disease in sorted(self.symptom_sort_keys(animal_type, selected_symptoms, catalogue))]
+
+    # Rules 1 and 2 without the sort: (key, position, disease) for every
+    # disease that passes rule 1, where ascending order is rank order
+    def symptom_sort_keys(self, animal_type, selected_symptoms, catalogue=None):
+        catalogue = catalogue or self.catalogue
+        diseases = catalogue.diseases[animal_type]
+        if not selected_symptoms:
+            return [(0, position, disease) for position, disease in enumerate(diseases)]
+
+        if self.engine == 'numpy':
+            matrix = catalogue.symptom_matrix[animal_type]
+            counts = matrix.match_counts(selected_symptoms)
+            return [(-int(counts[row]), row, diseases[row]) for row in counts.nonzero()[0].tolist()]
+
+        query_mask = catalogue.symptom_mask(animal_type, selected_symptoms)
+        keys = []
+        for position, disease in enumerate(diseases):
+            count = (disease.symptom_mask & query_mask).bit_count()
+            if count:
+                keys.append((-count, position, disease))
+        return keys
+
+    # Rules 1 and 2, likelihood mode: keep diseases matching a selected symptom,
+    # ordered by naive Bayes posterior. Posteriors are normalized over the
+    # animal's whole catalogue and written into `probabilities` by id(disease).
+    def rank_by_likelihood(self, animal_type, selected_symptoms, catalogue=None, probabilities=None):
+        keys = self.likelihood_sort_keys(animal_type, selected_symptoms, catalogue, probabilities)
+        return [disease for _, _, disease in sorted(keys)]
+
+    def likelihood_sort_keys(self, animal_type, selected_symptoms, catalogue=None, probabilities=None):
+        catalogue = catalogue or self.catalogue
+        diseases = catalogue.diseases[animal_type]
+        if not diseases:
+            return []
+
+        query_mask = catalogue.symptom_mask(animal_type, selected_symptoms)
+        scores = catalogue.likelihoods[animal_type].scores(diseases, query_mask)
+        peak = max(scores)
+        normalizer = peak + math.log(math.fsum(math.exp(score - peak) for score in scores))
+
+        keys = []
+        for position, (disease, score) in enumerate(zip(diseases, scores)):
+            if not selected_symptoms or disease.symptom_mask & query_mask:
+                keys.append((-score, position, disease))
+                if probabilities is not None:
+                    probabilities[id(disease)] = math.exp(score - normalizer)
+        return keys
+
+    # Rule 3: Filter by search text in name, description, symptoms or treatments.
+    # With rank_by_relevance the survivors are reordered by text relevance
+    # (used when no symptoms were selected to rank by).
+    def filter_by_search_text(self, animal_type, diseases, search_text, rank_by_relevance=False, catalogue=None):
+        if not search_text:
+            return diseases
+        if self.search_mode == 'substring':
+            return self.filter_by_substring(diseases, search_text)
+
+        scores = (catalogue or self.catalogue).text_index[animal_type].search(search_text)
+        filtered_diseases = [disease for disease in diseases if id(disease) in scores]
+        if rank_by_relevance:
+            # sort() is stable, so equal scores keep their current order
+            filtered_diseases.sort(key=lambda disease: scores[id(disease)], reverse=True)
+        return filtered_diseases
+
+    # Rule 3 over sort keys from the functions above. When rank_by_relevance,
+    # the keys of the survivors are replaced by their text relevance.
+    def filter_sort_keys_by_search_text(self, animal_type, keys, search_text, rank_by_relevance=False,
+                                        catalogue=None):
+        if not search_text:
+            return keys
+        if self.search_mode == 'substring':
+            matched = {id(disease) for disease in self.filter_by_substring([key[2] for key in keys], search_text)}
+            return [key for key in keys if id(key[2]) in matched]
+
+        scores = (catalogue or self.catalogue).text_index[animal_type].search(search_text)
+        if rank_by_relevance:
+            return [(-scores[id(disease)], position, disease) for _, position, disease in keys if id(disease) in scores]
+        return [key for key in keys if id(key[2]) in scores]
+
+    # Legacy rule 3: plain substring scan of name, description and symptoms
+    def filter_by_substring(self, diseases, search_text):
+        filtered_diseases = []
+        search_text = search_text.lower()
+        
+        for disease in diseases:
+            # Check if text is in disease name
+            if search_text in disease.name.lower():
+                filtered_diseases.append(disease)
+                continue
+                
+            # Check if text is in description
+            if search_text in disease.description.lower():
+                filtered_diseases.append(disease)
+                continue
+                
+            # Check if text is in any symptom
+            if any(search_text in symptom for symptom in disease.symptoms):
+                filtered_diseases.append(disease)
+                continue
+                
+        return filtered_diseases
+    
+    # Rule 4: Identify critical conditions that require immediate veterinary attention
+    # (static per disease, so it is evaluated once when the catalogue is loaded)
+    @staticmethod
+    def flag_critical_conditions(severity):
+        return "Critical" in severity
+    
+    # Rule 5: Calculate symptom coverage percentage
+    def calculate_symptom_coverage(self, animal_type, diseases, selected_symptoms, catalogue=None,
+                                   probabilities=None):
+        probabilities = probabilities or {}
+        if not selected_symptoms:
+            return [DiseaseMatch(disease, probability=probabilities.get(id(disease))) for disease in diseases]
+
+        catalogue = catalogue or self.catalogue
+        symptom_bits = catalogue.symptom_bits[animal_type]
+        query_mask = catalogue.symptom_mask(animal_type, selected_symptoms)
+        matches = []
+        for disease in diseases:
+            # Listed in the disease's own symptom order, so the result does not
+            # depend on the order the symptoms were ticked in
+            matching_symptoms = tuple(s for s in disease.symptoms if symptom_bits[s] & query_mask)
+            matches.append(DiseaseMatch(
+                disease,
+                matching_symptoms,
+                len(matching_symptoms) / len(selected_symptoms) * 100,
+                probabilities.get(id(disease))
+            ))
+
+        return matches
+    
+    # Rule 6: Apply severity rating score
+    # (static per disease, so it is evaluated once when the catalogue is loaded)
+    @staticmethod
+    def apply_severity_rating(severity):
+        # Extract base severity without additional text
+        base_severity = severity.split(' - ')[0] if ' - ' in severity else severity
+        return LivestockHealthAdvisor.SEVERITY_SCORES.get(base_severity, 0)
+    
+    # Free text that matches nothing as typed may still be a misspelt or
+    # synonymous symptom ("nasal discharges", "runny nose"); it is then
+    # replaced by the symptom it normalizes to. Text that matches is kept.
+    def resolve_search_text(self, animal_type, search_text, catalogue=None):
+        catalogue = catalogue or self.catalogue
+        normalizer = catalogue.normalizers.get(animal_type)
+        if normalizer is None or not search_text.strip():
+            return search_text
+        symptom = normalizer.lookup(search_text)
+        if symptom is None or normalize_key(symptom) == normalize_key(search_text):
+            return search_text
+        if self.search_mode == 'substring':
+            matched = self.filter_by_substring(catalogue.diseases[animal_type], search_text)
+        else:
+            matched = catalogue.text_index[animal_type].search(search_text)
+        return search_text if matched else symptom
+
+    # Results only depend on the catalogue generation, the animal, the set of
+    # symptoms, the lowercased search text and the ranking mode, so that tuple
+    # is the cache key
+    def cache_key(self, animal_type, selected_symptoms, search_text, catalogue=None, ranking='count', offset=0,
+                  limit=None):
+        catalogue = catalogue or self.catalogue
+        return (catalogue.version, animal_type, frozenset(selected_symptoms), search_text.lower(), ranking,
+                offset, limit)
+
+    # Main search method that applies all rules.
+    # ranking: 'count' orders by matching symptom count (rule 2),
+    # 'likelihood' by naive Bayes posterior, exposed as match.probability.
+    # With a limit, returns a ResultPage of at most `limit` matches starting
+    # at `offset` instead of the full list.
+    def search_diseases(self, animal_type, selected_symptoms, search_text, ranking='count', limit=None, offset=0):
+        if ranking not in self.RANKINGS:
+            raise ValueError("ranking must be one of %s" % ', '.join(self.RANKINGS))
+        if limit is not None and (limit < 0 or offset < 0):
+            raise ValueError("limit and offset must not be negative")
+        # Pin one catalogue for the whole request, even if a reload swaps it
+        catalogue = self.catalogue
+        offset = offset if limit is not None else 0
+        key = self.cache_key(animal_type, selected_symptoms, search_text, catalogue, ranking, offset, limit)
+        cached = self.result_cache.get(key)
+        if cached is not None:
+            return cached._replace(results=list(cached.results)) if limit is not None else list(cached)
+
+        if limit is not None:
+            page = self.evaluate_page(animal_type, selected_symptoms, search_text, catalogue, ranking, offset, limit)
+            self.result_cache.put(key, page._replace(results=tuple(page.results)))
+            return page
+
+        results = self.evaluate_rules(animal_type, selected_symptoms, search_text, catalogue, ranking=ranking)
+        self.result_cache.put(key, tuple(results))
+        return results
+
+    # ranked: output of rules 1 and 2 when already computed (batch scoring)
+    def evaluate_rules(self, animal_type, selected_symptoms, search_text, catalogue=None, ranked=None,
+                       ranking='count'):
+        catalogue = catalogue or self.catalogue
+        # A symptom ticked twice (e.g. in both animal lists) counts once
+        selected_symptoms = list(dict.fromkeys(selected_symptoms))
+
+        run = self.instrumentation.time_rule if self.instrumentation is not None else run_untimed
+
+        # Apply rules in sequence; rules 4 and 6 are already baked into the
+        # catalogue records, and nothing here writes to shared state
+        # Rules 1 and 2 share one scoring pass over the symptom index
+        probabilities = None
+        results = ranked
+        if ranking == 'likelihood':
+            probabilities = {}
+            results = run('rank_by_likelihood', len(catalogue.diseases[animal_type]),
+                          self.rank_by_likelihood, animal_type, selected_symptoms, catalogue, probabilities)
+        elif results is None:
+            results = run('rank_by_symptoms', len(catalogue.diseases[animal_type]),
+                          self.rank_by_symptoms, animal_type, selected_symptoms, catalogue)
+        # Text relevance only reorders when nothing else ranked the diseases
+        rank_by_relevance = not selected_symptoms and ranking == 'count'
+        results = run('filter_by_search_text', len(results),
+                      self.filter_by_search_text, animal_type, results, search_text, rank_by_relevance, catalogue)
+        results = run('calculate_symptom_coverage', len(results),
+                      self.calculate_symptom_coverage, animal_type, results, selected_symptoms, catalogue,
+                      probabilities)
+        
+        return results
+
+    # Rules 1-3 and 5 for one page of results. Every survivor of rules 1-3 gets
+    # a sort key, but only the best offset + limit are put in order (a heap
+    # selection, O(n log k) instead of a full sort) and only the shown ones go
+    # through rule 5.
+    def evaluate_page(self, animal_type, selected_symptoms, search_text, catalogue=None, ranking='count', offset=0,
+                      limit=20):
+        catalogue = catalogue or self.catalogue
+        selected_symptoms = list(dict.fromkeys(selected_symptoms))
+        diseases = catalogue.diseases[animal_type]
+
+        run = self.instrumentation.time_rule if self.instrumentation is not None else run_untimed
+
+        probabilities = None
+        if ranking == 'likelihood':
+            probabilities = {}
+            keys = run('rank_by_likelihood', len(diseases),
+                       self.likelihood_sort_keys, animal_type, selected_symptoms, catalogue, probabilities)
+        else:
+            keys = run('rank_by_symptoms', len(diseases),
+                       self.symptom_sort_keys, animal_type, selected_symptoms, catalogue)
+        rank_by_relevance = not selected_symptoms and ranking == 'count'
+        keys = run('filter_by_search_text', len(keys),
+                   self.filter_sort_keys_by_search_text, animal_type, keys, search_text, rank_by_relevance, catalogue)
+
+        shown = [disease for _, _, disease in heapq.nsmallest(offset + limit, keys)[offset:]]
+        results = run('calculate_symptom_coverage', len(shown),
+                      self.calculate_symptom_coverage, animal_type, shown, selected_symptoms, catalogue,
+                      probabilities)
+        return ResultPage(results, len(keys), offset, limit)
+
+    # Evaluate many (animal_type, symptoms, search_text) cases in one call.
+    # Identical cases (same animal, same symptom set, same text) are only
+    # evaluated once and share their result list; with the numpy engine all
+    # uncached cases of an animal are scored in one matrix product.
+    # Cases are (animal_type, symptoms, search_text[, ranking]) tuples.
+    def diagnose_batch(self, cases):
+        catalogue = self.catalogue
+        cases = [tuple(case) if len(case) > 3 else tuple(case) + ('count',) for case in cases]
+        keys = [self.cache_key(animal_type, selected_symptoms, search_text, catalogue, ranking)
+                for animal_type, selected_symptoms, search_text, ranking in cases]
+        evaluated = {}
+        pending = {}
+        for key, case in zip(keys, cases):
+            if key in evaluated or key in pending:
+                continue
+            cached = self.result_cache.get(key)
+            if cached is not None:
+                evaluated[key] = list(cached)
+            else:
+                pending[key] = case
+
+        ranked = self.rank_batch(pending, catalogue) if self.engine == 'numpy' else {}
+        for key, (animal_type, selected_symptoms, search_text, ranking) in pending.items():
+            results = self.evaluate_rules(animal_type, selected_symptoms, search_text, catalogue, ranked.get(key),
+                                          ranking)
+            self.result_cache.put(key, tuple(results))
+            evaluated[key] = results
+        return [evaluated[key] for key in keys]
+
+    # Rules 1 and 2 for many cases: one matrix-matrix product per animal type
+    def rank_batch(self, cases_by_key, catalogue):
+        by_animal = {}
+        for key, (animal_type, selected_symptoms, _, ranking) in cases_by_key.items():
+            if selected_symptoms and ranking == 'count':
+                by_animal.setdefault(animal_type, []).append((key, selected_symptoms))
+
+        ranked = {}
+        for animal_type, queries in by_animal.items():
+            diseases = catalogue.diseases[animal_type]
+            matrix = catalogue.symptom_matrix[animal_type]
+            counts = matrix.batch_match_counts([selected_symptoms for _, selected_symptoms in queries])
+            for (key, _), row in zip(queries, counts):
+                ranked[key] = [diseases[position] for position in matrix.rank(row)]
+        return ranked
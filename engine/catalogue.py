@@ -0,0 +1,330 @@
+# Disease catalogue storage: JSON source file, compiled binary form and hot reload.
+#
+# The JSON file ({"symptoms": {...}, "diseases": {...}, "remedies": {...}}) is
+# the editable source; "remedies" holds the keyword remedy rules (see
+# remedies.py) and is optional.
+# It is compiled into a compact binary file that is read through mmap. The
+# compiled file is a persistent cache: it carries the SHA-256 of the source it
+# was built from and is only rebuilt when that no longer matches, and besides
+# the records it stores everything DiseaseCatalogue would otherwise derive at
+# load -- symptom vocabularies in bit order, disease bitmasks, severity scores
+# and urgent flags, and the text index -- so a start only decodes.
+#
+# The records, vocabularies and bitmasks are decoded into Python objects, in
+# each process that loads the file. The text index postings, the bulk of the
+# file, are not: they are read in place from the mapped pages (see
+# PostingList), which are only paged in when searched and, being file-backed
+# and read-only, are shared by every process mapping the file -- including
+# pre-forked workers, which inherit the master's map.
+#
+# Binary layout (native-endian unsigned 32-bit words):
+#   magic (8 bytes) | source sha256 (32 bytes) | string count | structure word count
+#   string offsets [count + 1] | structure words | UTF-8 string data
+# Every distinct string is stored once in the string pool; the structure words
+# describe, per animal, the symptom list, the vocabulary, the diseases (with
+# their symptoms as vocabulary positions) and the text index (token ids, the
+# start of each token's postings, then all postings back to back), then the
+# remedy diseases and keywords, by string id. The magic carries the format
+# version: bump it whenever the layout or the derived indexes change.
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from collections import namedtuple
+
+from .advisor import AnimalIndex, DiseaseCatalogue, PostingList
+
+MAGIC = b'LHCAT\x00\x04\x00'
+HEADER = struct.Struct('=8s32sII')
+
+if sys.byteorder != 'little':  # memoryview.cast('I') reads native-endian words
+    raise ImportError("the compiled catalogue format assumes a little-endian host")
+
+
+DEFAULT_CATALOGUE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                      'data', 'catalogue.json')
+
+# indexes ({animal_type: AnimalIndex}) is None when read from the JSON source
+CatalogueData = namedtuple('CatalogueData', ['database', 'symptom_lists', 'remedies', 'indexes'],
+                           defaults=[None, None])
+
+
+class CatalogueError(ValueError):
+    pass
+
+
+def parse_source(raw, path):
+    data = json.loads(raw)
+    if not isinstance(data, dict) or 'diseases' not in data or 'symptoms' not in data:
+        raise CatalogueError("%s: expected an object with 'symptoms' and 'diseases'" % path)
+    return CatalogueData(data['diseases'], data['symptoms'], data.get('remedies'))
+
+
+def read_source(path):
+    with open(path, 'rb') as source:
+        return parse_source(source.read(), path)
+
+
+# Serialize the catalogue and its derived indexes into the binary catalogue
+# format. source_hash identifies the source the result was compiled from.
+def compile_catalogue(database, symptom_lists, remedies=None, source_hash=bytes(32)):
+    indexes = DiseaseCatalogue(database, symptom_lists, remedies).export_indexes()
+    string_ids = {}
+    strings = []
+
+    def sid(text):
+        if text not in string_ids:
+            string_ids[text] = len(strings)
+            strings.append(text.encode('utf-8'))
+        return string_ids[text]
+
+    words = [len(database)]
+    for animal_type, diseases in database.items():
+        index = indexes[animal_type]
+        column = {symptom: position for position, symptom in enumerate(index.vocabulary)}
+        animal_symptoms = symptom_lists.get(animal_type, [])
+        words += [sid(animal_type), len(animal_symptoms)]
+        words += [sid(symptom) for symptom in animal_symptoms]
+        words.append(len(index.vocabulary))
+        words += [sid(symptom) for symptom in index.vocabulary]
+        words.append(len(diseases))
+        for position, disease in enumerate(diseases):
+            if not isinstance(disease['id'], int) or not 0 <= disease['id'] < 2 ** 32:
+                raise CatalogueError("disease id must be a non-negative integer: %r" % (disease['id'],))
+            words += [disease['id'], sid(disease['name']), sid(disease['description']),
+                      sid(disease['severity']), index.severity_scores[position], int(index.urgent[position]),
+                      len(disease['symptoms'])]
+            words += [column[symptom] for symptom in disease['symptoms']]
+            words.append(len(disease['treatments']))
+            for treatment in disease['treatments']:
+                words += [sid(treatment['type']), sid(treatment['details'])]
+        # Token ids, then where each token's postings start in the posting
+        # block that follows (so the block can be used as is, see PostingList)
+        words.append(len(index.tokens))
+        words += [sid(token) for token in index.tokens]
+        start = 0
+        words.append(start)
+        for posting in index.postings:
+            start += len(posting)
+            words.append(start)
+        for posting in index.postings:
+            words += posting
+
+    remedies = remedies or {'diseases': [], 'keywords': {}}
+    words.append(len(remedies['diseases']))
+    for entry in remedies['diseases']:
+        excluded_species = entry.get('excluded_species', [])
+        words += [sid(entry['name']), len(entry['remedies'])]
+        words += [sid(remedy) for remedy in entry['remedies']]
+        words.append(len(excluded_species))
+        words += [sid(species) for species in excluded_species]
+    words.append(len(remedies['keywords']))
+    for keyword, diseases in remedies['keywords'].items():
+        words += [sid(keyword), len(diseases)]
+        words += [sid(disease) for disease in diseases]
+
+    offsets = [0]
+    for encoded in strings:
+        offsets.append(offsets[-1] + len(encoded))
+
+    return b''.join([
+        HEADER.pack(MAGIC, source_hash, len(strings), len(words)),
+        struct.pack('=%dI' % len(offsets), *offsets),
+        struct.pack('=%dI' % len(words), *words),
+        b''.join(strings),
+    ])
+
+
+# Source hash recorded in a compiled catalogue, or None if the file is
+# missing, truncated or in another format version
+def compiled_source_hash(path):
+    try:
+        with open(path, 'rb') as compiled:
+            header = compiled.read(HEADER.size)
+    except FileNotFoundError:
+        return None
+    if len(header) < HEADER.size:
+        return None
+    magic, source_hash, _, _ = HEADER.unpack(header)
+    return source_hash if magic == MAGIC else None
+
+
+# Decode a mapped binary catalogue back into CatalogueData.
+# Each pooled string is decoded once, so repeated symptom names share one
+# object. The text index postings are not decoded: they stay views of the
+# buffer, which therefore lives as long as the catalogue built from it.
+def decode_catalogue(buffer):
+    with memoryview(buffer) as view:
+        magic, _, string_count, word_count = HEADER.unpack_from(view, 0)
+        if magic != MAGIC:
+            raise CatalogueError("not a compiled catalogue (bad magic)")
+
+        start = HEADER.size
+        with view[start:start + 4 * (string_count + 1)].cast('I') as offsets:
+            start += 4 * (string_count + 1)
+            data_start = start + 4 * word_count
+            with view[data_start:] as data:
+                strings = [str(data[offsets[i]:offsets[i + 1]], 'utf-8') for i in range(string_count)]
+        words = view[start:data_start].cast('I')
+        return decode_structure(words.tolist(), strings, words)
+
+
+# posting_words: the same words as stored, read by the text index postings
+# in place (the list itself when not given)
+def decode_structure(words, strings, posting_words=None):
+    if posting_words is None:
+        posting_words = words
+    cursor = 0
+
+    def take(count=1):
+        nonlocal cursor
+        cursor += count
+        return words[cursor - count:cursor]
+
+    database = {}
+    symptom_lists = {}
+    indexes = {}
+    for _ in range(take()[0]):
+        animal_type = strings[take()[0]]
+        symptom_lists[animal_type] = [strings[i] for i in take(take()[0])]
+        vocabulary = tuple(strings[i] for i in take(take()[0]))
+        diseases = database[animal_type] = []
+        masks, severity_scores, urgent = [], [], []
+        for _ in range(take()[0]):
+            disease_id, name, description, severity, severity_score, is_urgent = take(6)
+            columns = take(take()[0])
+            treatments = []
+            for _ in range(take()[0]):
+                treatment_type, details = take(2)
+                treatments.append({'type': strings[treatment_type], 'details': strings[details]})
+            diseases.append({
+                'id': disease_id,
+                'name': strings[name],
+                'symptoms': [vocabulary[column] for column in columns],
+                'description': strings[description],
+                'severity': strings[severity],
+                'treatments': treatments,
+            })
+            masks.append(sum(1 << column for column in columns))
+            severity_scores.append(severity_score)
+            urgent.append(bool(is_urgent))
+        token_count = take()[0]
+        tokens = [strings[i] for i in take(token_count)]
+        starts = array('I', take(token_count + 1))
+        postings = PostingList(posting_words[cursor:cursor + starts[-1]], starts)
+        cursor += starts[-1]
+        indexes[animal_type] = AnimalIndex(vocabulary, masks, severity_scores, urgent, tokens, postings)
+
+    remedies = {'diseases': [], 'keywords': {}}
+    for _ in range(take()[0]):
+        name = strings[take()[0]]
+        entry_remedies = [strings[i] for i in take(take()[0])]
+        excluded_species = [strings[i] for i in take(take()[0])]
+        remedies['diseases'].append({'name': name, 'remedies': entry_remedies, 'excluded_species': excluded_species})
+    for _ in range(take()[0]):
+        keyword = strings[take()[0]]
+        remedies['keywords'][keyword] = [strings[i] for i in take(take()[0])]
+    return CatalogueData(database, symptom_lists, remedies, indexes)
+
+
+# The map is never closed: the postings read from it keep it open until the
+# catalogue is garbage. CatalogueStore only ever replaces the compiled file
+# (os.replace), so a mapped old file stays intact while it is in use.
+def load_compiled(path):
+    with open(path, 'rb') as compiled:
+        mapped = mmap.mmap(compiled.fileno(), 0, access=mmap.ACCESS_READ)
+    return decode_catalogue(mapped)
+
+
+# Owns the catalogue files: recompiles the binary form when the JSON source's
+# content changed and pushes every successful load into the advisor via
+# load_catalogue
+class CatalogueStore:
+    def __init__(self, source_path, compiled_path=None):
+        self.source_path = source_path
+        self.compiled_path = compiled_path or os.path.splitext(source_path)[0] + '.lhcat'
+        # How the last load was served: 'cached' (compiled file reused),
+        # 'compiled' (rebuilt from the source) or 'source' (compiled file
+        # not writable or readable, indexes built in memory)
+        self.last_load = None
+        self._signature = None
+        self._lock = threading.Lock()
+        self._watcher = None
+
+    def source_signature(self):
+        stat = os.stat(self.source_path)
+        return stat.st_mtime_ns, stat.st_size
+
+    # Compile to a temporary file and rename it into place, so readers only
+    # ever see a complete file
+    def compile(self, raw=None):
+        if raw is None:
+            with open(self.source_path, 'rb') as source:
+                raw = source.read()
+        compiled = compile_catalogue(*parse_source(raw, self.source_path)[:3],
+                                     source_hash=hashlib.sha256(raw).digest())
+        temporary_path = '%s.%d.tmp' % (self.compiled_path, os.getpid())
+        with open(temporary_path, 'wb') as output:
+            output.write(compiled)
+        os.replace(temporary_path, self.compiled_path)
+
+    def load(self):
+        with self._lock:
+            signature = self.source_signature()
+            with open(self.source_path, 'rb') as source:
+                raw = source.read()
+            try:
+                # Keyed on content, not mtime: a touched or re-deployed but
+                # unchanged source keeps its compiled file
+                self.last_load = 'cached'
+                if compiled_source_hash(self.compiled_path) != hashlib.sha256(raw).digest():
+                    self.last_load = 'compiled'
+                    self.compile(raw)
+                data = load_compiled(self.compiled_path)
+            except OSError:
+                # Compiled file not writable or readable here (e.g. a
+                # read-only install or file system)
+                self.last_load = 'source'
+                data = parse_source(raw, self.source_path)
+            self._signature = signature
+            return data
+
+    # Reload into the advisor if the source changed since the last load.
+    # The advisor swaps its catalogue reference in one assignment, so
+    # in-flight requests keep using the catalogue they started with.
+    def reload_if_changed(self, advisor):
+        try:
+            signature = self.source_signature()
+        except OSError as error:
+            print("catalogue reload failed: %s" % error, file=sys.stderr)
+            return False
+        if signature == self._signature:
+            return False
+
+        try:
+            advisor.load_catalogue(*self.load())
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            # Keep serving the current catalogue if the new file is broken,
+            # and do not retry until the file changes again
+            self._signature = signature
+            print("catalogue reload failed: %r" % error, file=sys.stderr)
+            return False
+        return True
+
+    def watch(self, advisor, interval=2.0):
+        if self._watcher is not None or interval <= 0:
+            return
+
+        def poll():
+            while True:
+                time.sleep(interval)
+                self.reload_if_changed(advisor)
+
+        self._watcher = threading.Thread(target=poll, name='catalogue-watcher', daemon=True)
+        self._watcher.start()
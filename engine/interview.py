@@ -0,0 +1,146 @@
+# Incremental "next best question" diagnosis.
+#
+# QuestionTable holds what an interview needs for one animal, computed once per
+# catalogue when its first interview starts: the positions of the diseases listing each symptom,
+# how many diseases list it, and the symptom co-occurrence counts (for each
+# symptom, how many diseases list it together with each other symptom).
+#
+# An Interview is the state of one session: the surviving candidate diseases
+# and, for every symptom still present among them, how many candidates list
+# it. Answering narrows the candidates -- a confirmed symptom keeps the
+# diseases that list it, a ruled-out one keeps those that do not -- and
+# returns a new Interview, so a state can be shared between threads. The
+# counts are updated by scanning either the survivors or the eliminated
+# diseases, whichever is smaller, so a step costs time proportional to the
+# current candidates, not the whole catalogue. The first answer needs no scan
+# at all: the counts are a row of the co-occurrence table.
+#
+# Candidates are treated as equally likely and a disease either lists a
+# symptom or not, so asking about a symptom listed by n of N candidates gains
+# the binary entropy H(n / N) bits; the best question is the one that splits
+# the candidates closest to half. Ties go to the symptom earliest in the
+# animal's vocabulary, which puts the checkbox symptoms first.
+
+import math
+
+
+def split_entropy(listed, total):
+    if not 0 < listed < total:
+        return 0.0
+    p = listed / total
+    return -(p * math.log2(p) + (1 - p) * math.log2(1 - p))
+
+
+class QuestionTable:
+    def __init__(self, diseases, symptom_bits):
+        self.diseases = diseases
+        self.symptom_bits = symptom_bits
+        self.holders = {}
+        for position, disease in enumerate(diseases):
+            for symptom in disease.symptoms:
+                self.holders.setdefault(symptom, []).append(position)
+        self.holders = {symptom: tuple(positions) for symptom, positions in self.holders.items()}
+        self.frequency = {symptom: len(positions) for symptom, positions in self.holders.items()}
+
+        self.cooccurrence = {symptom: {} for symptom in self.holders}
+        for disease in diseases:
+            for symptom in disease.symptoms:
+                row = self.cooccurrence[symptom]
+                for other in disease.symptoms:
+                    row[other] = row.get(other, 0) + 1
+
+    def start(self):
+        return Interview(self, tuple(range(len(self.diseases))), self.frequency)
+
+    # The state reached by the given (symptom, present) answers, in order
+    def replay(self, answers):
+        interview = self.start()
+        for symptom, present in answers:
+            interview = interview.answer(symptom, present)
+        return interview
+
+
+class Interview:
+    __slots__ = ('table', 'candidates', 'counts', 'confirmed', 'ruled_out', 'skipped')
+
+    def __init__(self, table, candidates, counts, confirmed=(), ruled_out=(), skipped=()):
+        self.table = table
+        # Positions of the surviving diseases, in catalogue order
+        self.candidates = candidates
+        # symptom -> number of candidates listing it (never mutated)
+        self.counts = counts
+        self.confirmed = confirmed
+        self.ruled_out = ruled_out
+        self.skipped = skipped
+
+    @property
+    def asked(self):
+        return set(self.confirmed) | set(self.ruled_out) | set(self.skipped)
+
+    def diseases(self):
+        return [self.table.diseases[position] for position in self.candidates]
+
+    # New state after an answer: present is True (confirmed), False (ruled
+    # out) or None (unknown; the symptom is only marked as asked)
+    def answer(self, symptom, present):
+        if present is None or symptom in self.confirmed or symptom in self.ruled_out:
+            skipped = self.skipped if symptom in self.asked else self.skipped + (symptom,)
+            return Interview(self.table, self.candidates, self.counts, self.confirmed, self.ruled_out, skipped)
+
+        table = self.table
+        confirmed = self.confirmed + (symptom,) if present else self.confirmed
+        ruled_out = self.ruled_out if present else self.ruled_out + (symptom,)
+
+        if len(self.candidates) == len(table.diseases):
+            # Nothing eliminated yet: read the counts off the co-occurrence table
+            together = table.cooccurrence.get(symptom, {})
+            if present:
+                candidates = table.holders.get(symptom, ())
+                counts = together
+            else:
+                holders = set(table.holders.get(symptom, ()))
+                candidates = tuple(position for position in self.candidates if position not in holders)
+                counts = {other: count - together.get(other, 0) for other, count in self.counts.items()
+                          if count > together.get(other, 0)}
+            return Interview(table, candidates, counts, confirmed, ruled_out, self.skipped)
+
+        bit = table.symptom_bits.get(symptom, 0)
+        survivors, eliminated = [], []
+        for position in self.candidates:
+            if bool(table.diseases[position].symptom_mask & bit) == present:
+                survivors.append(position)
+            else:
+                eliminated.append(position)
+
+        if len(survivors) <= len(eliminated):
+            counts = {}
+            for position in survivors:
+                for other in table.diseases[position].symptoms:
+                    counts[other] = counts.get(other, 0) + 1
+        else:
+            counts = dict(self.counts)
+            for position in eliminated:
+                for other in table.diseases[position].symptoms:
+                    counts[other] -= 1
+                    if not counts[other]:
+                        del counts[other]
+        return Interview(table, tuple(survivors), counts, confirmed, ruled_out, self.skipped)
+
+    # (symptom, information gain in bits, candidates listing it) of the most
+    # discriminating unasked symptom, or None when no question splits the
+    # candidates any further
+    def next_question(self):
+        total = len(self.candidates)
+        asked = self.asked
+        symptom_bits = self.table.symptom_bits
+        best = None
+        best_key = None
+        for symptom, listed in self.counts.items():
+            if listed >= total or symptom in asked:
+                continue
+            key = (-min(listed, total - listed), symptom_bits[symptom])
+            if best_key is None or key < best_key:
+                best, best_key = symptom, key
+        if best is None:
+            return None
+        return best, split_entropy(self.counts[best], total), self.counts[best]
@@ -0,0 +1,194 @@
+# Free-text symptom normalization.
+#
+# SymptomNormalizer maps what a user types ("Cough", "coughing ", "nasal
+# discharges", "runny nose") to an entry of a fixed symptom vocabulary, in
+# three steps:
+#
+#   1. the text is reduced to a key: lowercase words separated by single
+#      spaces, so case, punctuation and stray whitespace never matter
+#   2. the key is looked up among the vocabulary and the synonyms of its
+#      entries (SYMPTOM_SYNONYMS: groups of equivalent terms; whichever member
+#      of a group is in the vocabulary is the canonical one)
+#   3. otherwise the closest vocabulary entry or synonym by edit distance is
+#      taken, allowing one typo in keys under 8 characters and two in longer
+#      ones (none under 4)
+#
+# Step 3 uses a partition index. Every key is cut into segments of about
+# SEGMENT_LENGTH characters (at least MAX_DISTANCE + 1 of them). Each typo
+# breaks at most one segment, so a key within d typos of the query keeps all
+# but d of its segments intact, each within d characters of its own position
+# in the query. For every possible key length a lookup therefore probes each
+# segment around its position (one dict lookup each), and only the keys
+# found with enough intact segments get their edit distance computed. Keys
+# sharing a common word with the query are mostly dropped by that count, so
+# the cost does not grow with the vocabulary; results are also cached.
+
+import re
+from functools import lru_cache
+
+MAX_DISTANCE = 2
+SEGMENT_LENGTH = 4
+
+# Groups of equivalent symptom terms
+SYMPTOM_SYNONYMS = (
+    ('coughing', 'cough', 'coughs'),
+    ('nasal discharge', 'runny nose', 'snotty nose', 'nose discharge'),
+    ('fever', 'high temperature', 'temperature', 'pyrexia', 'feverish'),
+    ('reduced appetite', 'loss of appetite', 'poor appetite', 'off feed', 'not eating', 'inappetence'),
+    ('labored breathing', 'laboured breathing', 'difficulty breathing', 'breathing difficulty', 'dyspnea',
+     'dyspnoea'),
+    ('swollen udder', 'udder swelling'),
+    ('pain in udder', 'painful udder', 'sore udder', 'udder pain'),
+    ('reduced milk production', 'milk drop', 'low milk yield', 'less milk', 'reduced milk yield'),
+    ('blisters on mouth', 'mouth blisters', 'mouth sores', 'oral blisters'),
+    ('blisters on feet', 'foot blisters', 'hoof blisters', 'blisters on hooves'),
+    ('excessive salivation', 'drooling', 'salivation', 'hypersalivation'),
+    ('lameness', 'lame', 'limping', 'limp'),
+    ('diarrhea', 'diarrhoea', 'scours', 'scouring', 'loose stool', 'loose stools'),
+    ('weight loss', 'losing weight', 'wasting'),
+    ('dehydration', 'dehydrated'),
+    ('weakness', 'weak', 'lethargy', 'lethargic'),
+    ('bloody stool', 'blood in stool', 'bloody feces', 'bloody faeces'),
+    ('joint swelling', 'swollen joints', 'swollen joint'),
+    ('bloating', 'bloat', 'bloated'),
+    ('convulsions', 'seizures', 'fits', 'convulsing'),
+    ('abdominal pain', 'belly pain', 'colic'),
+    ('sudden death', 'found dead'),
+    ('neurological symptoms', 'neurological signs', 'nervous signs'),
+)
+
+
+def normalize_key(text):
+    return ' '.join(re.findall(r'[a-z0-9]+', text.lower()))
+
+
+# Typos tolerated in a query key of the given length
+def allowed_distance(length):
+    if length < 4:
+        return 0
+    return 1 if length < 8 else MAX_DISTANCE
+
+
+# (start, length) of the segments a key of the given length is cut into
+def segments(length):
+    count = max(MAX_DISTANCE + 1, length // SEGMENT_LENGTH)
+    base, longer = divmod(length, count)
+    bounds = []
+    start = 0
+    for index in range(count):
+        size = base + (1 if index >= count - longer else 0)
+        bounds.append((start, size))
+        start += size
+    return bounds
+
+
+# Levenshtein distance, or limit + 1 as soon as it is known to exceed limit.
+# Only the diagonal band of width 2 * limit + 1 of the table can stay within
+# the limit, so only that band is computed.
+def edit_distance(first, second, limit):
+    if abs(len(first) - len(second)) > limit:
+        return limit + 1
+    # A common prefix or suffix never adds to the distance
+    start = 0
+    while start < len(first) and start < len(second) and first[start] == second[start]:
+        start += 1
+    end = 0
+    while end < len(first) - start and end < len(second) - start and first[-1 - end] == second[-1 - end]:
+        end += 1
+    first, second = first[start:len(first) - end], second[start:len(second) - end]
+    beyond = limit + 1
+    previous = [column if column <= limit else beyond for column in range(len(second) + 1)]
+    for row in range(1, len(first) + 1):
+        first_char = first[row - 1]
+        low, high = max(1, row - limit), min(len(second), row + limit)
+        current = [beyond] * (len(second) + 1)
+        current[0] = row if row <= limit else beyond
+        best = current[0] if low == 1 else beyond
+        for column in range(low, high + 1):
+            value = min(previous[column] + 1, current[column - 1] + 1,
+                        previous[column - 1] + (first_char != second[column - 1]))
+            current[column] = value
+            if value < best:
+                best = value
+        if best > limit:
+            return beyond
+        previous = current
+    return min(previous[-1], beyond)
+
+
+class SymptomNormalizer:
+    def __init__(self, vocabulary, synonyms=SYMPTOM_SYNONYMS):
+        # key -> canonical vocabulary entry (first spelling wins)
+        self.exact = {}
+        for symptom in vocabulary:
+            self.exact.setdefault(normalize_key(symptom), symptom)
+        for group in synonyms:
+            canonical = next((self.exact[normalize_key(term)] for term in group
+                              if normalize_key(term) in self.exact), None)
+            if canonical is not None:
+                for term in group:
+                    self.exact.setdefault(normalize_key(term), canonical)
+
+        # Partition index: (key length, segment number, segment) -> key ids,
+        # ids in vocabulary order (vocabulary entries before synonyms)
+        self.keys = []
+        self.partitions = {}
+        for key in self.exact:
+            if len(key) <= MAX_DISTANCE:
+                continue
+            for number, (start, size) in enumerate(segments(len(key))):
+                self.partitions.setdefault((len(key), number, key[start:start + size]), []).append(len(self.keys))
+            self.keys.append(key)
+        # Tuples of ints are untracked by the garbage collector, so a full
+        # collection does not walk the index
+        self.partitions = {segment: tuple(key_ids) for segment, key_ids in self.partitions.items()}
+        self.lookup = lru_cache(maxsize=4096)(self.lookup)
+
+    def __len__(self):
+        return len(self.exact)
+
+    # The vocabulary entry the text names, or None
+    def lookup(self, text):
+        key = normalize_key(text)
+        if not key:
+            return None
+        canonical = self.exact.get(key)
+        if canonical is None:
+            match = self.closest(key)
+            canonical = match and self.exact[match[1]]
+        return canonical
+
+    # (distance, key) of the nearest indexed key within the allowed number
+    # of typos (the earliest in vocabulary order among equals), or None
+    def closest(self, key):
+        limit = allowed_distance(len(key))
+        if not limit:
+            return None
+        candidates = set()
+        for length in range(max(len(key) - limit, MAX_DISTANCE + 1), len(key) + limit + 1):
+            shift = len(key) - length
+            bounds = segments(length)
+            hits = {}
+            for number, (start, size) in enumerate(bounds):
+                found = set()
+                for offset in range(max(start - limit, start + shift - limit, 0),
+                                    min(start + limit, start + shift + limit, len(key) - size) + 1):
+                    found.update(self.partitions.get((length, number, key[offset:offset + size]), ()))
+                for key_id in found:
+                    hits[key_id] = hits.get(key_id, 0) + 1
+            needed = len(bounds) - limit
+            candidates.update(key_id for key_id, count in hits.items() if count >= needed)
+
+        best = None
+        for key_id in sorted(candidates):
+            distance = edit_distance(key, self.keys[key_id], limit)
+            if distance <= limit and (best is None or distance < best[0]):
+                best = (distance, self.keys[key_id])
+                if distance == 1:
+                    break
+        return best
+
+    # Each symptom mapped to its vocabulary entry; unrecognised ones are kept
+    # as given, and duplicates after mapping are dropped
+    def normalize(self, symptoms):
+        return list(dict.fromkeys(self.lookup(symptom) or symptom for symptom in symptoms))
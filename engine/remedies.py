@@ -0,0 +1,41 @@
+# Keyword remedy rules (the command-line advisor's rule set).
+#
+# The catalogue's "remedies" section lists diseases with their remedies and
+# the species they never apply to, plus a symptom keyword -> diseases table.
+# RemedyTable compiles that into one lookup table per species with the
+# exclusions already applied, so a query is one dict lookup per symptom.
+# Species without exclusions share the default table. Symptoms are first
+# normalized to the keywords, so "Cough" or "nasal discharges" still match.
+
+from .normalize import SymptomNormalizer
+
+
+class RemedyTable:
+    def __init__(self, remedies=None):
+        remedies = remedies or {'diseases': [], 'keywords': {}}
+        self.remedies = {entry['name']: tuple(entry['remedies']) for entry in remedies['diseases']}
+        excluded = {}
+        for entry in remedies['diseases']:
+            for species in entry.get('excluded_species', ()):
+                excluded.setdefault(species, set()).add(entry['name'])
+
+        # species (None for any other species) -> keyword -> ((disease, remedies), ...)
+        self.tables = {}
+        for species in list(excluded) + [None]:
+            species_excluded = excluded.get(species, set())
+            self.tables[species] = {
+                keyword: tuple((disease, self.remedies[disease]) for disease in diseases
+                               if disease in self.remedies and disease not in species_excluded)
+                for keyword, diseases in remedies['keywords'].items()
+            }
+        self.normalizer = SymptomNormalizer(remedies['keywords'])
+
+    # Possible diseases and their remedies, in the order the symptoms name them
+    def suggest(self, animal_type, symptoms):
+        table = self.tables.get(animal_type.lower(), self.tables[None])
+        possible_diseases = {}
+        for symptom in symptoms:
+            keyword = self.normalizer.lookup(symptom)
+            for disease, remedies in table.get(keyword, ()):
+                possible_diseases[disease] = list(remedies)
+        return possible_diseases
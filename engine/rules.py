@@ -0,0 +1,456 @@
+# Declarative diagnosis rules compiled into a Rete-style network.
+#
+# A rule set is a list of rules, {"name": ..., "when": [condition, ...],
+# "then": {action: argument, ...}}, written in Python or loaded from JSON
+# (load_rules). A rule fires for every disease that meets all of its
+# conditions. A condition is [subject, operator, value], [subject, "empty"]
+# or ["not", condition]:
+#
+#   disease subjects  id, name, description, severity, severity_level (the
+#                     severity without its " - ..." suffix), symptoms
+#   query subjects    species, selected (the selected symptoms),
+#                     search_text, ranking
+#   operators         ==, !=, in, contains (substring, or membership for
+#                     symptoms/selected), startswith, empty
+#   joins             ["symptoms", "intersects", "selected"]: the disease
+#                     lists a selected symptom
+#                     ["text", "matches", "search_text"]: rule 3's text
+#                     search (index or substring, as the advisor is set up)
+#
+# Actions:
+#   "exclude": true               drop the disease from the results
+#   "set": {field: value}         override urgent or severity_score; later
+#                                 rules win
+#   "order_by": key               rank by match_count, likelihood or
+#                                 relevance; the order_by rules that fire
+#                                 sort in rule order, then catalogue order
+#   "compute": "symptom_coverage" fill in the matching symptoms and coverage
+#
+# REFERENCE_RULES re-expresses the advisor's six rules in this format; with
+# it, the network returns exactly what the built-in pipeline returns.
+#
+# compile_rules builds one RuleNetwork per animal. Every distinct condition
+# is one alpha node holding the bitmask (by catalogue position) of the
+# diseases that meet it, and each rule's conditions are chained into join
+# nodes that AND those masks. Rules with a common condition prefix share the
+# nodes, so a condition is evaluated once per request however many rules
+# use it. Conditions on disease fields and on the species are fixed for a
+# network: they and every join built only from them are folded into
+# constants at compile time, as are set actions that no query-dependent rule
+# can override. A request evaluates only the nodes downstream of the query
+# facts; a RuleSession keeps the node masks and, when a fact changes,
+# re-evaluates just the nodes that depend on it.
+
+import heapq
+import json
+import math
+import time
+
+from .advisor import DiseaseMatch, LivestockHealthAdvisor, ResultPage
+
+DISEASE_SUBJECTS = ('id', 'name', 'description', 'severity', 'severity_level', 'symptoms')
+QUERY_FACTS = ('selected', 'search_text', 'ranking')
+ORDER_KEYS = ('match_count', 'likelihood', 'relevance')
+SETTABLE_FIELDS = ('urgent', 'severity_score')
+
+OPERATORS = {
+    '==': lambda subject, value: subject == value,
+    '!=': lambda subject, value: subject != value,
+    'in': lambda subject, value: subject in value,
+    'contains': lambda subject, value: value in subject,
+    'startswith': lambda subject, value: subject.startswith(value),
+    'empty': lambda subject, value: not subject,
+}
+
+
+class RuleError(ValueError):
+    pass
+
+
+def load_rules(path):
+    with open(path, encoding='utf-8') as source:
+        rules = json.load(source)
+    if not isinstance(rules, list):
+        raise RuleError("%s: expected a list of rules" % path)
+    return rules
+
+
+def disease_field(disease, subject):
+    if subject == 'severity_level':
+        return disease.severity.split(' - ')[0]
+    return getattr(disease, subject)
+
+
+# Positions of the set bits of a mask, lowest first
+def mask_positions(mask):
+    positions = []
+    for index, byte in enumerate(mask.to_bytes((mask.bit_length() + 7) // 8, 'little')):
+        while byte:
+            low = byte & -byte
+            positions.append(index * 8 + low.bit_length() - 1)
+            byte ^= low
+    return positions
+
+
+# Mask with the given bit positions set
+def positions_mask(positions, size):
+    data = bytearray((size + 7) // 8)
+    for position in positions:
+        data[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(data, 'little')
+
+
+# One node of the network: a constant mask, or a function of the query facts
+# (and of the masks of earlier nodes) evaluated per request
+class Node:
+    __slots__ = ('key', 'facts', 'inputs', 'evaluate', 'constant')
+
+    def __init__(self, key, facts=frozenset(), inputs=(), evaluate=None, constant=None):
+        self.key = key
+        self.facts = facts
+        self.inputs = inputs
+        self.evaluate = evaluate
+        self.constant = constant
+
+
+# Compiled rule set for one animal's diseases
+class RuleNetwork:
+    def __init__(self, rules, animal_type, catalogue, search_mode='index'):
+        self.animal_type = animal_type
+        self.catalogue = catalogue
+        self.search_mode = search_mode
+        self.records = catalogue.diseases[animal_type]
+        self.all = (1 << len(self.records)) - 1
+        self.positions = {id(disease): position for position, disease in enumerate(self.records)}
+        holders = {}
+        for position, disease in enumerate(self.records):
+            for symptom in disease.symptoms:
+                holders.setdefault(symptom, []).append(position)
+        self.holders = {symptom: positions_mask(positions, len(self.records))
+                        for symptom, positions in holders.items()}
+
+        self.nodes = []
+        self.node_index = {}
+        terminals = []
+        for rule in rules:
+            name = rule.get('name', '?')
+            node = self.compile_rule(name, rule.get('when', []))
+            if node is None or node.constant == 0:
+                continue
+            for action, argument in rule.get('then', {}).items():
+                self.check_action(name, action, argument)
+                terminals.append((name, node, action, argument))
+
+        # Query-dependent nodes, in evaluation order
+        self.dynamic = [node for node in self.nodes if node.constant is None]
+
+        self.excluded_constant = 0
+        self.exclusions = []
+        self.orderings = []
+        self.computations = []
+        for name, node, action, argument in terminals:
+            if action == 'exclude' and argument:
+                if node.constant is not None:
+                    self.excluded_constant |= node.constant
+                else:
+                    self.exclusions.append(node)
+            elif action == 'order_by':
+                self.orderings.append((node, argument))
+            elif action == 'compute':
+                self.computations.append(node)
+
+        # Set actions are baked into the records, up to the first one that
+        # depends on the query; from there on they are applied per result
+        setters = [(node, argument) for _, node, action, argument in terminals if action == 'set']
+        baked = 0
+        while baked < len(setters) and setters[baked][0].constant is not None:
+            baked += 1
+        self.diseases = list(self.records)
+        for node, fields in setters[:baked]:
+            for position in mask_positions(node.constant):
+                self.diseases[position] = self.with_fields(self.diseases[position], fields)
+        self.diseases = tuple(self.diseases)
+        self.setters = setters[baked:]
+
+    @staticmethod
+    def with_fields(disease, fields):
+        changed = {field: value for field, value in fields.items() if getattr(disease, field) != value}
+        return disease._replace(**changed) if changed else disease
+
+    def check_action(self, name, action, argument):
+        if action == 'set':
+            if not isinstance(argument, dict) or not set(argument) <= set(SETTABLE_FIELDS):
+                raise RuleError("rule %s: set accepts %s" % (name, ', '.join(SETTABLE_FIELDS)))
+        elif action == 'order_by':
+            if argument not in ORDER_KEYS:
+                raise RuleError("rule %s: order_by must be one of %s" % (name, ', '.join(ORDER_KEYS)))
+        elif action == 'compute':
+            if argument != 'symptom_coverage':
+                raise RuleError("rule %s: compute only supports symptom_coverage" % name)
+        elif action != 'exclude':
+            raise RuleError("rule %s: unknown action %r" % (name, action))
+
+    def add_node(self, node):
+        self.node_index[node.key] = node
+        self.nodes.append(node)
+        return node
+
+    # Alpha nodes first (constant ones before query-dependent ones, each in a
+    # canonical order, so equal prefixes share join nodes), then the chain of
+    # joins; a rule that can never fire compiles to None
+    def compile_rule(self, name, conditions):
+        if not conditions:
+            return self.node_index.get('*') or self.add_node(Node('*', constant=self.all))
+        alphas = [self.compile_condition(name, condition) for condition in conditions]
+        alphas.sort(key=lambda node: (node.constant is None, node.key))
+        node = alphas[0]
+        for alpha in alphas[1:]:
+            key = '(%s & %s)' % (node.key, alpha.key)
+            if key in self.node_index:
+                node = self.node_index[key]
+            elif node.constant is not None and alpha.constant is not None:
+                node = self.add_node(Node(key, constant=node.constant & alpha.constant))
+            else:
+                node = self.add_node(Node(key, node.facts | alpha.facts, (node, alpha),
+                                          lambda facts, masks, left=node, right=alpha: masks[left] & masks[right]))
+        return node
+
+    def compile_condition(self, name, condition):
+        if not isinstance(condition, list) or len(condition) not in (2, 3):
+            raise RuleError("rule %s: malformed condition %r" % (name, condition))
+        key = json.dumps(condition, sort_keys=True)
+        if key in self.node_index:
+            return self.node_index[key]
+
+        if condition[0] == 'not':
+            inner = self.compile_condition(name, condition[1])
+            if inner.constant is not None:
+                return self.add_node(Node(key, constant=self.all & ~inner.constant))
+            return self.add_node(Node(key, inner.facts, (inner,),
+                                      lambda facts, masks: self.all & ~masks[inner]))
+
+        subject, operator = condition[0], condition[1]
+        value = condition[2] if len(condition) == 3 else None
+        if (subject, operator, value) == ('symptoms', 'intersects', 'selected'):
+            return self.add_node(Node(key, frozenset(['selected']), (), self.symptoms_selected))
+        if (subject, operator, value) == ('text', 'matches', 'search_text'):
+            return self.add_node(Node(key, frozenset(['search_text']), (), self.text_matches))
+        if operator not in OPERATORS:
+            raise RuleError("rule %s: unknown operator %r" % (name, operator))
+        test = OPERATORS[operator]
+
+        if subject in DISEASE_SUBJECTS:
+            mask = positions_mask((position for position, disease in enumerate(self.records)
+                                   if test(disease_field(disease, subject), value)), len(self.records))
+            return self.add_node(Node(key, constant=mask))
+        if subject == 'species':
+            return self.add_node(Node(key, constant=self.all if test(self.animal_type, value) else 0))
+        if subject in QUERY_FACTS:
+            return self.add_node(Node(key, frozenset([subject]), (),
+                                      lambda facts, masks: self.all if test(facts[subject], value) else 0))
+        raise RuleError("rule %s: unknown subject %r" % (name, subject))
+
+    def symptoms_selected(self, facts, masks):
+        mask = 0
+        for symptom in facts['selected']:
+            mask |= self.holders.get(symptom, 0)
+        return mask
+
+    def text_matches(self, facts, masks):
+        search_text = facts['search_text']
+        if not search_text:
+            return self.all
+        if self.search_mode == 'substring':
+            search_text = search_text.lower()
+            matched = (position for position, disease in enumerate(self.records)
+                       if search_text in disease.name.lower() or search_text in disease.description.lower()
+                       or any(search_text in symptom for symptom in disease.symptoms))
+        else:
+            scores = self.catalogue.text_index[self.animal_type].search(search_text)
+            matched = (self.positions[disease_id] for disease_id in scores)
+        return positions_mask(matched, len(self.records))
+
+    def session(self, selected_symptoms=(), search_text='', ranking='count'):
+        return RuleSession(self, selected_symptoms, search_text, ranking)
+
+
+# Working memory of one diagnosis: the query facts and the mask of every
+# query-dependent node. Changing a fact re-evaluates only its dependents.
+class RuleSession:
+    def __init__(self, network, selected_symptoms=(), search_text='', ranking='count'):
+        self.network = network
+        self.facts = {
+            'selected': list(dict.fromkeys(selected_symptoms)),
+            'search_text': search_text,
+            'ranking': ranking,
+        }
+        self.masks = {}
+        for node in network.nodes:
+            if node.constant is not None:
+                self.masks[node] = node.constant
+        for node in network.dynamic:
+            self.masks[node] = node.evaluate(self.facts, self.masks)
+
+    def assert_facts(self, **facts):
+        changed = set()
+        for fact, value in facts.items():
+            if fact not in QUERY_FACTS:
+                raise RuleError("unknown fact %r" % fact)
+            if fact == 'selected':
+                value = list(dict.fromkeys(value))
+            if value != self.facts[fact]:
+                self.facts[fact] = value
+                changed.add(fact)
+        if changed:
+            for node in self.network.dynamic:
+                if node.facts & changed:
+                    self.masks[node] = node.evaluate(self.facts, self.masks)
+
+    def survivors(self):
+        excluded = self.network.excluded_constant
+        for node in self.network.exclusions:
+            excluded |= self.masks[node]
+        return self.network.all & ~excluded
+
+    # (matches, total): the surviving diseases as DiseaseMatch objects in rank
+    # order, or with a limit only the page starting at offset
+    def results(self, offset=0, limit=None):
+        network = self.network
+        if not network.records:
+            return [], 0
+        catalogue = network.catalogue
+        animal_type = network.animal_type
+        diseases = network.diseases
+        selected_symptoms = self.facts['selected']
+        survivors = mask_positions(self.survivors())
+        query_mask = catalogue.symptom_mask(animal_type, selected_symptoms)
+
+        probabilities = None
+        keys = []
+        for node, order in network.orderings:
+            if not self.masks[node]:
+                continue
+            if order == 'match_count':
+                keys.append([-(diseases[position].symptom_mask & query_mask).bit_count() for position in survivors])
+            elif order == 'likelihood':
+                scores = catalogue.likelihoods[animal_type].scores(network.records, query_mask)
+                peak = max(scores)
+                normalizer = peak + math.log(math.fsum(math.exp(score - peak) for score in scores))
+                probabilities = {position: math.exp(scores[position] - normalizer) for position in survivors}
+                keys.append([-scores[position] for position in survivors])
+            elif network.search_mode == 'index' and self.facts['search_text']:
+                relevance = catalogue.text_index[animal_type].search(self.facts['search_text'])
+                records = network.records
+                keys.append([-relevance.get(id(records[position]), 0) for position in survivors])
+        ranked = [tuple(key[index] for key in keys) + (position,) for index, position in enumerate(survivors)]
+        if limit is None:
+            shown = sorted(ranked)[offset:]
+        else:
+            shown = heapq.nsmallest(offset + limit, ranked)[offset:]
+
+        coverage = any(self.masks[node] for node in network.computations) and selected_symptoms
+        symptom_bits = catalogue.symptom_bits[animal_type]
+        matches = []
+        for key in shown:
+            position = key[-1]
+            disease = diseases[position]
+            for node, fields in network.setters:
+                if self.masks[node] >> position & 1:
+                    disease = network.with_fields(disease, fields)
+            probability = probabilities.get(position) if probabilities is not None else None
+            if coverage:
+                matching_symptoms = tuple(s for s in disease.symptoms if symptom_bits[s] & query_mask)
+                matches.append(DiseaseMatch(disease, matching_symptoms,
+                                            len(matching_symptoms) / len(selected_symptoms) * 100, probability))
+            else:
+                matches.append(DiseaseMatch(disease, probability=probability))
+        return matches, len(survivors)
+
+
+def compile_rules(rules, catalogue, search_mode='index'):
+    return {animal_type: RuleNetwork(rules, animal_type, catalogue, search_mode)
+            for animal_type in catalogue.diseases}
+
+
+# LivestockHealthAdvisor evaluating a declarative rule set in place of its
+# built-in rule methods. Each catalogue generation gets its networks compiled
+# when it is built, so a reload swaps rules and catalogue together.
+class RuleBasedAdvisor(LivestockHealthAdvisor):
+    def __init__(self, database, symptom_lists, remedies=None, indexes=None, rules=None, **options):
+        self.rules = REFERENCE_RULES if rules is None else rules
+        super().__init__(database, symptom_lists, remedies, indexes, **options)
+
+    def build_catalogue(self, database, symptom_lists, remedies=None, indexes=None):
+        catalogue = super().build_catalogue(database, symptom_lists, remedies, indexes)
+        catalogue.rule_networks = compile_rules(self.rules, catalogue, self.search_mode)
+        return catalogue
+
+    # (matches, total) from the animal's network, timed as one rule
+    def run_network(self, animal_type, selected_symptoms, search_text, catalogue, ranking, offset=0, limit=None):
+        session = catalogue.rule_networks[animal_type].session(selected_symptoms, search_text, ranking)
+        if self.instrumentation is None:
+            return session.results(offset, limit)
+        started = time.perf_counter()
+        results, total = session.results(offset, limit)
+        self.instrumentation.observe('rule', 'rule_network', time.perf_counter() - started,
+                                     len(catalogue.diseases[animal_type]), total)
+        return results, total
+
+    def evaluate_rules(self, animal_type, selected_symptoms, search_text, catalogue=None, ranked=None,
+                       ranking='count'):
+        results, _ = self.run_network(animal_type, selected_symptoms, search_text, catalogue or self.catalogue,
+                                      ranking)
+        return results
+
+    def evaluate_page(self, animal_type, selected_symptoms, search_text, catalogue=None, ranking='count', offset=0,
+                      limit=20):
+        results, total = self.run_network(animal_type, selected_symptoms, search_text, catalogue or self.catalogue,
+                                          ranking, offset, limit)
+        return ResultPage(results, total, offset, limit)
+
+    # The network ranks by itself; nothing to precompute per batch
+    def rank_batch(self, cases_by_key, catalogue):
+        return {}
+
+
+# The advisor's six rules as a declarative rule set
+REFERENCE_RULES = [
+    # Rule 1: keep diseases listing a selected symptom
+    {'name': 'filter_by_symptoms',
+     'when': [['not', ['selected', 'empty']], ['not', ['symptoms', 'intersects', 'selected']]],
+     'then': {'exclude': True}},
+    # Rule 2: most matching symptoms first (or by posterior in likelihood mode)
+    {'name': 'sort_by_match_count',
+     'when': [['ranking', '==', 'count']],
+     'then': {'order_by': 'match_count'}},
+    {'name': 'rank_by_likelihood',
+     'when': [['ranking', '==', 'likelihood']],
+     'then': {'order_by': 'likelihood'}},
+    # Rule 3: the search text must match; it ranks when no symptom does
+    {'name': 'filter_by_search_text',
+     'when': [['not', ['search_text', 'empty']], ['not', ['text', 'matches', 'search_text']]],
+     'then': {'exclude': True}},
+    {'name': 'rank_by_relevance',
+     'when': [['selected', 'empty'], ['ranking', '==', 'count']],
+     'then': {'order_by': 'relevance'}},
+    # Rule 4: critical conditions need a vet immediately
+    {'name': 'flag_critical_conditions',
+     'when': [['severity', 'contains', 'Critical']],
+     'then': {'set': {'urgent': True}}},
+    {'name': 'not_critical',
+     'when': [['not', ['severity', 'contains', 'Critical']]],
+     'then': {'set': {'urgent': False}}},
+    # Rule 5: share of the selected symptoms each disease explains
+    {'name': 'calculate_symptom_coverage',
+     'when': [['not', ['selected', 'empty']]],
+     'then': {'compute': 'symptom_coverage'}},
+    # Rule 6: severity score by severity level
+    {'name': 'apply_severity_rating',
+     'when': [['not', ['severity_level', 'in', list(LivestockHealthAdvisor.SEVERITY_SCORES)]]],
+     'then': {'set': {'severity_score': 0}}},
+] + [
+    {'name': 'apply_severity_rating_%s' % level.lower().replace(' ', '_'),
+     'when': [['severity_level', '==', level]],
+     'then': {'set': {'severity_score': score}}}
+    for level, score in LivestockHealthAdvisor.SEVERITY_SCORES.items() if ' - ' not in level
+]
@@ -0,0 +1,474 @@
+# Outbreak surveillance over the diagnoses the app makes.
+#
+# The leading diagnosis of each symptom search, as the request already
+# computed it, is handed to OutbreakMonitor.submit, which only puts a tuple on
+# a bounded in-process queue (put_nowait: when the queue is full the event is
+# counted as dropped, never waited for), so surveillance adds no latency to
+# the request. A daemon thread takes events off the queue in batches and
+# counts each in two series: (animal type, disease) and, when the request
+# carried a region tag, (animal type, disease, region). The thread never runs
+# the rules, so it records nothing in the request instrumentation.
+#
+# A series is a count per time bucket (bucket_seconds each) over the last
+# history_seconds, and at most max_series series are kept (the least recently
+# updated are dropped first). The sliding window is the last window_seconds of
+# buckets; its baseline is the average count per window over the older part
+# of the history.
+#
+# For reportable diseases (severity mentions "Reportable") a series raises an
+# alert when its window count reaches alert_count and alert_ratio times the
+# baseline. It alerts once per spike: a new alert needs the series to have
+# dropped back below the threshold first. Recent alerts are kept and passed
+# to each callable in `listeners` of the process whose event raised them.
+#
+# Where the counts live:
+#
+#   path=None   MemorySeries: a fixed ring of bucket counts per series in
+#               this process's memory. Each worker of a multi-process
+#               deployment would only see its own share of the cases.
+#   path        SharedSeries: an SQLite database (WAL mode) that every
+#               process given the same path reads and writes. The aggregator
+#               threads of all workers count into it, each batch in one
+#               transaction, so windows, baselines and alerts cover every
+#               worker and a spike alerts once however it is spread. Counts
+#               also survive a restart. When the file cannot be opened the
+#               monitor falls back to memory.
+
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict, deque
+
+MAX_REGION_LENGTH = 64
+# Events the aggregator takes off the queue and counts together
+BATCH_SIZE = 500
+
+logger = logging.getLogger('livestock.surveillance')
+
+
+# Region tags are compared case-insensitively; empty ones mean no region
+def region_tag(region):
+    if not isinstance(region, str):
+        return None
+    return ' '.join(region.lower().split())[:MAX_REGION_LENGTH] or None
+
+
+def is_reportable(disease):
+    return 'Reportable' in disease.severity
+
+
+def snapshot_order(row):
+    return -row['count'], row['animal_type'], row['disease'], row['region'] or ''
+
+
+# Counts of one series in consecutive time buckets: bucket number b is kept
+# in slot b % size until bucket b + size arrives
+class Series:
+    __slots__ = ('counts', 'latest', 'reportable', 'alerting')
+
+    def __init__(self, size, reportable):
+        self.counts = array('I', bytes(4 * size))
+        self.latest = None
+        self.reportable = reportable
+        self.alerting = False
+
+    def add(self, bucket):
+        size = len(self.counts)
+        if self.latest is None:
+            self.latest = bucket
+        elif bucket > self.latest:
+            # Clear the slots of the buckets skipped since the last event
+            for skipped in range(self.latest + 1, min(bucket, self.latest + size) + 1):
+                self.counts[skipped % size] = 0
+            self.latest = bucket
+        elif bucket <= self.latest - size:
+            return
+        self.counts[bucket % size] += 1
+
+    # Events in the `span` buckets ending with `bucket`
+    def total(self, bucket, span):
+        if self.latest is None:
+            return 0
+        size = len(self.counts)
+        first = max(bucket - span + 1, self.latest - size + 1)
+        return sum(self.counts[number % size] for number in range(first, min(bucket, self.latest) + 1))
+
+
+# Series in this process's memory
+class MemorySeries:
+    def __init__(self, monitor):
+        self.monitor = monitor
+        self._series = OrderedDict()
+        self._alerts = deque(maxlen=monitor.alerts_kept)
+        self._lock = threading.Lock()
+        self._totals = {'submitted': 0, 'dropped': 0, 'recorded': 0}
+
+    # Count a batch of events; returns the alerts they raised
+    def record(self, events, submitted, dropped):
+        monitor = self.monitor
+        older = monitor.history_buckets - monitor.window_buckets
+        raised = []
+        with self._lock:
+            self._totals['submitted'] += submitted
+            self._totals['dropped'] += dropped
+            self._totals['recorded'] += len(events)
+            for animal_type, disease_name, reportable, region, timestamp in events:
+                bucket = int(timestamp // monitor.bucket_seconds)
+                for tag in (None, region) if region else (None,):
+                    key = (animal_type, disease_name, tag)
+                    series = self._series.get(key)
+                    if series is None:
+                        series = self._series[key] = Series(monitor.history_buckets, reportable)
+                        while len(self._series) > monitor.max_series:
+                            self._series.popitem(last=False)
+                    else:
+                        self._series.move_to_end(key)
+                    series.add(bucket)
+                    if series.reportable:
+                        count = series.total(bucket, monitor.window_buckets)
+                        baseline = monitor.baseline(series.total(bucket - monitor.window_buckets, older))
+                        series.alerting, alert = monitor.check(key, series.alerting, count, baseline, timestamp)
+                        if alert is not None:
+                            self._alerts.append(alert)
+                            raised.append(alert)
+        return raised
+
+    def snapshot(self, animal_type, disease, region, reportable_only, bucket):
+        monitor = self.monitor
+        older = monitor.history_buckets - monitor.window_buckets
+        rows = []
+        with self._lock:
+            for key, series in self._series.items():
+                if ((animal_type is not None and key[0] != animal_type) or
+                        (disease is not None and key[1] != disease) or
+                        (reportable_only and not series.reportable) or
+                        (key[2] != region if region != '*' else key[2] is None)):
+                    continue
+                count = series.total(bucket, monitor.window_buckets)
+                baseline = monitor.baseline(series.total(bucket - monitor.window_buckets, older))
+                if count or baseline:
+                    rows.append(monitor.row(key, series.reportable, count, baseline))
+        return rows
+
+    def alerts(self):
+        with self._lock:
+            return list(reversed(self._alerts))
+
+    def totals(self):
+        with self._lock:
+            return dict(self._totals, series=len(self._series))
+
+
+# Series in an SQLite database shared by every process that opens the same
+# path. Regions are stored as '' when absent, so the unique key holds.
+class SharedSeries:
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS series (
+            id INTEGER PRIMARY KEY,
+            animal_type TEXT NOT NULL,
+            disease TEXT NOT NULL,
+            region TEXT NOT NULL,
+            reportable INTEGER NOT NULL,
+            alerting INTEGER NOT NULL DEFAULT 0,
+            latest INTEGER NOT NULL,
+            updated INTEGER NOT NULL,
+            UNIQUE (animal_type, disease, region)
+        );
+        CREATE INDEX IF NOT EXISTS series_updated ON series (updated);
+        CREATE TABLE IF NOT EXISTS counts (
+            series INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (series, bucket)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS alerts (id INTEGER PRIMARY KEY, alert TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS totals (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+        INSERT OR IGNORE INTO totals VALUES ('submitted', 0), ('dropped', 0), ('recorded', 0);
+    '''
+    # (events in the window, events in the older part of the history)
+    WINDOW = '''
+        SELECT COALESCE(SUM(CASE WHEN bucket > :window_start THEN count END), 0),
+               COALESCE(SUM(CASE WHEN bucket <= :window_start THEN count END), 0)
+        FROM counts WHERE series = :series AND bucket > :history_start AND bucket <= :bucket
+    '''
+
+    def __init__(self, path, monitor):
+        self.path = path
+        self.monitor = monitor
+        self._local = threading.local()
+        connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+        try:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(self.SCHEMA)
+        finally:
+            connection.close()
+
+    # One connection per thread, opened again in a forked child
+    def connection(self):
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            local.connection.execute('PRAGMA synchronous=NORMAL')
+            local.pid = os.getpid()
+        return local.connection
+
+    def record(self, events, submitted, dropped):
+        monitor = self.monitor
+        connection = self.connection()
+        raised = []
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            sequence = connection.execute("SELECT value FROM totals WHERE name = 'recorded'").fetchone()[0]
+            for animal_type, disease_name, reportable, region, timestamp in events:
+                bucket = int(timestamp // monitor.bucket_seconds)
+                sequence += 1
+                for tag in ('', region) if region else ('',):
+                    alert = self._add(connection, (animal_type, disease_name, tag), reportable, bucket, timestamp,
+                                      sequence)
+                    if alert is not None:
+                        connection.execute('INSERT INTO alerts (alert) VALUES (?)', (json.dumps(alert),))
+                        raised.append(alert)
+
+            excess = connection.execute('SELECT COUNT(*) FROM series').fetchone()[0] - monitor.max_series
+            if excess > 0:
+                evicted = [row[0] for row in connection.execute(
+                    'SELECT id FROM series ORDER BY updated LIMIT ?', (excess,))]
+                connection.executemany('DELETE FROM counts WHERE series = ?', [(key,) for key in evicted])
+                connection.executemany('DELETE FROM series WHERE id = ?', [(key,) for key in evicted])
+            if raised:
+                connection.execute('DELETE FROM alerts WHERE id <= (SELECT MAX(id) FROM alerts) - ?',
+                                   (monitor.alerts_kept,))
+            connection.executemany('UPDATE totals SET value = value + ? WHERE name = ?',
+                                   [(submitted, 'submitted'), (dropped, 'dropped'), (len(events), 'recorded')])
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        for alert in raised:
+            alert['region'] = alert['region'] or None
+        return raised
+
+    # Count one event in one series; returns the alert it raised, if any
+    def _add(self, connection, key, reportable, bucket, timestamp, sequence):
+        monitor = self.monitor
+        row = connection.execute('SELECT id, reportable, alerting, latest FROM series '
+                                 'WHERE animal_type = ? AND disease = ? AND region = ?', key).fetchone()
+        if row is None:
+            series = connection.execute(
+                'INSERT INTO series (animal_type, disease, region, reportable, latest, updated) '
+                'VALUES (?, ?, ?, ?, ?, ?)', key + (reportable, bucket, sequence)).lastrowid
+            alerting, latest = False, bucket
+        else:
+            series, reportable, alerting, latest = row
+            if bucket > latest:
+                # Buckets that left the history
+                connection.execute('DELETE FROM counts WHERE series = ? AND bucket <= ?',
+                                   (series, bucket - monitor.history_buckets))
+                latest = bucket
+            connection.execute('UPDATE series SET latest = ?, updated = ? WHERE id = ?', (latest, sequence, series))
+        if bucket > latest - monitor.history_buckets:
+            connection.execute('INSERT INTO counts VALUES (?, ?, 1) '
+                               'ON CONFLICT (series, bucket) DO UPDATE SET count = count + 1', (series, bucket))
+        if not reportable:
+            return None
+
+        count, older = connection.execute(self.WINDOW, {
+            'series': series, 'bucket': bucket, 'window_start': bucket - monitor.window_buckets,
+            'history_start': bucket - monitor.history_buckets}).fetchone()
+        spiking, alert = monitor.check(key, bool(alerting), count, monitor.baseline(older), timestamp)
+        if spiking != bool(alerting):
+            connection.execute('UPDATE series SET alerting = ? WHERE id = ?', (spiking, series))
+        return alert
+
+    def snapshot(self, animal_type, disease, region, reportable_only, bucket):
+        monitor = self.monitor
+        conditions = ['s.region != ?' if region == '*' else 's.region = ?']
+        parameters = ['' if region == '*' else region or '']
+        if animal_type is not None:
+            conditions.append('s.animal_type = ?')
+            parameters.append(animal_type)
+        if disease is not None:
+            conditions.append('s.disease = ?')
+            parameters.append(disease)
+        if reportable_only:
+            conditions.append('s.reportable')
+        query = '''
+            SELECT s.animal_type, s.disease, s.region, s.reportable,
+                   COALESCE(SUM(CASE WHEN c.bucket > ? THEN c.count END), 0),
+                   COALESCE(SUM(CASE WHEN c.bucket <= ? THEN c.count END), 0)
+            FROM series s JOIN counts c ON c.series = s.id AND c.bucket > ? AND c.bucket <= ?
+            WHERE %s GROUP BY s.id
+        ''' % ' AND '.join(conditions)
+        window_start = bucket - monitor.window_buckets
+        rows = []
+        for animal, name, tag, reportable, count, older in self.connection().execute(
+                query, [window_start, window_start, bucket - monitor.history_buckets, bucket] + parameters):
+            rows.append(monitor.row((animal, name, tag or None), bool(reportable), count, monitor.baseline(older)))
+        return rows
+
+    def alerts(self):
+        rows = self.connection().execute('SELECT alert FROM alerts ORDER BY id DESC LIMIT ?',
+                                         (self.monitor.alerts_kept,))
+        alerts = [json.loads(alert) for alert, in rows]
+        for alert in alerts:
+            alert['region'] = alert['region'] or None
+        return alerts
+
+    def totals(self):
+        connection = self.connection()
+        totals = dict(connection.execute('SELECT name, value FROM totals'))
+        totals['series'] = connection.execute('SELECT COUNT(*) FROM series').fetchone()[0]
+        return totals
+
+
+class OutbreakMonitor:
+    def __init__(self, bucket_seconds=300, window_seconds=3600, history_seconds=86400,
+                 max_series=10000, queue_size=10000, alert_count=5, alert_ratio=3.0, alerts_kept=100, path=None):
+        if not 0 < window_seconds < history_seconds:
+            raise ValueError("window_seconds must be positive and shorter than history_seconds")
+        self.bucket_seconds = bucket_seconds
+        self.window_buckets = max(1, round(window_seconds / bucket_seconds))
+        self.history_buckets = max(self.window_buckets + 1, round(history_seconds / bucket_seconds))
+        self.max_series = max_series
+        self.queue_size = queue_size
+        self.alert_count = alert_count
+        self.alert_ratio = alert_ratio
+        self.alerts_kept = alerts_kept
+        self.listeners = []
+        # Events submitted, dropped and counted by this process
+        self.submitted = 0
+        self.dropped = 0
+        self.recorded = 0
+        self._reported = (0, 0)
+        self._lock = threading.Lock()
+        self._queue = None
+        self._worker_pid = None
+
+        self.store = MemorySeries(self)
+        if path is not None:
+            try:
+                self.store = SharedSeries(path, self)
+            except (sqlite3.Error, OSError) as error:
+                logger.warning("could not open %s, keeping surveillance counts in this process: %s", path, error)
+
+    # Called on the request path with the leading Disease (anything with a
+    # name and a severity): queue the event and return at once
+    def submit(self, animal_type, disease, region=None, timestamp=None):
+        if self._worker_pid != os.getpid():
+            self._start()
+        self.submitted += 1
+        event = (animal_type, disease.name, is_reportable(disease), region_tag(region),
+                 time.time() if timestamp is None else timestamp)
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    # The aggregator thread is started by the first submit in each process,
+    # so a pre-fork master never starts one for its workers to lose
+    def _start(self):
+        with self._lock:
+            if self._worker_pid == os.getpid():
+                return
+            self.submitted = self.dropped = 0
+            self._reported = (0, 0)
+            self._queue = queue.Queue(self.queue_size)
+            threading.Thread(target=self._run, args=(self._queue,), name='outbreak-monitor', daemon=True).start()
+            self._worker_pid = os.getpid()
+
+    def _run(self, events):
+        while True:
+            batch = [events.get()]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(events.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.record_batch(batch)
+            except Exception:
+                # One bad batch must not stop the aggregator
+                logger.exception("could not record %d diagnosis events", len(batch))
+            finally:
+                for _ in batch:
+                    events.task_done()
+
+    # Block until every queued event has been counted
+    def flush(self):
+        if self._worker_pid == os.getpid():
+            self._queue.join()
+
+    # Count (animal_type, disease name, reportable, region tag, timestamp)
+    # events, with this process's submitted and dropped counts since the
+    # last batch, and notify the listeners of the alerts they raise
+    def record_batch(self, events):
+        submitted, dropped = self.submitted, self.dropped
+        raised = self.store.record(events, submitted - self._reported[0], dropped - self._reported[1])
+        self._reported = (submitted, dropped)
+        self.recorded += len(events)
+        for alert in raised:
+            for listener in self.listeners:
+                listener(alert)
+
+    def record(self, animal_type, disease_name, reportable, region, timestamp):
+        self.record_batch([(animal_type, disease_name, reportable, region, timestamp)])
+
+    # Average events per window over `older_total`, the events in the part
+    # of the history before the window
+    def baseline(self, older_total):
+        older = self.history_buckets - self.window_buckets
+        return older_total * self.window_buckets / older
+
+    def _spiking(self, count, baseline):
+        return count >= self.alert_count and count >= self.alert_ratio * baseline
+
+    # (whether the series is now spiking, the alert to raise or None)
+    def check(self, key, alerting, count, baseline, timestamp):
+        spiking = self._spiking(count, baseline)
+        alert = None
+        if spiking and not alerting:
+            alert = {
+                'time': timestamp,
+                'animal_type': key[0],
+                'disease': key[1],
+                'region': key[2],
+                'count': count,
+                'baseline': baseline,
+                'window_seconds': self.window_buckets * self.bucket_seconds,
+            }
+        return spiking, alert
+
+    def row(self, key, reportable, count, baseline):
+        return {
+            'animal_type': key[0],
+            'disease': key[1],
+            'region': key[2],
+            'reportable': reportable,
+            'count': count,
+            'baseline': baseline,
+            'alerting': reportable and self._spiking(count, baseline),
+        }
+
+    # Current window counts, busiest first. Without a region only the
+    # all-region series are listed; region='*' lists every regional one.
+    def snapshot(self, animal_type=None, disease=None, region=None, reportable_only=False, timestamp=None):
+        bucket = int((time.time() if timestamp is None else timestamp) // self.bucket_seconds)
+        region = region if region == '*' else region_tag(region)
+        rows = self.store.snapshot(animal_type, disease, region, reportable_only, bucket)
+        rows.sort(key=snapshot_order)
+        return rows
+
+    # Most recent first
+    def alerts(self):
+        return self.store.alerts()
+
+    # Events submitted, dropped and counted (by every process sharing the
+    # store), the series kept, and the events queued in this process
+    def stats(self):
+        return dict(self.store.totals(),
+                    queued=self._queue.qsize() if self._worker_pid == os.getpid() else 0)
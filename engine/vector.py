@@ -0,0 +1,90 @@
+# Optional NumPy scoring engine for rules 1 and 2.
+#
+# Each animal's catalogue is stored as a sparse disease x symptom matrix in
+# CSR form (row pointers + column indices, all ones). Scoring a query is a
+# sparse matrix-vector product: gather the query vector at every stored
+# column and sum each row's segment with np.add.reduceat. A batch of queries
+# is the same product against a query matrix, one row per query, taken a
+# chunk of queries at a time: the gathered array holds one cell per query and
+# stored symptom, so chunks are sized to keep it under GATHER_CELLS.
+# Ranking uses a stable argsort on the negated counts, so ties keep catalogue
+# order exactly like the pure-Python pipeline.
+# numpy is optional and only imported when a matrix is built, so importing the
+# engine stays cheap for the command-line tools.
+
+np = None
+
+GATHER_CELLS = 1 << 22
+
+
+def import_numpy():
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError("the numpy scoring engine requires numpy to be installed") from None
+        np = numpy
+    return np
+
+
+class SymptomMatrix:
+    def __init__(self, diseases, symptom_bits):
+        import_numpy()
+
+        # Bits were assigned in vocabulary order, so bit n is column n
+        self.columns = {symptom: bit.bit_length() - 1 for symptom, bit in symptom_bits.items()}
+        self.width = len(self.columns)
+
+        row_lengths = np.fromiter((len(disease.symptoms) for disease in diseases), dtype=np.int64,
+                                  count=len(diseases))
+        self.indices = np.fromiter((self.columns[symptom] for disease in diseases for symptom in disease.symptoms),
+                                   dtype=np.int64, count=int(row_lengths.sum()))
+        indptr = np.zeros(len(diseases) + 1, dtype=np.int64)
+        np.cumsum(row_lengths, out=indptr[1:])
+
+        # reduceat cannot express empty segments, so only non-empty rows are summed
+        self.nonempty_rows = np.flatnonzero(row_lengths)
+        self.segment_starts = indptr[:-1][self.nonempty_rows]
+        self.rows = len(diseases)
+
+    def query_vector(self, selected_symptoms):
+        vector = np.zeros(self.width, dtype=np.int32)
+        for symptom in selected_symptoms:
+            column = self.columns.get(symptom)
+            if column is not None:
+                vector[column] = 1
+        return vector
+
+    # Matching symptom count per disease (matrix-vector product)
+    def match_counts(self, selected_symptoms):
+        counts = np.zeros(self.rows, dtype=np.int32)
+        if len(self.indices):
+            gathered = self.query_vector(selected_symptoms)[self.indices]
+            counts[self.nonempty_rows] = np.add.reduceat(gathered, self.segment_starts)
+        return counts
+
+    # Matching symptom counts for many queries at once (matrix-matrix product),
+    # one row of the result per query
+    def batch_match_counts(self, symptom_sets):
+        counts = np.zeros((len(symptom_sets), self.rows), dtype=np.int32)
+        if not len(self.indices):
+            return counts
+        chunk = max(1, GATHER_CELLS // len(self.indices))
+        for first in range(0, len(symptom_sets), chunk):
+            chunk_sets = symptom_sets[first:first + chunk]
+            queries = np.zeros((len(chunk_sets), self.width), dtype=np.int32)
+            for row, selected_symptoms in enumerate(chunk_sets):
+                for symptom in selected_symptoms:
+                    column = self.columns.get(symptom)
+                    if column is not None:
+                        queries[row, column] = 1
+            counts[first:first + len(chunk_sets), self.nonempty_rows] = np.add.reduceat(
+                queries[:, self.indices], self.segment_starts, axis=1)
+        return counts
+
+    # Rows with at least one match, highest count first, ties in catalogue order
+    @staticmethod
+    def rank(counts):
+        order = np.argsort(-counts, kind='stable')
+        return order[:np.count_nonzero(counts)].tolist()
@@ -0,0 +1,206 @@
+# Responsive image pipeline for static/images.
+#
+# Every source image is resized to a set of widths and encoded as WebP and
+# JPEG under content-hashed names (<stem>.<hash>.<width>.<ext>) in
+# static/images/build/, described by a manifest.json. Because the names change
+# whenever the source changes, the built files can be cached forever.
+# Templates call responsive_image() to emit a <picture> with srcset; images
+# that do not exist get an inline SVG placeholder instead of a 404 request.
+#
+# Pillow is optional: without it the original file is published under its
+# hashed name and no resized variants are produced.
+#
+# The app builds at import, so every worker of a multi-process server may
+# build at once. Each writes its files under a temporary name of its own and
+# renames them into place, so a reader never sees a partial file whichever
+# worker wins. When the build directory cannot be written the manifest is
+# kept in memory only.
+#
+#   python images.py            # build ahead of deployment
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+from html import escape
+
+from markupsafe import Markup
+
+try:
+    from PIL import Image
+except ImportError:  # optional: originals are served without resizing
+    Image = None
+
+WIDTHS = (160, 320, 640, 1280)
+SOURCE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+MANIFEST_VERSION = 1
+
+logger = logging.getLogger('livestock.images')
+
+PLACEHOLDER = ('data:image/svg+xml,'
+               '%3Csvg xmlns=%22http://www.w3.org/2000/svg%22 viewBox=%220 0 4 3%22%3E'
+               '%3Crect width=%224%22 height=%223%22 fill=%22%23e9ecef%22/%3E%3C/svg%3E')
+
+
+def content_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+class ImagePipeline:
+    def __init__(self, source_dir, widths=WIDTHS, url_prefix='/static/images/build/'):
+        self.source_dir = source_dir
+        self.output_dir = os.path.join(source_dir, 'build')
+        self.manifest_path = os.path.join(self.output_dir, 'manifest.json')
+        self.widths = widths
+        self.url_prefix = url_prefix
+        self.manifest = {}
+
+    def sources(self):
+        if not os.path.isdir(self.source_dir):
+            return []
+        return sorted(name for name in os.listdir(self.source_dir)
+                      if name.lower().endswith(SOURCE_EXTENSIONS)
+                      and os.path.isfile(os.path.join(self.source_dir, name)))
+
+    def read_manifest(self):
+        try:
+            with open(self.manifest_path) as manifest_file:
+                manifest = json.load(manifest_file)
+        except (OSError, ValueError):
+            return {}
+        if manifest.get('version') != MANIFEST_VERSION or manifest.get('pillow') != (Image is not None):
+            return {}
+        return manifest.get('images', {})
+
+    # Build variants for new or changed sources; unchanged ones are reused
+    def build(self):
+        previous = self.read_manifest()
+        os.makedirs(self.output_dir, exist_ok=True)
+        images = {}
+        for name in self.sources():
+            path = os.path.join(self.source_dir, name)
+            digest = content_hash(path)
+            entry = previous.get(name)
+            if entry is None or entry['hash'] != digest or not all(
+                    os.path.exists(os.path.join(self.output_dir, variant['file']))
+                    for variants in entry['variants'].values() for variant in variants):
+                entry = self.build_image(name, path, digest)
+            images[name] = entry
+
+        # Remove variants no longer referenced by any source
+        referenced = {variant['file'] for entry in images.values()
+                      for variants in entry['variants'].values() for variant in variants}
+        for stale in os.listdir(self.output_dir):
+            if stale != 'manifest.json' and stale not in referenced and not stale.endswith('.tmp'):
+                try:
+                    os.remove(os.path.join(self.output_dir, stale))
+                except FileNotFoundError:
+                    pass  # removed by another worker
+
+        self.manifest = images
+        try:
+            self.write_atomically(self.manifest_path, lambda manifest_file: manifest_file.write(json.dumps(
+                {'version': MANIFEST_VERSION, 'pillow': Image is not None, 'images': images},
+                indent=2, sort_keys=True).encode('utf-8')))
+        except OSError as error:
+            logger.warning("could not write %s, keeping the image manifest in memory: %s", self.manifest_path, error)
+        return images
+
+    # Write through a temporary file of this process, then rename it into place
+    def write_atomically(self, path, write):
+        with tempfile.NamedTemporaryFile(dir=self.output_dir, prefix=os.path.basename(path) + '.', suffix='.tmp',
+                                         delete=False) as temporary:
+            try:
+                write(temporary)
+            except BaseException:
+                temporary.close()
+                os.remove(temporary.name)
+                raise
+        try:
+            os.replace(temporary.name, path)
+        except OSError:
+            os.remove(temporary.name)
+            raise
+
+    def build_image(self, name, path, digest):
+        stem, extension = os.path.splitext(name)
+        if Image is None:
+            published = '%s.%s%s' % (stem, digest, extension.lower())
+            with open(path, 'rb') as source:
+                self.write_atomically(os.path.join(self.output_dir, published),
+                                      lambda destination: shutil.copyfileobj(source, destination))
+            return {'hash': digest, 'width': None, 'height': None,
+                    'variants': {'jpeg': [{'width': None, 'file': published}]}}
+
+        with Image.open(path) as original:
+            original = original.convert('RGB')
+            width, height = original.size
+            # Never upscale; always include the original width as the largest
+            widths = sorted({w for w in self.widths if w < width} | {width})
+            variants = {'webp': [], 'jpeg': []}
+            for target in widths:
+                resized = original if target == width else original.resize(
+                    (target, max(1, round(height * target / width))), Image.LANCZOS)
+                for fmt, ext, options in (('webp', 'webp', {'quality': 80, 'method': 6}),
+                                          ('jpeg', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True})):
+                    file_name = '%s.%s.%d.%s' % (stem, digest, target, ext)
+                    self.write_atomically(os.path.join(self.output_dir, file_name),
+                                          lambda destination: resized.save(destination, fmt.upper(), **options))
+                    variants[fmt].append({'width': target, 'file': file_name})
+        return {'hash': digest, 'width': width, 'height': height, 'variants': variants}
+
+    # Use the existing manifest if it matches the sources, otherwise rebuild
+    def load_or_build(self):
+        manifest = self.read_manifest()
+        current = {name: content_hash(os.path.join(self.source_dir, name)) for name in self.sources()}
+        if {name: entry['hash'] for name, entry in manifest.items()} == current:
+            self.manifest = manifest
+            return manifest
+        try:
+            return self.build()
+        except OSError as error:
+            # A read-only deployment still serves whatever was built before
+            logger.warning("could not build images in %s, using the existing manifest: %s", self.output_dir, error)
+            self.manifest = manifest
+            return manifest
+
+    def srcset(self, variants):
+        return ', '.join('%s%s %dw' % (self.url_prefix, variant['file'], variant['width'])
+                         for variant in variants if variant['width'])
+
+    # <picture> markup with WebP and JPEG srcsets; `sizes` is the CSS display width
+    def responsive_image(self, name, alt='', sizes='100vw'):
+        entry = self.manifest.get(name)
+        if entry is None:
+            return Markup('<img src="%s" alt="%s">' % (PLACEHOLDER, escape(alt)))
+
+        jpeg = entry['variants']['jpeg']
+        attributes = 'alt="%s" loading="lazy" decoding="async"' % escape(alt)
+        if entry['width']:
+            attributes += ' width="%d" height="%d"' % (entry['width'], entry['height'])
+        if 'webp' not in entry['variants']:
+            return Markup('<img src="%s%s" %s>' % (self.url_prefix, jpeg[0]['file'], attributes))
+
+        return Markup(
+            '<picture>'
+            '<source type="image/webp" srcset="%s" sizes="%s">'
+            '<img src="%s%s" srcset="%s" sizes="%s" %s>'
+            '</picture>' % (
+                self.srcset(entry['variants']['webp']), escape(sizes),
+                self.url_prefix, jpeg[0]['file'], self.srcset(jpeg), escape(sizes), attributes))
+
+
+if __name__ == '__main__':
+    pipeline = ImagePipeline(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'images'))
+    for image_name, image in sorted(pipeline.build().items()):
+        files = [variant['file'] for variants in image['variants'].values() for variant in variants]
+        print('%s -> %d files' % (image_name, len(files)))
+    if Image is None:
+        print("Pillow is not installed: published originals only", file=sys.stderr)
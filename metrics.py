@@ -0,0 +1,160 @@
+# Request and rule instrumentation for the health advisor.
+#
+# Instrumentation fans timing events out to pluggable sinks. Every event has a
+# kind ('rule', 'template' or 'request'), a name, the wall time in seconds and,
+# for rules, the number of diseases going in and coming out. When no
+# Instrumentation is attached the advisor calls its rules through a plain
+# pass-through function instead, so the disabled cost is negligible.
+
+import contextvars
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+TIME_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000)
+
+
+# name="value" pairs of a Prometheus sample, with backslashes, double quotes
+# and newlines in the values escaped as the text format requires
+def format_labels(**labels):
+    return ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                    for name, value in labels.items())
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    # Prometheus exposition lines; bucket counts are cumulative
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append('%s_bucket{%sle="%s"} %d' % (name, labels, bound, cumulative))
+        lines.append('%s_bucket{%sle="+Inf"} %d' % (name, labels, self.count))
+        lines.append('%s_sum{%s} %r' % (name, labels.rstrip(','), self.total))
+        lines.append('%s_count{%s} %d' % (name, labels.rstrip(','), self.count))
+        return lines
+
+
+# In-memory histograms, exposed in Prometheus text format on /metrics
+class PrometheusSink:
+    DESCRIPTIONS = {
+        'livestock_rule_seconds': 'Wall time of one diagnostic rule',
+        'livestock_rule_input_diseases': 'Diseases passed into a rule',
+        'livestock_rule_output_diseases': 'Diseases returned by a rule',
+        'livestock_template_render_seconds': 'Template render time',
+        'livestock_request_seconds': 'Total request time',
+    }
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+        # metric name -> (description, callable returning {labels: value})
+        self.gauges = {}
+
+    def _observe(self, metric, label, value, buckets):
+        with self._lock:
+            histogram = self._histograms.get((metric, label))
+            if histogram is None:
+                histogram = self._histograms[(metric, label)] = Histogram(buckets)
+            histogram.observe(value)
+
+    def observe(self, kind, name, seconds, input_size=None, output_size=None):
+        if kind == 'rule':
+            self._observe('livestock_rule_seconds', ('rule', name), seconds, TIME_BUCKETS)
+            self._observe('livestock_rule_input_diseases', ('rule', name), input_size, SIZE_BUCKETS)
+            self._observe('livestock_rule_output_diseases', ('rule', name), output_size, SIZE_BUCKETS)
+        elif kind == 'template':
+            self._observe('livestock_template_render_seconds', ('template', name), seconds, TIME_BUCKETS)
+        elif kind == 'request':
+            self._observe('livestock_request_seconds', ('endpoint', name), seconds, TIME_BUCKETS)
+
+    def request_started(self):
+        pass
+
+    def request_finished(self):
+        pass
+
+    def render(self):
+        lines = []
+        with self._lock:
+            current = None
+            for (metric, (label, value)), histogram in sorted(self._histograms.items()):
+                if metric != current:
+                    current = metric
+                    lines.append('# HELP %s %s' % (metric, self.DESCRIPTIONS[metric]))
+                    lines.append('# TYPE %s histogram' % metric)
+                lines.extend(histogram.render(metric, format_labels(**{label: value}) + ','))
+        for metric, (description, read) in sorted(self.gauges.items()):
+            lines.append('# HELP %s %s' % (metric, description))
+            lines.append('# TYPE %s gauge' % metric)
+            for labels, value in sorted(read().items()):
+                lines.append('%s{%s} %s' % (metric, labels, value))
+        return '\n'.join(lines) + '\n'
+
+
+# One structured (JSON) log line per request with every event it recorded.
+# Events are collected per context rather than per thread: a thread serves
+# one request at a time, and the ASGI entry point starts a list per request
+# that the pool threads it hands work to share through the copied context.
+class LogSink:
+    def __init__(self, logger=None):
+        self.logger = logger or logging.getLogger('livestock.metrics')
+        self._events = contextvars.ContextVar('livestock_metrics_events', default=None)
+
+    def observe(self, kind, name, seconds, input_size=None, output_size=None):
+        events = self._events.get()
+        if events is None:
+            events = []
+            self._events.set(events)
+        event = {'kind': kind, 'name': name, 'ms': round(seconds * 1000, 3)}
+        if input_size is not None:
+            event['in'] = input_size
+            event['out'] = output_size
+        events.append(event)
+
+    def request_started(self):
+        self._events.set([])
+
+    def request_finished(self):
+        events = self._events.get()
+        if events:
+            self.logger.info(json.dumps({'events': events}))
+        self._events.set(None)
+
+
+class Instrumentation:
+    def __init__(self, sinks=()):
+        self.sinks = list(sinks)
+
+    def observe(self, kind, name, seconds, input_size=None, output_size=None):
+        for sink in self.sinks:
+            sink.observe(kind, name, seconds, input_size, output_size)
+
+    # Call fn(*args), recording its wall time and the input/output list sizes
+    def time_rule(self, name, input_size, fn, *args):
+        started = time.perf_counter()
+        result = fn(*args)
+        self.observe('rule', name, time.perf_counter() - started, input_size, len(result))
+        return result
+
+    def request_started(self):
+        for sink in self.sinks:
+            sink.request_started()
+
+    def request_finished(self):
+        for sink in self.sinks:
+            sink.request_finished()
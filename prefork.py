@@ -0,0 +1,260 @@
+# Pre-fork production launcher.
+#
+# The master process imports the app once -- loading the compiled catalogue,
+# building the indexes, likelihood tables and pre-rendered pages -- then binds
+# the listening socket and forks the workers. The workers inherit all of that
+# copy-on-write instead of building their own copy, so memory grows by each
+# worker's private pages only.
+#
+# Before forking, the master runs a full collection and gc.freeze(), which
+# moves every existing object into a permanent generation the collector never
+# walks again. Otherwise the first collection in each worker would write to
+# the GC header of every catalogue object and un-share those pages.
+#
+# The freeze does not stop reference counting: every decoded catalogue
+# object a request touches (disease records, symptom strings, bitmasks) has
+# its count written, and that copies its page into the worker. Only the text
+# index postings are immune, because the catalogue reads them from the
+# compiled file's read-only map, which the workers inherit (see
+# engine/catalogue.py). The rest of a worker's private memory is its own:
+# the server and its threads, and the caches and pages it fills while
+# serving. With the shipped catalogue that is most of the 5-10 MB per worker.
+# With 20,000 diseases per animal it is about 30 MB after a few hundred
+# searches, against about 250 MB shared.
+#
+# Hot reload is handled by the master: when the catalogue source changes it
+# reloads, freezes again and replaces the workers one at a time, so the new
+# catalogue is shared as well. The refreeze first unfreezes and collects, so
+# the replaced catalogue (which has reference cycles, e.g. each symptom
+# normalizer and its lookup cache) is freed instead of staying in the
+# permanent generation. The master also restarts workers that die.
+#
+# A worker told to stop (SIGTERM, on shutdown and when replaced) stops
+# accepting connections and finishes the requests it has in flight, waiting
+# up to --graceful-timeout seconds for them before it exits.
+#
+# Per-worker resident, shared and private memory (from /proc/<pid>/smaps_rollup)
+# is printed once the workers are up, on SIGUSR1, and every --report-interval
+# seconds if given. Linux only.
+#
+#   python prefork.py --workers 4 --bind 0.0.0.0:8000
+#   kill -USR1 <master pid>        # print the memory report
+
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+# The master polls for catalogue changes itself; workers must not start a
+# watcher thread (threads do not survive fork and would reload per worker)
+os.environ['LIVESTOCK_CATALOGUE_RELOAD_INTERVAL'] = '0'
+
+SMAPS_FIELDS = ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty')
+
+
+def read_memory(pid):
+    values = {}
+    try:
+        with open('/proc/%d/smaps_rollup' % pid) as smaps:
+            for line in smaps:
+                name, _, rest = line.partition(':')
+                if name in SMAPS_FIELDS:
+                    values[name] = int(rest.split()[0])
+    except OSError:
+        return None
+    return values
+
+
+def memory_report(master_pid, worker_pids):
+    lines = ['%-8s %-8s %10s %10s %10s %10s' % ('process', 'pid', 'rss_kb', 'pss_kb', 'shared_kb', 'private_kb')]
+    total_rss = total_pss = 0
+    for role, pid in [('master', master_pid)] + [('worker', pid) for pid in worker_pids]:
+        memory = read_memory(pid)
+        if memory is None:
+            lines.append('%-8s %-8d %10s' % (role, pid, 'n/a'))
+            continue
+        shared = memory.get('Shared_Clean', 0) + memory.get('Shared_Dirty', 0)
+        private = memory.get('Private_Clean', 0) + memory.get('Private_Dirty', 0)
+        total_rss += memory.get('Rss', 0)
+        total_pss += memory.get('Pss', 0)
+        lines.append('%-8s %-8d %10d %10d %10d %10d' % (role, pid, memory.get('Rss', 0), memory.get('Pss', 0),
+                                                       shared, private))
+    # PSS splits shared pages between the processes mapping them, so its sum
+    # is the real footprint; the RSS sum counts shared pages once per process
+    lines.append('total rss %d kB, total pss %d kB' % (total_rss, total_pss))
+    return '\n'.join(lines)
+
+
+def freeze_heap():
+    # Objects frozen by an earlier call (a replaced catalogue among them)
+    # must be collectable again before the new freeze
+    gc.unfreeze()
+    gc.collect()
+    gc.freeze()
+
+
+# Wait for the non-daemon threads (the requests in flight) to finish, at
+# most `timeout` seconds in all
+def join_request_threads(timeout):
+    deadline = time.monotonic() + timeout
+    for thread in threading.enumerate():
+        if thread is not threading.current_thread() and not thread.daemon:
+            thread.join(max(0.0, deadline - time.monotonic()))
+
+
+class Master:
+    def __init__(self, host, port, workers, backlog, reload_interval, graceful_timeout=30.0):
+        self.workers = workers
+        self.reload_interval = reload_interval
+        self.graceful_timeout = graceful_timeout
+        self.worker_pids = set()
+        self.running = True
+        self.report_requested = False
+
+        # Load and index the catalogue once, before forking
+        import app as livestock
+        self.livestock = livestock
+        freeze_heap()
+
+        self.listener = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((host, port))
+        self.listener.listen(backlog)
+        self.listener.set_inheritable(True)
+        self.host, self.port = host, self.listener.getsockname()[1]
+
+    def spawn(self):
+        pid = os.fork()
+        if pid:
+            self.worker_pids.add(pid)
+            return pid
+
+        # Worker: serve on the inherited socket until told to stop, then
+        # drain the requests in flight
+        code = 0
+        try:
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGUSR1, signal.SIG_DFL)
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            from werkzeug.serving import make_server
+            server = make_server(self.host, self.port, self.livestock.app, threaded=True,
+                                 fd=self.listener.fileno())
+            # Request threads must outlive serve_forever so they can be
+            # joined; the server itself does not track them
+            server.daemon_threads = False
+            server.block_on_close = False
+
+            # shutdown() waits for serve_forever to return, so it cannot be
+            # called from the handler, which runs inside serve_forever
+            def stop(signum, frame):
+                threading.Thread(target=server.shutdown, name='shutdown', daemon=True).start()
+
+            signal.signal(signal.SIGTERM, stop)
+            server.serve_forever()
+            join_request_threads(self.graceful_timeout)
+        except SystemExit:
+            pass
+        except BaseException:
+            import traceback
+            traceback.print_exc()
+            code = 1
+        finally:
+            os._exit(code)
+
+    def stop_worker(self, pid):
+        try:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+        self.worker_pids.discard(pid)
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if pid in self.worker_pids:
+                self.worker_pids.discard(pid)
+                if self.running:
+                    print("worker %d exited (status %d), restarting" % (pid, status), file=sys.stderr)
+
+    # Reload in the master, then replace the workers one at a time so the
+    # port is never left without a worker
+    def reload_if_changed(self):
+        if not self.livestock.catalogue_store.reload_if_changed(self.livestock.health_advisor):
+            return
+        freeze_heap()
+        print("catalogue reloaded, restarting workers", file=sys.stderr)
+        for pid in list(self.worker_pids):
+            self.spawn()
+            self.stop_worker(pid)
+
+    def run(self, report_interval=None):
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        signal.signal(signal.SIGINT, self.handle_stop)
+        signal.signal(signal.SIGUSR1, self.handle_report)
+
+        print("master %d listening on %s:%d with %d workers" % (os.getpid(), self.host, self.port, self.workers),
+              file=sys.stderr)
+        for _ in range(self.workers):
+            self.spawn()
+
+        started = time.monotonic()
+        next_report = started + 2.0
+        next_reload_check = started + self.reload_interval
+        while self.running:
+            time.sleep(0.5)
+            self.reap()
+            while self.running and len(self.worker_pids) < self.workers:
+                self.spawn()
+
+            now = time.monotonic()
+            if self.reload_interval > 0 and now >= next_reload_check:
+                self.reload_if_changed()
+                next_reload_check = now + self.reload_interval
+            if self.report_requested or (next_report is not None and now >= next_report):
+                print(memory_report(os.getpid(), sorted(self.worker_pids)), file=sys.stderr)
+                self.report_requested = False
+                next_report = now + report_interval if report_interval else None
+
+        for pid in list(self.worker_pids):
+            self.stop_worker(pid)
+        self.listener.close()
+
+    def handle_stop(self, signum, frame):
+        self.running = False
+
+    def handle_report(self, signum, frame):
+        self.report_requested = True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the health advisor with pre-forked workers")
+    parser.add_argument('--bind', default='127.0.0.1:8000', help="host:port to listen on")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--backlog', type=int, default=2048)
+    parser.add_argument('--reload-interval', type=float, default=2.0,
+                        help="seconds between catalogue change checks (0 disables)")
+    parser.add_argument('--graceful-timeout', type=float, default=30.0,
+                        help="seconds a stopping worker waits for its requests in flight")
+    parser.add_argument('--report-interval', type=float, default=None,
+                        help="print the memory report every N seconds")
+    args = parser.parse_args(argv)
+
+    host, _, port = args.bind.rpartition(':')
+    master = Master(host.strip('[]') or '127.0.0.1', int(port), args.workers, args.backlog, args.reload_interval,
+                    args.graceful_timeout)
+    master.run(args.report_interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,61 +1,42 @@
 # Simple Animal Disease Remedies Suggestion System
+#
+# Interactive:  python py/animal-disease-remedies.py
+# Batch:        python py/animal-disease-remedies.py --batch --input records.csv --workers 8 > results.jsonl
 
-# Dictionary of common diseases and their remedies
-disease_remedies = {
-    # Cattle diseases
-    "bovine respiratory disease": [
-        "Consult a veterinarian for appropriate antibiotics",
-        "Provide good ventilation in housing",
-        "Isolate affected animals",
-        "Ensure adequate nutrition and hydration"
-    ],
-    "mastitis": [
-        "Consult a veterinarian for appropriate antibiotics",
-        "Regular milking of affected quarters",
-        "Apply warm compresses to udder",
-        "Maintain clean bedding and milking equipment"
-    ],
-    "foot rot": [
-        "Clean and trim hooves",
-        "Apply topical antibiotics or copper sulfate",
-        "Keep affected animals in dry areas",
-        "Footbaths with zinc or copper sulfate solution"
-    ],
-    
-    # Goat diseases
-    "caprine arthritis encephalitis": [
-        "No cure - manage symptoms",
-        "Provide soft bedding and easy access to food/water",
-        "Anti-inflammatory medications (prescribed by vet)",
-        "Separate infected animals to prevent spread"
-    ],
-    "coccidiosis": [
-        "Administer anticoccidial medications (consult vet)",
-        "Improve sanitation in living areas",
-        "Ensure proper nutrition",
-        "Reduce overcrowding"
-    ],
-    "enterotoxemia": [
-        "Vaccination for prevention",
-        "Antitoxin for acute cases (vet prescribed)",
-        "Gradual diet changes",
-        "Limit grain intake"
-    ],
-    
-    # General diseases affecting multiple species
-    "parasites": [
-        "Appropriate deworming medication (consult vet)",
-        "Rotate pastures if possible",
-        "Regular fecal testing",
-        "Maintain clean living environment"
-    ],
-    "bloat": [
-        "For mild cases: walking the animal",
-        "Stomach tube to relieve pressure (by professional)",
-        "Anti-bloating medication",
-        "Dietary management to prevent recurrence"
-    ]
-}
+import argparse
+import csv
+import functools
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import re
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from engine import DEFAULT_CATALOGUE_PATH, CatalogueStore, RemedyTable  # noqa: E402
+
+def load_remedy_table(path):
+    """
+    Load the keyword remedy rules from the shared disease catalogue. The
+    compiled form of the catalogue is cached on disk next to the source, so
+    only the first run after an edit pays for compiling it.
+
+    Returns:
+    RemedyTable: per-species keyword -> (disease, remedies) lookup tables
+    """
+    return RemedyTable(CatalogueStore(path).load().remedies)
+
+def use_catalogue(path):
+    """Switch this process to the catalogue at path (also the pool worker initializer)"""
+    global REMEDY_TABLE
+    REMEDY_TABLE = load_remedy_table(path)
+
+# Built once per process at import (inherited by pool workers)
+REMEDY_TABLE = load_remedy_table(os.environ.get('LIVESTOCK_CATALOGUE', DEFAULT_CATALOGUE_PATH))
 
 def suggest_remedies(animal_type, symptoms):
     """
@@ -68,37 +49,130 @@ def suggest_remedies(animal_type, symptoms):
     Returns:
     dict: Possible diseases and their remedies
     """
-    possible_diseases = {}
-    
-    # Simple keyword matching for demonstration
-    keyword_to_disease = {
-        "coughing": ["bovine respiratory disease"],
-        "nasal discharge": ["bovine respiratory disease"],
-        "udder swelling": ["mastitis"],
-        "abnormal milk": ["mastitis"],
-        "lameness": ["foot rot", "caprine arthritis encephalitis"],
-        "joint swelling": ["caprine arthritis encephalitis"],
-        "diarrhea": ["coccidiosis", "enterotoxemia", "parasites"],
-        "weight loss": ["parasites", "caprine arthritis encephalitis"],
-        "bloating": ["bloat", "enterotoxemia"]
-    }
-    
-    # Match symptoms to diseases
-    for symptom in symptoms:
-        if symptom.lower() in keyword_to_disease:
-            for disease in keyword_to_disease[symptom.lower()]:
-                if animal_type.lower() == "cattle" and disease in ["caprine arthritis encephalitis"]:
-                    continue  # Skip goat-specific diseases for cattle
-                if animal_type.lower() == "goat" and disease in ["bovine respiratory disease"]:
-                    continue  # Skip cattle-specific diseases for goats
-                    
-                if disease in disease_remedies:
-                    possible_diseases[disease] = disease_remedies[disease]
-    
-    return possible_diseases
+    return REMEDY_TABLE.suggest(animal_type, symptoms)
 
-# Example usage
-if __name__ == "__main__":
+def parse_symptoms(value):
+    """
+    Symptoms from a list, or a string separated by commas or semicolons
+
+    Raises:
+    ValueError: for any other value (e.g. a number or an object in JSONL)
+    """
+    if isinstance(value, list):
+        return [str(s).strip() for s in value]
+    if value is not None and not isinstance(value, str):
+        raise ValueError("symptoms must be a string or a list")
+    return [s.strip() for s in re.split(r'[;,]', value or '') if s.strip()]
+
+def read_records(stream, input_format):
+    """
+    Yield (line number, record) pairs one at a time: raw lines for JSONL,
+    dicts for CSV (which must have animal_type and symptoms columns)
+    """
+    if input_format == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    else:
+        for line_number, line in enumerate(stream, 1):
+            if line.strip():
+                yield line_number, line
+
+def match_chunk(chunk, input_format, output_format, output_fields):
+    """
+    Match one chunk of records (runs in a pool worker)
+
+    Returns:
+    tuple: (formatted output text, list of (line number, error message))
+    """
+    output = io.StringIO()
+    writer = csv.DictWriter(output, output_fields, extrasaction='ignore') if output_format == 'csv' else None
+    errors = []
+    for line_number, record in chunk:
+        try:
+            if input_format == 'jsonl':
+                record = json.loads(record)
+                if not isinstance(record, dict):
+                    raise ValueError("expected a JSON object")
+            results = suggest_remedies(str(record.get('animal_type') or ''), parse_symptoms(record.get('symptoms')))
+        except ValueError as error:
+            errors.append((line_number, str(error)))
+            continue
+
+        if writer is not None:
+            row = dict(record, diseases='; '.join(results))
+            if not isinstance(row.get('symptoms'), str):
+                row['symptoms'] = '; '.join(parse_symptoms(row.get('symptoms')))
+            writer.writerow(row)
+        else:
+            record['results'] = results
+            output.write(json.dumps(record) + '\n')
+    return output.getvalue(), errors
+
+def chunked(records, size):
+    """Group an iterable into lists of at most size items, lazily"""
+    iterator = iter(records)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def throttled(iterable, slots):
+    """Yield items only while a slot is free, so Pool.imap cannot read ahead unboundedly"""
+    for item in iterable:
+        slots.acquire()
+        yield item
+
+def run_batch(source, destination, input_format, output_format, workers, chunk_size, catalogue_path=None):
+    """
+    Stream records from source to destination, matching them in chunks,
+    optionally across a process pool. Output keeps the input order.
+
+    Returns:
+    int: number of records that could not be parsed
+    """
+    records = read_records(source, input_format)
+    # The CSV header is known once the first record is read
+    first = next(records, None)
+    if first is None:
+        return 0
+    records = itertools.chain([first], records)
+    if input_format == 'csv':
+        output_fields = [f for f in first[1] if f is not None] + ['diseases']
+    else:
+        output_fields = ['animal_type', 'symptoms', 'diseases']
+    if output_format == 'csv':
+        csv.DictWriter(destination, output_fields).writeheader()
+
+    task = functools.partial(match_chunk, input_format=input_format, output_format=output_format,
+                             output_fields=output_fields)
+    chunks = chunked(records, chunk_size)
+    failed = 0
+
+    def write(result):
+        nonlocal failed
+        text, errors = result
+        destination.write(text)
+        for line_number, message in errors:
+            print(f"line {line_number}: {message}", file=sys.stderr)
+        failed += len(errors)
+
+    if workers <= 1:
+        for chunk in chunks:
+            write(task(chunk))
+        return failed
+
+    # At most a few chunks per worker are in flight at any time
+    slots = threading.BoundedSemaphore(workers * 4)
+    initializer, initargs = (use_catalogue, (catalogue_path,)) if catalogue_path else (None, ())
+    with multiprocessing.Pool(workers, initializer, initargs) as pool:
+        for result in pool.imap(task, throttled(chunks, slots)):
+            slots.release()
+            write(result)
+    return failed
+
+def interactive():
     print("=== Livestock Health Advisor ===")
     
     animal_type = input("Enter animal type (cattle/goat): ").strip()
@@ -119,3 +193,43 @@ if __name__ == "__main__":
         print("Please consult a veterinarian for proper diagnosis and treatment.")
         
     print("\nDisclaimer: This is a basic advisory tool. Always consult a qualified veterinarian for diagnosis and treatment.")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Suggest remedies for livestock symptoms. Without --batch, asks for one case interactively.",
+        epilog="Batch records need animal_type and symptoms (a list, or a string separated by commas or "
+               "semicolons). Other fields are passed through to the output.")
+    parser.add_argument('--batch', action='store_true', help="match records from --input instead of asking")
+    parser.add_argument('--input', default='-', help="CSV or JSONL file to read ('-' for stdin, the default)")
+    parser.add_argument('--output', default='-', help="file to write results to ('-' for stdout, the default)")
+    parser.add_argument('--input-format', choices=('csv', 'jsonl'),
+                        help="default: from the input file extension, else jsonl")
+    parser.add_argument('--output-format', choices=('csv', 'jsonl'), default='jsonl')
+    parser.add_argument('--workers', type=int, default=1, help="worker processes (default 1: match in-process)")
+    parser.add_argument('--chunk-size', type=int, default=1000, help="records per worker task")
+    parser.add_argument('--catalogue', help="disease catalogue source (default: $LIVESTOCK_CATALOGUE or "
+                                            "data/catalogue.json)")
+    args = parser.parse_args(argv)
+    if args.catalogue:
+        use_catalogue(args.catalogue)
+
+    if not args.batch:
+        interactive()
+        return 0
+
+    input_format = args.input_format or ('csv' if args.input.lower().endswith('.csv') else 'jsonl')
+    source = sys.stdin if args.input == '-' else open(args.input, newline='', encoding='utf-8')
+    destination = sys.stdout if args.output == '-' else open(args.output, 'w', newline='', encoding='utf-8')
+    try:
+        failed = run_batch(source, destination, input_format, args.output_format,
+                           max(1, args.workers), max(1, args.chunk_size), args.catalogue)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if destination is not sys.stdout:
+            destination.close()
+    return 1 if failed else 0
+
+# Example usage
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,401 @@
+// Client-side diagnosis engine.
+//
+// Runs the advisor's rules on the catalogue bundle served by /api/v1/catalogue,
+// in the same order and with the same tie-breaking as LivestockHealthAdvisor:
+// rules 1 and 2 (match count or naive Bayes likelihood), rule 3 (text index or
+// substring search) and rule 5 (symptom coverage). Rules 4 and 6 are already
+// baked into the bundle as the urgent flag and severity score. Selected
+// symptoms and search text go through the same synonym and typo handling as
+// engine/normalize.py and LivestockHealthAdvisor.resolve_search_text first.
+(function (exports) {
+    'use strict';
+
+    const BUNDLE_FORMAT = 2;
+    const MAX_DISTANCE = 2;
+    const SEGMENT_LENGTH = 4;
+
+    function tokenize(text) {
+        return text.toLowerCase().match(/[a-z0-9]+/g) || [];
+    }
+
+    function normalizeKey(text) {
+        return tokenize(text).join(' ');
+    }
+
+    // Typos tolerated in a query key of the given length
+    function allowedDistance(length) {
+        if (length < 4) {
+            return 0;
+        }
+        return length < 8 ? 1 : MAX_DISTANCE;
+    }
+
+    // [start, length] of the segments a key of the given length is cut into
+    function segments(length) {
+        const count = Math.max(MAX_DISTANCE + 1, Math.floor(length / SEGMENT_LENGTH));
+        const base = Math.floor(length / count);
+        const longer = length % count;
+        const bounds = [];
+        let start = 0;
+        for (let index = 0; index < count; index++) {
+            const size = base + (index >= count - longer ? 1 : 0);
+            bounds.push([start, size]);
+            start += size;
+        }
+        return bounds;
+    }
+
+    // Levenshtein distance, or limit + 1 as soon as it is known to exceed
+    // limit; only the diagonal band of the table is computed
+    function editDistance(first, second, limit) {
+        if (Math.abs(first.length - second.length) > limit) {
+            return limit + 1;
+        }
+        let start = 0;
+        while (start < first.length && start < second.length && first[start] === second[start]) {
+            start++;
+        }
+        let end = 0;
+        while (end < first.length - start && end < second.length - start &&
+               first[first.length - 1 - end] === second[second.length - 1 - end]) {
+            end++;
+        }
+        first = first.slice(start, first.length - end);
+        second = second.slice(start, second.length - end);
+        const beyond = limit + 1;
+        let previous = [];
+        for (let column = 0; column <= second.length; column++) {
+            previous.push(column <= limit ? column : beyond);
+        }
+        for (let row = 1; row <= first.length; row++) {
+            const firstChar = first[row - 1];
+            const low = Math.max(1, row - limit);
+            const high = Math.min(second.length, row + limit);
+            const current = new Array(second.length + 1).fill(beyond);
+            current[0] = row <= limit ? row : beyond;
+            let best = low === 1 ? current[0] : beyond;
+            for (let column = low; column <= high; column++) {
+                const value = Math.min(previous[column] + 1, current[column - 1] + 1,
+                    previous[column - 1] + (firstChar !== second[column - 1] ? 1 : 0));
+                current[column] = value;
+                if (value < best) {
+                    best = value;
+                }
+            }
+            if (best > limit) {
+                return beyond;
+            }
+            previous = current;
+        }
+        return Math.min(previous[previous.length - 1], beyond);
+    }
+
+    // SymptomNormalizer over the bundle's [key, vocabulary position] pairs.
+    // The partition index is rebuilt from the keys here rather than shipped,
+    // as it is several times their size.
+    function prepareNormalizer(symptoms, symptomKeys) {
+        const exact = new Map();
+        const keys = [];
+        const partitions = new Map();
+        symptomKeys.forEach(pair => {
+            const key = pair[0];
+            exact.set(key, symptoms[pair[1]]);
+            if (key.length <= MAX_DISTANCE) {
+                return;
+            }
+            segments(key.length).forEach((bound, number) => {
+                const segment = key.length + ' ' + number + ' ' + key.substr(bound[0], bound[1]);
+                if (!partitions.has(segment)) {
+                    partitions.set(segment, []);
+                }
+                partitions.get(segment).push(keys.length);
+            });
+            keys.push(key);
+        });
+        return {exact: exact, keys: keys, partitions: partitions, cache: new Map()};
+    }
+
+    // [distance, key] of the nearest indexed key within the allowed number
+    // of typos (the earliest in vocabulary order among equals), or null
+    function closest(normalizer, key) {
+        const limit = allowedDistance(key.length);
+        if (!limit) {
+            return null;
+        }
+        const candidates = new Set();
+        for (let length = Math.max(key.length - limit, MAX_DISTANCE + 1); length <= key.length + limit; length++) {
+            const shift = key.length - length;
+            const bounds = segments(length);
+            const hits = new Map();
+            bounds.forEach((bound, number) => {
+                const start = bound[0];
+                const size = bound[1];
+                const found = new Set();
+                const last = Math.min(start + limit, start + shift + limit, key.length - size);
+                for (let offset = Math.max(start - limit, start + shift - limit, 0); offset <= last; offset++) {
+                    const keyIds = normalizer.partitions.get(length + ' ' + number + ' ' + key.substr(offset, size));
+                    if (keyIds) {
+                        keyIds.forEach(keyId => found.add(keyId));
+                    }
+                }
+                found.forEach(keyId => hits.set(keyId, (hits.get(keyId) || 0) + 1));
+            });
+            const needed = bounds.length - limit;
+            hits.forEach((count, keyId) => {
+                if (count >= needed) {
+                    candidates.add(keyId);
+                }
+            });
+        }
+
+        let best = null;
+        const sorted = Array.from(candidates).sort((a, b) => a - b);
+        for (let i = 0; i < sorted.length; i++) {
+            const distance = editDistance(key, normalizer.keys[sorted[i]], limit);
+            if (distance <= limit && (best === null || distance < best[0])) {
+                best = [distance, normalizer.keys[sorted[i]]];
+                if (distance === 1) {
+                    break;
+                }
+            }
+        }
+        return best;
+    }
+
+    // The vocabulary entry the text names, or null
+    function lookup(normalizer, text) {
+        const key = normalizeKey(text);
+        if (!key) {
+            return null;
+        }
+        if (!normalizer.cache.has(key)) {
+            let canonical = normalizer.exact.get(key);
+            if (canonical === undefined) {
+                const match = closest(normalizer, key);
+                canonical = match ? normalizer.exact.get(match[1]) : null;
+            }
+            normalizer.cache.set(key, canonical);
+        }
+        return normalizer.cache.get(key);
+    }
+
+    // Each symptom mapped to its vocabulary entry; unrecognised ones are kept
+    // as given, and duplicates after mapping are dropped
+    function normalizeSymptoms(animal, symptoms) {
+        return Array.from(new Set(symptoms.map(symptom => lookup(animal.normalizer, symptom) || symptom)));
+    }
+
+    // Unpack one animal's section of the bundle into disease objects and lookups
+    function prepareAnimal(section) {
+        const column = new Map(section.symptoms.map((symptom, position) => [symptom, position]));
+        const diseases = section.diseases.map((row, position) => ({
+            position: position,
+            id: row[0],
+            name: row[1],
+            description: row[2],
+            severity: row[3],
+            symptomColumns: row[4],
+            symptoms: row[4].map(index => section.symptoms[index]),
+            treatments: row[5].map(treatment => ({type: treatment[0], details: treatment[1]})),
+            urgent: row[6],
+            severity_score: row[7]
+        }));
+        return {
+            symptoms: section.symptoms,
+            listedSymptoms: section.symptoms.slice(0, section.listed),
+            column: column,
+            diseases: diseases,
+            symptomIndex: section.symptom_index,
+            tokens: section.tokens,
+            postings: section.postings,
+            normalizer: prepareNormalizer(section.symptoms, section.symptom_keys)
+        };
+    }
+
+    function prepareBundle(bundle) {
+        if (bundle.format !== BUNDLE_FORMAT) {
+            throw new Error('unsupported catalogue bundle format ' + bundle.format);
+        }
+        const animals = {};
+        Object.keys(bundle.animals).forEach(animal => {
+            animals[animal] = prepareAnimal(bundle.animals[animal]);
+        });
+        return {searchMode: bundle.search_mode, likelihood: bundle.likelihood, animals: animals};
+    }
+
+    // Matching symptom count per disease position, via the symptom index
+    function matchCounts(animal, selected) {
+        const counts = new Int32Array(animal.diseases.length);
+        selected.forEach(symptom => {
+            const column = animal.column.get(symptom);
+            if (column !== undefined) {
+                animal.symptomIndex[column].forEach(position => { counts[position] += 1; });
+            }
+        });
+        return counts;
+    }
+
+    // Rules 1 and 2: diseases with at least one match, most matches first,
+    // ties in catalogue order
+    function rankBySymptoms(animal, selected) {
+        if (selected.length === 0) {
+            return animal.diseases.slice();
+        }
+        const counts = matchCounts(animal, selected);
+        return animal.diseases
+            .filter(disease => counts[disease.position] > 0)
+            .sort((a, b) => counts[b.position] - counts[a.position] || a.position - b.position);
+    }
+
+    // Rules 1 and 2, likelihood mode (see LikelihoodTable in app.py).
+    // Fills probabilities[position] with the normalized posterior.
+    function rankByLikelihood(animal, selected, model, probabilities) {
+        const diseases = animal.diseases;
+        if (diseases.length === 0) {
+            return [];
+        }
+        const counts = matchCounts(animal, selected);
+        const vocabularySize = animal.symptoms.length;
+        const logPrior = -Math.log(diseases.length);
+        const hit = Math.log(model.listed) - Math.log1p(-model.listed);
+        const miss = Math.log(model.unlisted) - Math.log1p(-model.unlisted);
+        const observed = new Set(selected.filter(symptom => animal.column.has(symptom))).size;
+
+        const scores = diseases.map(disease => {
+            const listed = disease.symptoms.length;
+            const hits = counts[disease.position];
+            return logPrior + listed * Math.log1p(-model.listed)
+                + (vocabularySize - listed) * Math.log1p(-model.unlisted)
+                + hits * hit + (observed - hits) * miss;
+        });
+        const peak = Math.max.apply(null, scores);
+        const normalizer = peak + Math.log(scores.reduce((sum, score) => sum + Math.exp(score - peak), 0));
+
+        const ranked = diseases.filter(disease => selected.length === 0 || counts[disease.position] > 0);
+        ranked.forEach(disease => {
+            probabilities[disease.position] = Math.exp(scores[disease.position] - normalizer);
+        });
+        return ranked.sort((a, b) => scores[b.position] - scores[a.position] || a.position - b.position);
+    }
+
+    // Relevance score per disease position; every query term must prefix a token
+    function textSearch(animal, text) {
+        let scores = null;
+        const terms = tokenize(text);
+        for (let t = 0; t < terms.length; t++) {
+            const term = terms[t];
+            const termScores = new Map();
+            let low = 0;
+            let high = animal.tokens.length;
+            while (low < high) {
+                const middle = (low + high) >> 1;
+                if (animal.tokens[middle] < term) {
+                    low = middle + 1;
+                } else {
+                    high = middle;
+                }
+            }
+            for (let position = low; position < animal.tokens.length && animal.tokens[position].startsWith(term); position++) {
+                const posting = animal.postings[position];
+                for (let i = 0; i < posting.length; i += 2) {
+                    termScores.set(posting[i], (termScores.get(posting[i]) || 0) + posting[i + 1]);
+                }
+            }
+
+            if (scores === null) {
+                scores = termScores;
+            } else {
+                const combined = new Map();
+                termScores.forEach((weight, disease) => {
+                    if (scores.has(disease)) {
+                        combined.set(disease, scores.get(disease) + weight);
+                    }
+                });
+                scores = combined;
+            }
+            if (scores.size === 0) {
+                break;
+            }
+        }
+        return scores || new Map();
+    }
+
+    function matchesSubstring(disease, text) {
+        return disease.name.toLowerCase().includes(text) ||
+            disease.description.toLowerCase().includes(text) ||
+            disease.symptoms.some(symptom => symptom.includes(text));
+    }
+
+    // Search text naming a symptom by a synonym or with a typo is replaced
+    // by that symptom, unless the text as typed already finds something
+    function resolveSearchText(animal, searchText, searchMode) {
+        if (!searchText.trim()) {
+            return searchText;
+        }
+        const symptom = lookup(animal.normalizer, searchText);
+        if (symptom === null || normalizeKey(symptom) === normalizeKey(searchText)) {
+            return searchText;
+        }
+        const text = searchText.toLowerCase();
+        const matched = searchMode === 'substring'
+            ? animal.diseases.some(disease => matchesSubstring(disease, text))
+            : textSearch(animal, searchText).size > 0;
+        return matched ? searchText : symptom;
+    }
+
+    // Rule 3: filter by search text, optionally reordering by relevance
+    function filterBySearchText(animal, diseases, searchText, searchMode, rankByRelevance) {
+        if (!searchText) {
+            return diseases;
+        }
+        if (searchMode === 'substring') {
+            const text = searchText.toLowerCase();
+            return diseases.filter(disease => matchesSubstring(disease, text));
+        }
+
+        const scores = textSearch(animal, searchText);
+        const filtered = diseases.filter(disease => scores.has(disease.position));
+        if (rankByRelevance) {
+            // Array.prototype.sort is stable, so equal scores keep their order
+            filtered.sort((a, b) => scores.get(b.position) - scores.get(a.position));
+        }
+        return filtered;
+    }
+
+    // Rule 5: matching symptoms (in disease order) and coverage percentage
+    function calculateSymptomCoverage(animal, diseases, selected, probabilities) {
+        const chosen = new Set(selected);
+        return diseases.map(disease => {
+            const matching = selected.length ? disease.symptoms.filter(symptom => chosen.has(symptom)) : [];
+            return {
+                disease: disease,
+                matching_symptoms: matching,
+                symptom_coverage: selected.length ? matching.length / selected.length * 100 : 0,
+                probability: disease.position in probabilities ? probabilities[disease.position] : null
+            };
+        });
+    }
+
+    // Equivalent of LivestockHealthAdvisor.search_diseases
+    function diagnose(prepared, animalType, selectedSymptoms, searchText, ranking) {
+        const animal = prepared.animals[animalType];
+        if (!animal) {
+            throw new Error('unknown animal type ' + animalType);
+        }
+        ranking = ranking || 'count';
+        // A symptom given twice, or under two names, counts once
+        const selected = normalizeSymptoms(animal, selectedSymptoms);
+        searchText = resolveSearchText(animal, searchText || '', prepared.searchMode);
+        const probabilities = {};
+
+        let results = ranking === 'likelihood'
+            ? rankByLikelihood(animal, selected, prepared.likelihood, probabilities)
+            : rankBySymptoms(animal, selected);
+        const rankByRelevance = selected.length === 0 && ranking === 'count';
+        results = filterBySearchText(animal, results, searchText, prepared.searchMode, rankByRelevance);
+        return calculateSymptomCoverage(animal, results, selected, probabilities);
+    }
+
+    exports.prepareBundle = prepareBundle;
+    exports.diagnose = diagnose;
+})(typeof module !== 'undefined' ? module.exports : (window.LivestockDiagnosis = {}));
@@ -0,0 +1,51 @@
+// Service worker of the offline diagnosis page.
+//
+// Precaches /offline, the client-side engine and the catalogue bundle when it
+// installs, so the page opens and diagnoses without a connection. Those three
+// are fetched from the network first (the bundle is revalidated by ETag) and
+// the cached copy is refreshed on every success; the cache only answers when
+// the network fails. Served as /service-worker.js so its scope covers
+// /offline; every other request is left to the browser.
+'use strict';
+
+const CACHE_NAME = 'livestock-offline-v1';
+const PRECACHED = ['/offline', '/static/js/diagnosis.js', '/api/v1/catalogue'];
+
+self.addEventListener('install', event => {
+    event.waitUntil(
+        caches.open(CACHE_NAME)
+            .then(cache => cache.addAll(PRECACHED.map(url => new Request(url, {cache: 'no-cache'}))))
+            .then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener('activate', event => {
+    event.waitUntil(
+        caches.keys()
+            .then(names => Promise.all(names.filter(name => name !== CACHE_NAME).map(name => caches.delete(name))))
+            .then(() => self.clients.claim())
+    );
+});
+
+self.addEventListener('fetch', event => {
+    const url = new URL(event.request.url);
+    if (event.request.method !== 'GET' || url.origin !== self.location.origin || !PRECACHED.includes(url.pathname)) {
+        return;
+    }
+    event.respondWith(
+        fetch(event.request)
+            .then(response => {
+                if (response.ok) {
+                    const copy = response.clone();
+                    event.waitUntil(caches.open(CACHE_NAME).then(cache => cache.put(url.pathname, copy)));
+                }
+                return response;
+            })
+            .catch(error => caches.match(url.pathname).then(cached => {
+                if (cached === undefined) {
+                    throw error;
+                }
+                return cached;
+            }))
+    );
+});
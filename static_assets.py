@@ -0,0 +1,133 @@
+# Static asset layer for the files under static/images.
+#
+# Every file is indexed once at startup: size, modification time, a content
+# ETag and its MIME type, so a request does no hashing or directory lookups.
+# Small files can be kept in memory; everything else is handed to the WSGI
+# server as a file wrapper, which servers such as gunicorn send with the
+# zero-copy sendfile() system call instead of copying through the worker.
+# Werkzeug's make_conditional answers If-None-Match / If-Modified-Since with
+# 304 and Range with 206 from the precomputed metadata.
+# Fingerprinted files (a content hash in the name, as produced by images.py)
+# are cached by clients for a year; other files are revalidated by ETag.
+
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+from collections import namedtuple
+
+from flask import Response, abort
+from werkzeug.security import safe_join
+from werkzeug.wsgi import wrap_file
+
+Asset = namedtuple('Asset', ['path', 'size', 'mtime_ns', 'etag', 'mimetype', 'fingerprinted', 'data'])
+
+FINGERPRINT = re.compile(r'\.[0-9a-f]{8,}\.')
+IMMUTABLE_MAX_AGE = 31536000
+
+
+class StaticAssets:
+    def __init__(self, root, memory_max_size=65536, memory_budget=16 * 1024 * 1024):
+        self.root = root
+        # Files up to memory_max_size bytes are held in memory until
+        # memory_budget bytes are used; 0 disables the memory cache
+        self.memory_max_size = memory_max_size
+        self.memory_budget = memory_budget
+        self.memory_used = 0
+        self.assets = {}
+        self._lock = threading.Lock()
+
+    def scan(self):
+        assets = {}
+        self.memory_used = 0
+        for directory, _, file_names in os.walk(self.root):
+            for file_name in sorted(file_names):
+                path = os.path.join(directory, file_name)
+                name = os.path.relpath(path, self.root).replace(os.sep, '/')
+                asset = self.index_file(name, path)
+                if asset is not None:
+                    assets[name] = asset
+        self.assets = assets
+        return assets
+
+    def index_file(self, name, path):
+        try:
+            with open(path, 'rb') as source:
+                stat = os.fstat(source.fileno())
+                digest = hashlib.sha256()
+                keep = 0 < stat.st_size <= self.memory_max_size and \
+                    self.memory_used + stat.st_size <= self.memory_budget
+                chunks = []
+                for chunk in iter(lambda: source.read(65536), b''):
+                    digest.update(chunk)
+                    if keep:
+                        chunks.append(chunk)
+        except OSError:
+            return None
+
+        data = b''.join(chunks) if keep else None
+        if data is not None:
+            self.memory_used += len(data)
+        mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        return Asset(path, stat.st_size, stat.st_mtime_ns, digest.hexdigest()[:32], mimetype,
+                     bool(FINGERPRINT.search(os.path.basename(name))), data)
+
+    # Index entry for name if it can be served without looking at the file:
+    # fingerprinted files never change under the same name
+    def cached(self, name):
+        asset = self.assets.get(name)
+        return asset if asset is not None and asset.fingerprinted else None
+
+    # Index entry for name, picking up files added or changed since the scan
+    def lookup(self, name):
+        asset = self.cached(name)
+        if asset is not None:
+            return asset
+        asset = self.assets.get(name)
+
+        path = safe_join(self.root, name)
+        if path is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if asset is not None and (stat.st_size, stat.st_mtime_ns) == (asset.size, asset.mtime_ns):
+            return asset
+        if not os.path.isfile(path):
+            return None
+        with self._lock:
+            if asset is not None and asset.data is not None:
+                self.memory_used -= len(asset.data)
+            asset = self.index_file(name, path)
+            if asset is not None:
+                self.assets[name] = asset
+        return asset
+
+    @staticmethod
+    def cache_control(asset):
+        if asset.fingerprinted:
+            return 'public, max-age=%d, immutable' % IMMUTABLE_MAX_AGE
+        return 'public, no-cache'
+
+    def response(self, name, request):
+        asset = self.lookup(name)
+        if asset is None:
+            abort(404)
+
+        if asset.data is not None:
+            response = Response(asset.data, mimetype=asset.mimetype)
+        else:
+            try:
+                source = open(asset.path, 'rb')
+            except OSError:
+                abort(404)
+            response = Response(wrap_file(request.environ, source), mimetype=asset.mimetype,
+                                direct_passthrough=True)
+            response.content_length = asset.size
+
+        response.set_etag(asset.etag)
+        response.last_modified = asset.mtime_ns / 1e9
+        response.headers['Cache-Control'] = self.cache_control(asset)
+        return response.make_conditional(request, accept_ranges=True, complete_length=asset.size)
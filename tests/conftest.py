@@ -0,0 +1,28 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+# Keep the surveillance counts of tests that import the app out of data/
+os.environ.setdefault('LIVESTOCK_SURVEILLANCE_PATH',
+                      os.path.join(tempfile.mkdtemp(prefix='livestock-'), 'surveillance.sqlite3'))
+
+from engine import DEFAULT_CATALOGUE_PATH, CatalogueStore  # noqa: E402
+from synthetic import synthetic_catalogue as build_synthetic_catalogue  # noqa: E402
+
+
+# (database, symptom lists, remedies) of data/catalogue.json
+@pytest.fixture(scope='session')
+def shipped_catalogue():
+    return CatalogueStore(DEFAULT_CATALOGUE_PATH).load()[:3]
+
+
+# (database, symptom lists) of a synthetic catalogue, 300 diseases per
+# animal type
+@pytest.fixture(scope='session')
+def synthetic_catalogue():
+    return build_synthetic_catalogue(300)
@@ -0,0 +1,125 @@
+# Focused tests of the advisor's rules on small hand-written catalogues.
+
+import errno
+import json
+
+import pytest
+
+from engine import CatalogueStore, LivestockHealthAdvisor
+
+SOURCE = {
+    'symptoms': {'cattle': ['coughing', 'fever', 'lameness']},
+    'diseases': {'cattle': [
+        {'id': 1, 'name': 'Respiratory disease', 'symptoms': ['coughing', 'fever', 'fever'],
+         'description': 'Lungs.', 'severity': 'High', 'treatments': []},
+        {'id': 2, 'name': 'Foot rot', 'symptoms': ['lameness', 'fever'],
+         'description': 'Feet.', 'severity': 'Medium', 'treatments': []},
+    ]},
+    'remedies': {'diseases': [], 'keywords': {}},
+}
+
+
+@pytest.fixture(params=['source', 'compiled'])
+def advisor(request, tmp_path):
+    if request.param == 'source':
+        return LivestockHealthAdvisor(SOURCE['diseases'], SOURCE['symptoms'], cache_size=0)
+    path = tmp_path / 'catalogue.json'
+    path.write_text(json.dumps(SOURCE))
+    return LivestockHealthAdvisor(*CatalogueStore(str(path)).load()[:3], cache_size=0)
+
+
+def test_symptom_listed_twice_counts_once(advisor):
+    disease = advisor.catalogue.diseases['cattle'][0]
+    assert disease.symptoms == ('coughing', 'fever')
+
+    results = advisor.search_diseases('cattle', ['coughing', 'fever'], '')
+    assert [match.disease.id for match in results] == [1, 2]
+    assert list(results[0].matching_symptoms) == ['coughing', 'fever']
+    assert results[0].symptom_coverage == 100.0
+    assert results[1].symptom_coverage == 50.0
+
+
+def test_symptom_listed_twice_counts_once_in_likelihood(advisor):
+    results = advisor.search_diseases('cattle', ['fever'], '', ranking='likelihood')
+    # Both diseases list fever once and two symptoms in all, so they tie
+    assert [match.disease.id for match in results] == [1, 2]
+    assert results[0].probability == pytest.approx(results[1].probability)
+
+
+def test_symptom_selected_twice_counts_once(advisor):
+    results = advisor.search_diseases('cattle', ['coughing', 'coughing'], '')
+    assert [match.disease.id for match in results] == [1]
+    assert results[0].symptom_coverage == 100.0
+
+
+def test_failed_reload_leaves_everything_in_place(advisor):
+    installed, notified = [], []
+
+    # Like the app's landing page, which needs every animal type
+    def prepare_pages(catalogue):
+        pages = catalogue.symptoms['goat']
+        return lambda: installed.append(pages)
+
+    advisor.reload_preparers.append(lambda catalogue: lambda: installed.append('first'))
+    advisor.reload_preparers.append(prepare_pages)
+    advisor.reload_listeners.append(notified.append)
+    current = advisor.catalogue
+
+    with pytest.raises(KeyError):
+        advisor.load_catalogue(SOURCE['diseases'], SOURCE['symptoms'])
+    assert advisor.catalogue is current
+    assert installed == [] and notified == []
+
+    symptoms = dict(SOURCE['symptoms'], goat=['fever'])
+    advisor.load_catalogue(dict(SOURCE['diseases'], goat=[]), symptoms)
+    assert installed == ['first', ('fever',)]
+    assert notified == [advisor.catalogue] and advisor.catalogue is not current
+
+
+def test_read_only_file_system_loads_from_source(tmp_path, monkeypatch):
+    path = tmp_path / 'catalogue.json'
+    path.write_text(json.dumps(SOURCE))
+
+    def compile(self, raw=None):
+        raise OSError(errno.EROFS, 'Read-only file system')
+
+    monkeypatch.setattr(CatalogueStore, 'compile', compile)
+    store = CatalogueStore(str(path))
+    advisor = LivestockHealthAdvisor(*store.load()[:3], cache_size=0)
+    assert store.last_load == 'source'
+    assert [match.disease.id for match in advisor.search_diseases('cattle', ['fever'], '')] == [1, 2]
+
+
+# Diseases that tie on every ranking, so their order is down to the sort keys
+TIES = {
+    'symptoms': {'cattle': ['coughing', 'fever']},
+    'diseases': {'cattle': [
+        {'id': number, 'name': 'Disease %d' % number, 'symptoms': ['coughing', 'fever'],
+         'description': 'Same.', 'severity': 'Medium', 'treatments': []}
+        for number in range(1, 31)
+    ]},
+}
+
+
+@pytest.mark.parametrize('catalogue', ['ties', 'synthetic_catalogue'])
+@pytest.mark.parametrize('ranking', LivestockHealthAdvisor.RANKINGS)
+def test_page_is_a_slice_of_the_full_list(request, catalogue, ranking):
+    if catalogue == 'ties':
+        advisor = LivestockHealthAdvisor(TIES['diseases'], TIES['symptoms'], cache_size=0)
+    else:
+        advisor = LivestockHealthAdvisor(*request.getfixturevalue(catalogue), cache_size=0)
+    vocabulary = sorted(advisor.catalogue.symptom_bits['cattle'])
+    queries = [([], ''), ([], 'disease'), (vocabulary[:1], ''), (vocabulary[:3], ''), (vocabulary[1:4], 'viral'),
+               (['no such symptom'], '')]
+
+    for selected, search_text in queries:
+        full = advisor.evaluate_rules('cattle', selected, search_text, ranking=ranking)
+        # Up to, at and past the end of the list
+        for offset in sorted({0, 1, 7, max(0, len(full) - 1), len(full), len(full) + 5}):
+            for limit in (1, 5, 20):
+                page = advisor.evaluate_page('cattle', selected, search_text, ranking=ranking, offset=offset,
+                                             limit=limit)
+                assert page.total == len(full)
+                assert [(match.disease.id, match.symptom_coverage, match.probability) for match in page.results] == [
+                    (match.disease.id, match.symptom_coverage, match.probability)
+                    for match in full[offset:offset + limit]]
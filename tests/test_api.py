@@ -0,0 +1,82 @@
+# Tests of the JSON API through Flask's test client.
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def client():
+    from app import app
+    return app.test_client()
+
+
+@pytest.mark.parametrize('animal_type', ['sheep', ['cattle'], {}, 3, None])
+def test_diagnose_rejects_unknown_animal_type(client, animal_type):
+    response = client.post('/api/v1/diagnose', json={'animal_type': animal_type, 'symptoms': ['fever']})
+    assert response.status_code == 400
+    assert response.get_json()['error'].startswith('unknown animal_type')
+
+
+def test_diagnose_batch_fails_only_the_bad_case(client):
+    response = client.post('/api/v1/diagnose', json=[
+        {'animal_type': 'cattle', 'symptoms': ['coughing']},
+        {'animal_type': ['cattle'], 'symptoms': ['coughing']},
+        {'animal_type': 'goat', 'symptoms': ['diarrhea']},
+    ])
+    assert response.status_code == 200
+    first, bad, last = response.get_json()['results']
+    assert first['results'] and last['results']
+    assert bad == {'error': "unknown animal_type: ['cattle']"}
+
+
+@pytest.mark.parametrize('animal_type', ['sheep', ['cattle'], {}, 3])
+def test_interview_rejects_unknown_animal_type(client, animal_type):
+    response = client.post('/api/v1/interview', json={'animal_type': animal_type})
+    assert response.status_code == 400
+    assert response.get_json()['error'].startswith('unknown animal_type')
+
+
+def test_interview_state_travels_in_the_session_id(client):
+    from app import health_advisor
+    started = client.post('/api/v1/interview', json={'animal_type': 'cattle', 'confirmed': ['Fever']})
+    assert started.status_code == 201
+    state = started.get_json()
+    assert state['confirmed'] == ['fever']
+
+    answers = [('fever', True)]
+    for present in (False, None, True):
+        symptom = state['next_question']['symptom']
+        response = client.post('/api/v1/interview/' + state['session'], json={'symptom': symptom, 'present': present})
+        assert response.status_code == 200
+        state = response.get_json()
+        answers.append((symptom, present))
+
+    expected = health_advisor.catalogue.question_table('cattle').replay(answers)
+    assert state['candidates'] == len(expected.candidates)
+    assert (state['confirmed'], state['ruled_out'], state['skipped']) == (
+        list(expected.confirmed), list(expected.ruled_out), list(expected.skipped))
+    assert client.get('/api/v1/interview/' + state['session']).get_json() == state
+
+    # Repeating an answer changes nothing, including the session id
+    repeated = client.post('/api/v1/interview/' + state['session'], json={'symptom': 'fever', 'present': True})
+    assert repeated.get_json() == state
+    assert client.delete('/api/v1/interview/' + state['session']).status_code == 204
+
+
+@pytest.mark.parametrize('session_id', ['x', 'bm90IGpzb24', 'WyJzaGVlcCIsW11d', 'WyJjYXR0bGUiLFtbMSwxXV1d'])
+def test_interview_rejects_malformed_session(client, session_id):
+    assert client.get('/api/v1/interview/' + session_id).status_code == 404
+
+
+def test_offline_page_registers_a_service_worker(client):
+    page = client.get('/offline').get_data(as_text=True)
+    assert "navigator.serviceWorker.register('/service-worker.js')" in page
+
+    response = client.get('/service-worker.js')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/javascript'
+    script = response.get_data(as_text=True)
+    # Everything the offline page needs is precached
+    for url in ('/offline', '/static/js/diagnosis.js', '/api/v1/catalogue'):
+        assert "'%s'" % url in script
+        assert client.get(url).status_code == 200
+    response.close()
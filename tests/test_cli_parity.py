@@ -0,0 +1,164 @@
+# Parity tests: the command-line advisor on the shared engine against the
+# original stand-alone implementation.
+#
+# The reference below is the matcher py/animal-disease-remedies.py shipped
+# before it moved onto the engine, with its own tables, kept verbatim. Every
+# combination of up to MAX_SYMPTOMS symptoms (all keywords, case variants and
+# unknown symptoms) is run for each animal type through both, and the results
+# -- diseases, their order and remedies -- must be identical. The engine
+# normalizes symptoms (typos, synonyms) before matching, which the original
+# did not, so the reference is given the symptoms as the engine normalized
+# them.
+
+import importlib.util
+import io
+import itertools
+import json
+import os
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+MAX_SYMPTOMS = 3
+ANIMAL_TYPES = ["cattle", "goat", "Cattle", "GOAT", "sheep", ""]
+EXTRA_SYMPTOMS = ["Coughing", "DIARRHEA", "fever", "swollen udder", ""]
+
+REFERENCE_REMEDIES = {
+    # Cattle diseases
+    "bovine respiratory disease": [
+        "Consult a veterinarian for appropriate antibiotics",
+        "Provide good ventilation in housing",
+        "Isolate affected animals",
+        "Ensure adequate nutrition and hydration"
+    ],
+    "mastitis": [
+        "Consult a veterinarian for appropriate antibiotics",
+        "Regular milking of affected quarters",
+        "Apply warm compresses to udder",
+        "Maintain clean bedding and milking equipment"
+    ],
+    "foot rot": [
+        "Clean and trim hooves",
+        "Apply topical antibiotics or copper sulfate",
+        "Keep affected animals in dry areas",
+        "Footbaths with zinc or copper sulfate solution"
+    ],
+    
+    # Goat diseases
+    "caprine arthritis encephalitis": [
+        "No cure - manage symptoms",
+        "Provide soft bedding and easy access to food/water",
+        "Anti-inflammatory medications (prescribed by vet)",
+        "Separate infected animals to prevent spread"
+    ],
+    "coccidiosis": [
+        "Administer anticoccidial medications (consult vet)",
+        "Improve sanitation in living areas",
+        "Ensure proper nutrition",
+        "Reduce overcrowding"
+    ],
+    "enterotoxemia": [
+        "Vaccination for prevention",
+        "Antitoxin for acute cases (vet prescribed)",
+        "Gradual diet changes",
+        "Limit grain intake"
+    ],
+    
+    # General diseases affecting multiple species
+    "parasites": [
+        "Appropriate deworming medication (consult vet)",
+        "Rotate pastures if possible",
+        "Regular fecal testing",
+        "Maintain clean living environment"
+    ],
+    "bloat": [
+        "For mild cases: walking the animal",
+        "Stomach tube to relieve pressure (by professional)",
+        "Anti-bloating medication",
+        "Dietary management to prevent recurrence"
+    ]
+}
+
+def reference_suggest_remedies(animal_type, symptoms):
+    """
+    Suggest potential remedies based on animal type and symptoms
+    
+    Parameters:
+    animal_type (str): Type of animal (cattle, goat, etc.)
+    symptoms (list): List of symptoms the animal is showing
+    
+    Returns:
+    dict: Possible diseases and their remedies
+    """
+    possible_diseases = {}
+    
+    # Simple keyword matching for demonstration
+    keyword_to_disease = {
+        "coughing": ["bovine respiratory disease"],
+        "nasal discharge": ["bovine respiratory disease"],
+        "udder swelling": ["mastitis"],
+        "abnormal milk": ["mastitis"],
+        "lameness": ["foot rot", "caprine arthritis encephalitis"],
+        "joint swelling": ["caprine arthritis encephalitis"],
+        "diarrhea": ["coccidiosis", "enterotoxemia", "parasites"],
+        "weight loss": ["parasites", "caprine arthritis encephalitis"],
+        "bloating": ["bloat", "enterotoxemia"]
+    }
+    
+    # Match symptoms to diseases
+    for symptom in symptoms:
+        if symptom.lower() in keyword_to_disease:
+            for disease in keyword_to_disease[symptom.lower()]:
+                if animal_type.lower() == "cattle" and disease in ["caprine arthritis encephalitis"]:
+                    continue  # Skip goat-specific diseases for cattle
+                if animal_type.lower() == "goat" and disease in ["bovine respiratory disease"]:
+                    continue  # Skip cattle-specific diseases for goats
+                    
+                if disease in REFERENCE_REMEDIES:
+                    possible_diseases[disease] = REFERENCE_REMEDIES[disease]
+    
+    return possible_diseases
+
+
+def load_cli():
+    spec = importlib.util.spec_from_file_location('animal_disease_remedies',
+                                                  os.path.join(ROOT, 'py', 'animal-disease-remedies.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope='module')
+def cli():
+    return load_cli()
+
+
+@pytest.mark.parametrize('animal_type', ANIMAL_TYPES)
+def test_cli_matches_original(cli, animal_type):
+    keywords = ["coughing", "nasal discharge", "udder swelling", "abnormal milk", "lameness",
+                "joint swelling", "diarrhea", "weight loss", "bloating"]
+    mismatches = []
+    for size in range(MAX_SYMPTOMS + 1):
+        for symptoms in itertools.permutations(keywords + EXTRA_SYMPTOMS, size):
+            normalized = [cli.REMEDY_TABLE.normalizer.lookup(symptom) or symptom for symptom in symptoms]
+            expected = reference_suggest_remedies(animal_type, normalized)
+            actual = cli.suggest_remedies(animal_type, list(symptoms))
+            if list(expected.items()) != list(actual.items()):
+                mismatches.append((symptoms, list(expected), list(actual)))
+    assert mismatches == []
+
+
+@pytest.mark.parametrize('value', [5, 2.5, True, {'cough': 1}])
+def test_parse_symptoms_rejects_other_values(cli, value):
+    with pytest.raises(ValueError):
+        cli.parse_symptoms(value)
+
+
+def test_batch_reports_non_string_symptoms(cli):
+    source = io.StringIO('{"animal_type": "cattle", "symptoms": 5}\n'
+                         '{"animal_type": "cattle", "symptoms": "coughing"}\n')
+    destination = io.StringIO()
+    assert cli.run_batch(source, destination, 'jsonl', 'jsonl', workers=1, chunk_size=10) == 1
+    records = [json.loads(line) for line in destination.getvalue().splitlines()]
+    assert [record['symptoms'] for record in records] == ['coughing']
+    assert 'bovine respiratory disease' in records[0]['results']
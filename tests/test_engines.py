@@ -0,0 +1,86 @@
+# Parity tests: the numpy engine (rules 1 and 2 as sparse matrix products)
+# against the bitset engine, on the shipped catalogue and a synthetic one.
+#
+# Single searches (full lists and pages, both rankings), batches through
+# diagnose_batch and rank_batch must give the same diseases in the same order
+# with the same matching symptoms, coverage and probability.
+
+import random
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from engine import LivestockHealthAdvisor  # noqa: E402
+
+CASES = 200
+
+SEARCH_TEXTS = ['', '', 'fever', 'viral', 'fev', 'milk', 'zzz']
+
+
+def summary(match):
+    probability = None if match.probability is None else round(match.probability, 12)
+    return match.disease.id, match.matching_symptoms, round(match.symptom_coverage, 9), probability
+
+
+def random_queries(catalogue, count, seed=0):
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        animal_type = rng.choice(sorted(catalogue.diseases))
+        vocabulary = sorted(catalogue.symptom_bits[animal_type])
+        selected = rng.sample(vocabulary, min(len(vocabulary), rng.randint(0, 4)))
+        if rng.random() < 0.1:
+            selected.append('no such symptom')
+        queries.append((animal_type, selected, rng.choice(SEARCH_TEXTS), rng.choice(LivestockHealthAdvisor.RANKINGS)))
+    return queries
+
+
+@pytest.fixture(params=['shipped_catalogue', 'synthetic_catalogue'])
+def advisors(request):
+    data = request.getfixturevalue(request.param)
+    return (LivestockHealthAdvisor(*data, cache_size=0, engine='bitset'),
+            LivestockHealthAdvisor(*data, cache_size=0, engine='numpy'))
+
+
+def test_single_searches_match(advisors):
+    bitset, vectorized = advisors
+    for animal_type, selected, search_text, ranking in random_queries(bitset.catalogue, CASES):
+        expected = bitset.search_diseases(animal_type, selected, search_text, ranking)
+        actual = vectorized.search_diseases(animal_type, selected, search_text, ranking)
+        assert [summary(match) for match in actual] == [summary(match) for match in expected]
+
+
+def test_pages_match(advisors):
+    bitset, vectorized = advisors
+    rng = random.Random(1)
+    for animal_type, selected, search_text, ranking in random_queries(bitset.catalogue, CASES, seed=1):
+        offset, limit = rng.choice([0, 0, 5, 20, 10000]), rng.choice([1, 10, 20])
+        expected = bitset.search_diseases(animal_type, selected, search_text, ranking, limit, offset)
+        actual = vectorized.search_diseases(animal_type, selected, search_text, ranking, limit, offset)
+        assert actual.total == expected.total
+        assert [summary(match) for match in actual.results] == [summary(match) for match in expected.results]
+
+
+def test_batches_match(advisors):
+    bitset, vectorized = advisors
+    cases = random_queries(bitset.catalogue, CASES, seed=2)
+    # Repeated cases share one evaluation
+    cases += cases[:20]
+    expected = bitset.diagnose_batch(cases)
+    actual = vectorized.diagnose_batch(cases)
+    assert [[summary(match) for match in results] for results in actual] == [
+        [summary(match) for match in results] for results in expected]
+
+
+def test_rank_batch_matches_rank_by_symptoms(advisors):
+    bitset, vectorized = advisors
+    cases = {number: case for number, case in enumerate(random_queries(bitset.catalogue, CASES, seed=3))}
+    ranked = vectorized.rank_batch(cases, vectorized.catalogue)
+    assert ranked
+    for number, (animal_type, selected, _, ranking) in cases.items():
+        if selected and ranking == 'count':
+            expected = bitset.rank_by_symptoms(animal_type, selected)
+            assert [disease.id for disease in ranked[number]] == [disease.id for disease in expected]
+        else:
+            assert number not in ranked
@@ -0,0 +1,17 @@
+# Tests of the instrumentation sinks.
+
+from metrics import PrometheusSink, format_labels
+
+
+def test_label_values_are_escaped():
+    assert format_labels(disease='Foot "and" mouth\\FMD\nnew', region='north') == (
+        'disease="Foot \\"and\\" mouth\\\\FMD\\nnew",region="north"')
+
+
+def test_render_escapes_gauge_and_histogram_labels():
+    sink = PrometheusSink()
+    sink.observe('request', 'say "hi"', 0.01)
+    sink.gauges['livestock_cases'] = ('Cases', lambda: {format_labels(disease='a\nb'): 2})
+    lines = sink.render().splitlines()
+    assert 'livestock_cases{disease="a\\nb"} 2' in lines
+    assert 'livestock_request_seconds_count{endpoint="say \\"hi\\""} 1' in lines
@@ -0,0 +1,44 @@
+# Tests of free-text symptom normalization.
+
+import pytest
+
+from engine import SymptomNormalizer
+from engine.normalize import edit_distance
+
+VOCABULARY = ['coughing', 'nasal discharge', 'fever', 'lameness', 'diarrhea', 'itch']
+
+
+@pytest.fixture(scope='module')
+def normalizer():
+    return SymptomNormalizer(VOCABULARY)
+
+
+@pytest.mark.parametrize('text, symptom', [
+    ('Coughing', 'coughing'),
+    ('  nasal   DISCHARGE!', 'nasal discharge'),
+    ('runny nose', 'nasal discharge'),
+    ('coughs', 'coughing'),
+    ('feverr', 'fever'),
+    ('diarhoea', 'diarrhea'),
+    ('nasl dischrge', 'nasal discharge'),
+    ('itch', 'itch'),
+])
+def test_lookup(normalizer, text, symptom):
+    assert normalizer.lookup(text) == symptom
+
+
+@pytest.mark.parametrize('text', ['', '!!', 'itc', 'fevr x', 'cgouhing  xyz', 'no such symptom'])
+def test_lookup_misses(normalizer, text):
+    assert normalizer.lookup(text) is None
+
+
+def test_normalize_keeps_unknown_and_drops_duplicates(normalizer):
+    assert normalizer.normalize(['cough', 'Coughing', 'bogus', 'fever', 'pyrexia']) == ['coughing', 'bogus', 'fever']
+
+
+@pytest.mark.parametrize('first, second, distance', [
+    ('fever', 'fever', 0), ('fever', 'fevr', 1), ('fever', 'feverr', 1), ('lameness', 'lamnes', 2),
+    ('coughing', 'nasal', 3),
+])
+def test_edit_distance_is_capped_at_limit_plus_one(first, second, distance):
+    assert edit_distance(first, second, 2) == min(distance, 3)
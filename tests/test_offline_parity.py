@@ -0,0 +1,117 @@
+# Parity tests: the browser engine (static/js/diagnosis.js, run under Node)
+# against the server.
+#
+# Random queries are diagnosed by the server path -- normalize_symptoms,
+# resolve_search_text, then search_diseases -- and by diagnose() on the
+# catalogue bundle /api/v1/catalogue serves, in both search modes, on the
+# shipped catalogue and a synthetic one. Selected symptoms and search text
+# include synonyms, typos and case variants, so the client's normalizer is
+# covered along with the rules. The results -- diseases, their order,
+# matching symptoms, coverage and probability -- must be identical. The
+# tests are skipped where Node is not installed.
+
+import json
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+
+import pytest
+
+from engine import LivestockHealthAdvisor
+from engine.normalize import SYMPTOM_SYNONYMS
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+CASES = 300
+
+pytestmark = pytest.mark.skipif(shutil.which('node') is None, reason="node is not installed")
+
+SEARCH_TEXTS = ['', '', 'fever', 'viral', 'fev', 'milk', 'Disease 1', 'term1', '!!', 'zzz',
+                'feverr', 'runny nose', 'diarrhoea', 'coughng', 'LAME', 'off feed']
+
+RUNNER = '''
+const diagnosis = require(process.argv[1]);
+const fs = require('fs');
+const prepared = diagnosis.prepareBundle(JSON.parse(fs.readFileSync(process.argv[2], 'utf8')));
+const cases = JSON.parse(fs.readFileSync(process.argv[3], 'utf8'));
+console.log(JSON.stringify(cases.map(c => diagnosis.diagnose(prepared, c[0], c[1], c[2], c[3]).map(match => [
+    match.disease.id, match.matching_symptoms, Math.round(match.symptom_coverage * 1e9) / 1e9,
+    match.probability === null ? null : Math.round(match.probability * 1e12) / 1e12]))));
+'''
+
+
+# One typo (a dropped, doubled or swapped character) in a longer symptom
+def misspell(rng, symptom):
+    if len(symptom) < 8:
+        return symptom.upper()
+    position = rng.randrange(1, len(symptom) - 1)
+    return rng.choice([
+        symptom[:position] + symptom[position + 1:],
+        symptom[:position] + symptom[position] + symptom[position:],
+        symptom[:position - 1] + symptom[position] + symptom[position - 1] + symptom[position + 1:],
+    ])
+
+
+def random_query(rng, catalogue, animal_type):
+    vocabulary = sorted(catalogue.symptom_bits[animal_type])
+    selected = rng.sample(vocabulary, min(len(vocabulary), rng.randint(0, 4))) if vocabulary else []
+    selected = [misspell(rng, symptom) if rng.random() < 0.3 else symptom for symptom in selected]
+    if rng.random() < 0.3:
+        selected.append(rng.choice(rng.choice(SYMPTOM_SYNONYMS)))
+    if rng.random() < 0.1:
+        selected.append('no such symptom')
+    search_text = rng.choice(SEARCH_TEXTS)
+    if vocabulary and rng.random() < 0.2:
+        search_text = misspell(rng, rng.choice(vocabulary))
+    return [animal_type, selected, search_text, rng.choice(LivestockHealthAdvisor.RANKINGS)]
+
+
+def summary(match):
+    probability = None if match.probability is None else round(match.probability, 12)
+    return [match.disease.id, list(match.matching_symptoms), round(match.symptom_coverage, 9), probability]
+
+
+def run_client(bundle, cases):
+    with tempfile.TemporaryDirectory() as directory:
+        bundle_path = os.path.join(directory, 'bundle.json')
+        cases_path = os.path.join(directory, 'cases.json')
+        with open(bundle_path, 'wb') as destination:
+            destination.write(bundle)
+        with open(cases_path, 'w') as destination:
+            json.dump(cases, destination)
+        output = subprocess.check_output(['node', '-e', RUNNER, os.path.join(ROOT, 'static', 'js', 'diagnosis.js'),
+                                          bundle_path, cases_path])
+    return json.loads(output)
+
+
+def check(name, data, cases, rng):
+    # The bundle is built by the app, which is only imported when Node is here to run the client
+    from app import build_catalogue_bundle
+
+    mismatches = []
+    checked = 0
+    for search_mode in ('index', 'substring'):
+        advisor = LivestockHealthAdvisor(*data, cache_size=0, search_mode=search_mode)
+        catalogue = advisor.catalogue
+        queries = [random_query(rng, catalogue, animal_type) for animal_type in catalogue.diseases
+                   for _ in range(cases)]
+        expected = []
+        for animal_type, selected, search_text, ranking in queries:
+            results = advisor.search_diseases(animal_type, catalogue.normalize_symptoms(animal_type, selected),
+                                              advisor.resolve_search_text(animal_type, search_text), ranking=ranking)
+            expected.append([summary(match) for match in results])
+
+        bundle = build_catalogue_bundle(catalogue, search_mode).encodings['identity'][1]
+        for query, wanted, got in zip(queries, expected, run_client(bundle, queries)):
+            if wanted != got:
+                mismatches.append([name, search_mode] + query)
+        checked += len(queries)
+    return checked, mismatches
+
+
+@pytest.mark.parametrize('name', ['shipped', 'synthetic'])
+def test_browser_engine_matches_server(request, name):
+    data = request.getfixturevalue(name + '_catalogue')
+    checked, mismatches = check(name, data, CASES, random.Random(0))
+    assert checked and mismatches == []
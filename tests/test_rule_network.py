@@ -0,0 +1,76 @@
+# Parity tests: the declarative reference rule set, compiled into a rule
+# network, against the advisor's built-in rule pipeline.
+#
+# Random queries (symptom sets, search text, both rankings, full lists and
+# pages) are run through LivestockHealthAdvisor and through RuleBasedAdvisor
+# with REFERENCE_RULES, in both search modes, on the shipped catalogue and a
+# synthetic one. The results -- diseases, their order, matching symptoms,
+# coverage, probability, urgency and severity score -- must be identical.
+# Each query is also replayed on one RuleSession by asserting the changed
+# facts, which must give what a fresh session gives.
+
+import random
+
+import pytest
+
+from engine import LivestockHealthAdvisor, RuleBasedAdvisor
+
+CASES = 200
+
+SEARCH_TEXTS = ['', '', 'fever', 'viral', 'fev', 'milk', 'respiratory disease', 'term1', 'zzz']
+
+
+def summary(match):
+    probability = None if match.probability is None else round(match.probability, 12)
+    coverage = round(match.symptom_coverage, 9)
+    return (match.disease.id, match.matching_symptoms, coverage, probability, match.urgent, match.severity_score)
+
+
+def random_query(rng, catalogue, animal_type):
+    vocabulary = sorted(catalogue.symptom_bits[animal_type])
+    selected = rng.sample(vocabulary, min(len(vocabulary), rng.randint(0, 4))) if vocabulary else []
+    if rng.random() < 0.1:
+        selected.append('no such symptom')
+    return selected, rng.choice(SEARCH_TEXTS), rng.choice(LivestockHealthAdvisor.RANKINGS)
+
+
+def check(name, data, cases, rng):
+    checked = 0
+    mismatches = []
+    for search_mode in ('index', 'substring'):
+        expected_advisor = LivestockHealthAdvisor(*data, cache_size=0, search_mode=search_mode)
+        rule_advisor = RuleBasedAdvisor(*data, cache_size=0, search_mode=search_mode)
+        for animal_type in rule_advisor.catalogue.diseases:
+            network = rule_advisor.catalogue.rule_networks[animal_type]
+            session = network.session()
+            for _ in range(cases):
+                selected, search_text, ranking = random_query(rng, rule_advisor.catalogue, animal_type)
+                case = (name, search_mode, animal_type, selected, search_text, ranking)
+
+                expected = expected_advisor.evaluate_rules(animal_type, selected, search_text, ranking=ranking)
+                actual = rule_advisor.evaluate_rules(animal_type, selected, search_text, ranking=ranking)
+                if [summary(match) for match in expected] != [summary(match) for match in actual]:
+                    mismatches.append(case + ('full',))
+
+                offset, limit = rng.choice([0, 0, 5, 20]), rng.choice([1, 10, 20])
+                expected = expected_advisor.evaluate_page(animal_type, selected, search_text, ranking=ranking,
+                                                          offset=offset, limit=limit)
+                actual = rule_advisor.evaluate_page(animal_type, selected, search_text, ranking=ranking,
+                                                    offset=offset, limit=limit)
+                if (expected.total != actual.total or
+                        [summary(match) for match in expected.results] != [summary(match) for match in actual.results]):
+                    mismatches.append(case + ('page %d+%d' % (offset, limit),))
+
+                session.assert_facts(selected=selected, search_text=search_text, ranking=ranking)
+                fresh = network.session(selected, search_text, ranking)
+                if session.masks != fresh.masks:
+                    mismatches.append(case + ('incremental',))
+                checked += 1
+    return checked, mismatches
+
+
+@pytest.mark.parametrize('name', ['shipped', 'synthetic'])
+def test_rule_network_matches_advisor(request, name):
+    data = request.getfixturevalue(name + '_catalogue')
+    checked, mismatches = check(name, data, CASES, random.Random(0))
+    assert checked and mismatches == []
@@ -0,0 +1,157 @@
+# Tests of outbreak surveillance: counting, alerts and what the aggregator
+# thread may touch.
+
+import json
+import logging
+import os
+import threading
+
+import pytest
+
+from engine import LivestockHealthAdvisor, OutbreakMonitor
+from metrics import Instrumentation, LogSink
+
+BUCKET = 300
+
+
+# Each counting test runs against counts kept in memory and in a database
+@pytest.fixture(params=['memory', 'shared'])
+def path(request, tmp_path):
+    return None if request.param == 'memory' else str(tmp_path / 'surveillance.sqlite3')
+
+
+class Case:
+    def __init__(self, name, severity='High'):
+        self.name = name
+        self.severity = severity
+
+
+# Records the thread of every observation
+class ThreadRecorder:
+    def __init__(self):
+        self.threads = []
+
+    def observe(self, kind, name, seconds, input_size=None, output_size=None):
+        self.threads.append(threading.current_thread().name)
+
+    def request_started(self):
+        pass
+
+    def request_finished(self):
+        pass
+
+
+def test_aggregator_records_no_request_metrics(shipped_catalogue, caplog):
+    advisor = LivestockHealthAdvisor(*shipped_catalogue, cache_size=0)
+    recorder = ThreadRecorder()
+    advisor.instrumentation = Instrumentation([LogSink(logging.getLogger('test.metrics')), recorder])
+    monitor = OutbreakMonitor()
+
+    with caplog.at_level(logging.INFO, logger='test.metrics'):
+        advisor.instrumentation.request_started()
+        results = advisor.search_diseases('cattle', ['coughing', 'fever'], '')
+        observed = len(recorder.threads)
+        monitor.submit('cattle', results[0].disease, region='North')
+        monitor.flush()
+        advisor.instrumentation.request_finished()
+
+    assert monitor.stats()['recorded'] == 1
+    # Only the request's own rules were observed, all on its thread
+    assert recorder.threads == [threading.current_thread().name] * observed
+    logged = [json.loads(record.getMessage()) for record in caplog.records if record.name == 'test.metrics']
+    assert len(logged) == 1 and len(logged[0]['events']) == observed
+
+
+def test_counts_all_region_and_regional_series(path):
+    monitor = OutbreakMonitor(bucket_seconds=BUCKET, path=path)
+    for region in ('North', ' north ', 'South', None):
+        monitor.submit('cattle', Case('Mastitis'), region=region, timestamp=1000 * BUCKET)
+    monitor.flush()
+
+    rows = monitor.snapshot(timestamp=1000 * BUCKET)
+    assert [(row['disease'], row['region'], row['count']) for row in rows] == [('Mastitis', None, 4)]
+    rows = monitor.snapshot(region='*', timestamp=1000 * BUCKET)
+    assert [(row['region'], row['count']) for row in rows] == [('north', 2), ('south', 1)]
+
+
+def test_old_buckets_leave_the_window(path):
+    monitor = OutbreakMonitor(bucket_seconds=BUCKET, window_seconds=2 * BUCKET, history_seconds=10 * BUCKET,
+                              path=path)
+    monitor.record('cattle', 'Mastitis', False, None, 1000 * BUCKET)
+    monitor.record('cattle', 'Mastitis', False, None, 1001 * BUCKET)
+    assert monitor.snapshot(timestamp=1001 * BUCKET)[0]['count'] == 2
+    assert monitor.snapshot(timestamp=1002 * BUCKET)[0]['count'] == 1
+    # Out of the window, still part of the baseline
+    row = monitor.snapshot(timestamp=1005 * BUCKET)[0]
+    assert row['count'] == 0 and row['baseline'] == pytest.approx(2 * 2 / 8)
+    # Past the history, gone
+    assert monitor.snapshot(timestamp=1020 * BUCKET) == []
+
+
+def test_reportable_spike_alerts_once(path):
+    monitor = OutbreakMonitor(bucket_seconds=BUCKET, alert_count=3, path=path)
+    alerts = []
+    monitor.listeners.append(alerts.append)
+    for _ in range(6):
+        monitor.record('cattle', 'Anthrax', True, 'north', 1000 * BUCKET)
+        monitor.record('cattle', 'Mastitis', False, 'north', 1000 * BUCKET)
+
+    assert [(alert['disease'], alert['region'], alert['count']) for alert in alerts] == [
+        ('Anthrax', None, 3), ('Anthrax', 'north', 3)]
+    assert monitor.alerts() == alerts[::-1]
+
+
+def test_least_recently_updated_series_are_dropped(path):
+    monitor = OutbreakMonitor(bucket_seconds=BUCKET, max_series=2, path=path)
+    for name in ('A', 'B', 'A', 'C'):
+        monitor.record('goat', name, False, None, 1000 * BUCKET)
+    assert sorted(row['disease'] for row in monitor.snapshot(timestamp=1000 * BUCKET)) == ['A', 'C']
+
+
+def test_full_queue_drops_events(path):
+    monitor = OutbreakMonitor(queue_size=1, path=path)
+    blocker = threading.Event()
+    monitor.listeners.append(lambda alert: blocker.wait())
+    # Hold the aggregator on an alert so the queue fills up
+    monitor.alert_count = 1
+    monitor.submit('cattle', Case('Anthrax', 'Reportable'))
+    for _ in range(20):
+        monitor.submit('cattle', Case('Mastitis'))
+    blocker.set()
+    monitor.flush()
+    assert monitor.dropped > 0
+    assert monitor.recorded + monitor.dropped == monitor.submitted == 21
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="needs fork")
+def test_workers_share_counts_and_alerts(tmp_path):
+    # Like pre-forked workers: each process counts part of a spike that none
+    # of them sees enough of alone
+    monitor = OutbreakMonitor(bucket_seconds=BUCKET, alert_count=5, path=str(tmp_path / 'surveillance.sqlite3'))
+    children = []
+    for _ in range(4):
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                for _ in range(2):
+                    monitor.submit('cattle', Case('Anthrax', 'Reportable'), timestamp=1000 * BUCKET)
+                monitor.flush()
+                status = 0
+            finally:
+                os._exit(status)
+        children.append(pid)
+    for pid in children:
+        assert os.waitpid(pid, 0)[1] == 0
+
+    [row] = monitor.snapshot(timestamp=1000 * BUCKET)
+    assert row['count'] == 8 and row['alerting']
+    assert [(alert['disease'], alert['count']) for alert in monitor.alerts()] == [('Anthrax', 5)]
+    stats = monitor.stats()
+    assert stats['submitted'] == stats['recorded'] == 8 and stats['dropped'] == 0
+
+
+def test_unopenable_path_keeps_counts_in_memory(tmp_path):
+    monitor = OutbreakMonitor(bucket_seconds=BUCKET, path=str(tmp_path / 'missing' / 'surveillance.sqlite3'))
+    monitor.record('cattle', 'Mastitis', False, None, 1000 * BUCKET)
+    assert monitor.snapshot(timestamp=1000 * BUCKET)[0]['count'] == 1